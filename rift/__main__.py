@@ -5,7 +5,9 @@ import os
 import config
 import constants
 import engine
+import packet_codec
 import packet_common
+import shard
 
 def log_level(string):
     string = string.lower()
@@ -23,6 +25,36 @@ def log_level(string):
         msg = "{} is not a valid log level".format(string)
         raise argparse.ArgumentTypeError(msg)
 
+def positive_int(string):
+    try:
+        value = int(string)
+    except ValueError:
+        value = 0
+    if value < 1:
+        msg = "{} is not a positive integer".format(string)
+        raise argparse.ArgumentTypeError(msg)
+    return value
+
+def percentage(string):
+    try:
+        value = float(string)
+    except ValueError:
+        value = -1.0
+    if not 0.0 <= value <= 100.0:
+        msg = "{} is not a percentage between 0 and 100".format(string)
+        raise argparse.ArgumentTypeError(msg)
+    return value
+
+def non_negative_float(string):
+    try:
+        value = float(string)
+    except ValueError:
+        value = -1.0
+    if value < 0.0:
+        msg = "{} is not a non-negative number".format(string)
+        raise argparse.ArgumentTypeError(msg)
+    return value
+
 def parse_command_line_arguments():
     parser = argparse.ArgumentParser(description='Routing In Fat Trees (RIFT) protocol engine')
     parser.add_argument(
@@ -62,7 +94,51 @@ def parse_command_line_arguments():
     parser.add_argument(
         '--ipv6-multicast-loopback-disable', action="store_true",
         help='Disable IPv6 loopback on multicast send sockets')
+    parser.add_argument(
+        '--rx-batch-size',
+        type=positive_int,
+        default=constants.DEFAULT_RX_BATCH_SIZE,
+        help='Maximum number of packets received from a socket in one go')
+    parser.add_argument(
+        '--event-loop',
+        choices=constants.EVENT_LOOPS,
+        default=constants.DEFAULT_EVENT_LOOP,
+        help='Event loop (select is the default; asyncio uses uvloop if it is installed)')
+    parser.add_argument(
+        '--codec',
+        choices=constants.CODECS,
+        default=constants.DEFAULT_CODEC,
+        help='Protocol packet codec (fast uses the Thrift C extension if it is available; '
+             'python is the fallback)')
+    parser.add_argument(
+        '--lazy-tie-decode',
+        action="store_true",
+        help='Only decode the element of a received TIE when it is needed')
+    parser.add_argument(
+        '--multi-process',
+        action="store_true",
+        help='Run each shard in its own worker process')
+    parser.add_argument(
+        '--pin-cpus',
+        action="store_true",
+        help='Pin each shard worker process to its own CPU (requires --multi-process)')
+    parser.add_argument(
+        '--in-memory-links',
+        action="store_true",
+        help='Deliver packets between simulated interfaces in memory instead of using sockets')
+    parser.add_argument(
+        '--link-loss',
+        type=percentage,
+        default=constants.DEFAULT_LINK_LOSS_PERCENT,
+        help='Percentage of packets randomly lost on in-memory links')
+    parser.add_argument(
+        '--link-delay',
+        type=non_negative_float,
+        default=constants.DEFAULT_LINK_DELAY_SECS,
+        help='Delay in seconds for delivering packets on in-memory links')
     args = parser.parse_args()
+    if args.in_memory_links and args.multi_process:
+        parser.error("--in-memory-links cannot be used with --multi-process")
     return args
 
 def parse_environment_variables(args):
@@ -93,6 +169,25 @@ def main():
     parse_environment_variables(args)
     parsed_config = config.parse_configuration(args.configfile)
     packet_common.add_missing_methods_to_thrift()
+    # Select the codec before the worker processes are forked in multi-process mode
+    packet_codec.select_codec(args.codec)
+    packet_codec.set_lazy_tie_decode(args.lazy_tie_decode)
+    if args.multi_process:
+        front_end = shard.ShardFrontEnd(
+            interactive=args.interactive,
+            telnet_port_file=args.telnet_port_file,
+            log_level=args.log_level,
+            config=parsed_config,
+            pin_cpus=args.pin_cpus,
+            engine_args={
+                'run_which_nodes': run_which_nodes(args),
+                'passive_nodes': args.passive_nodes,
+                'ipv4_multicast_loopback': ipv4_multicast_loopback(args),
+                'ipv6_multicast_loopback': ipv6_multicast_loopback(args),
+                'rx_batch_size': args.rx_batch_size,
+                'event_loop': args.event_loop})
+        front_end.run()
+        return
     eng = engine.Engine(run_which_nodes=run_which_nodes(args),
                         passive_nodes=args.passive_nodes,
                         interactive=args.interactive,
@@ -100,7 +195,12 @@ def main():
                         ipv4_multicast_loopback=ipv4_multicast_loopback(args),
                         ipv6_multicast_loopback=ipv6_multicast_loopback(args),
                         log_level=args.log_level,
-                        config=parsed_config)
+                        config=parsed_config,
+                        rx_batch_size=args.rx_batch_size,
+                        event_loop=args.event_loop,
+                        in_memory_links=args.in_memory_links,
+                        link_loss_percent=args.link_loss,
+                        link_delay=args.link_delay)
     eng.run()
 
 if __name__ == "__main__":
@@ -12,6 +12,17 @@ DEFAULT_LIE_IPV6_MCAST_ADDRESS = 'FF02::0078'
 DEFAULT_LIE_SEND_INTERVAL_SECS = 1.0
 DEFAULT_FLOODING_REDUCTION_REDUNDANCY = 2
 DEFAULT_FLOODING_REDUCTION_SIMILARITY = 2
+DEFAULT_RX_BATCH_SIZE = 32
+EVENT_LOOP_ASYNCIO = 'asyncio'
+EVENT_LOOP_SELECT = 'select'
+EVENT_LOOPS = [EVENT_LOOP_ASYNCIO, EVENT_LOOP_SELECT]
+DEFAULT_EVENT_LOOP = EVENT_LOOP_SELECT
+CODEC_FAST = 'fast'
+CODEC_PYTHON = 'python'
+CODECS = [CODEC_FAST, CODEC_PYTHON]
+DEFAULT_CODEC = CODEC_FAST
+DEFAULT_LINK_LOSS_PERCENT = 0.0
+DEFAULT_LINK_DELAY_SECS = 0.0
 if RUN_AS_ROOT:
     DEFAULT_LIE_PORT = common.constants.default_lie_udp_port
     DEFAULT_TIE_PORT = common.constants.default_tie_udp_flood_port
@@ -10,10 +10,14 @@ import sortedcontainers
 import cli_listen_handler
 import cli_session_handler
 import constants
+import fsm
 import interface
 import key
+import memory_transport
 import netifaces
 import node
+import packet_codec
+import profiler
 import scheduler
 import stats
 import table
@@ -41,23 +45,37 @@ def restore_terminal():
         termios.tcsetattr(sys.stdin, termios.TCSADRAIN, OLD_TERMINAL_SETTINGS)
         OLD_TERMINAL_SETTINGS = None
 
+def log_file_name():
+    file_name = "rift.log"  # TODO: Make this configurable
+    if "RIFT_TEST_RESULTS_DIR" in os.environ:
+        file_name = os.environ["RIFT_TEST_RESULTS_DIR"] + "/" + file_name
+    return file_name
+
 class Engine:
 
     def __init__(self, passive_nodes, run_which_nodes, interactive, telnet_port_file,
-                 ipv4_multicast_loopback, ipv6_multicast_loopback, log_level, config):
+                 ipv4_multicast_loopback, ipv6_multicast_loopback, log_level, config,
+                 rx_batch_size=constants.DEFAULT_RX_BATCH_SIZE,
+                 event_loop=constants.DEFAULT_EVENT_LOOP, shard_ids=None, in_memory_links=False,
+                 link_loss_percent=constants.DEFAULT_LINK_LOSS_PERCENT,
+                 link_delay=constants.DEFAULT_LINK_DELAY_SECS):
         # pylint:disable=too-many-statements
-        log_file_name = "rift.log"  # TODO: Make this configurable
-        if "RIFT_TEST_RESULTS_DIR" in os.environ:
-            log_file_name = os.environ["RIFT_TEST_RESULTS_DIR"] + "/" + log_file_name
         logging.basicConfig(
-            filename=log_file_name,
+            filename=log_file_name(),
             format='%(asctime)s:%(levelname)s:%(name)s:%(message)s',
             level=log_level)
+        # The asyncio event loop logs its own debug messages, which are not in the RIFT log format
+        logging.getLogger('asyncio').setLevel(max(log_level, logging.INFO))
         self._run_which_nodes = run_which_nodes
         self._interactive = interactive
         self._telnet_port_file = telnet_port_file
         self.ipv4_multicast_loopback = ipv4_multicast_loopback
         self.ipv6_multicast_loopback = ipv6_multicast_loopback
+        self.rx_batch_size = rx_batch_size
+        self.event_loop = event_loop
+        # In multi-process mode (see shard.py) each worker process runs an engine for a subset of
+        # the shards (shard_ids) and the CLI runs in the parent process. None means all shards.
+        self.shard_ids = shard_ids
         self._config = config
         if self.nr_nodes() > 1:
             self._stand_alone = False
@@ -67,6 +85,13 @@ class Engine:
             self._stand_alone = True
             self.simulated_interfaces = False
             self.physical_interface_name = None
+        # In-memory links only make sense for simulated interfaces: all nodes must be in this
+        # process (see memory_transport.py)
+        self.in_memory_links = in_memory_links and self.simulated_interfaces
+        self.link_loss_percent = link_loss_percent
+        self.link_delay = link_delay
+        if self.in_memory_links:
+            memory_transport.MEMORY_TRANSPORT.configure(link_loss_percent, link_delay)
         self.tx_src_address = self.read_global_configuration(config, 'tx_src_address', '')
         self.floodred_enabled = self.read_global_configuration(config, 'flooding_reduction', True)
         self.floodred_redundancy = self.read_global_configuration(
@@ -82,6 +107,7 @@ class Engine:
         self.intf_security_stats_group = stats.Group()
         self.intf_lie_fsm_stats_group = stats.Group()
         self.node_ztp_fsm_stats_group = stats.Group()
+        self._profiler = profiler.Profiler()
         self.keys = {}    # Indexed by key-id
         self.keys[0] = key.Key(key_id=0, algorithm="null", secret="")
         self._nodes = sortedcontainers.SortedDict()
@@ -91,7 +117,10 @@ class Engine:
             first_node = self._nodes.peekitem(0)[1]
         else:
             first_node = None
-        if self._interactive:
+        if self.shard_ids is not None:
+            self._cli_listen_handler = None
+            self._interactive_cli_session_handler = None
+        elif self._interactive:
             make_terminal_unbuffered()
             self._cli_listen_handler = None
             self._interactive_cli_session_handler = cli_session_handler.CliSessionHandler(
@@ -181,6 +210,10 @@ class Engine:
 
     def create_shard(self, shard_config, passive_nodes):
         if 'nodes' in shard_config:
+            if (self.shard_ids is not None) and (shard_config['id'] not in self.shard_ids):
+                # The nodes in this shard run in another process
+                node.Node.skip_node_nrs(len(shard_config['nodes']))
+                return
             for node_config in shard_config['nodes']:
                 if 'name' in node_config:
                     force_passive = node_config['name'] in passive_nodes
@@ -192,14 +225,26 @@ class Engine:
         new_node = node.Node(node_config, self, force_passive, self._stand_alone)
         self._nodes[new_node.name] = new_node
 
+    def node_names(self):
+        return list(self._nodes.keys())
+
+    def node_by_name(self, node_name):
+        return self._nodes.get(node_name)
+
     def run(self):
-        scheduler.SCHEDULER.run()
+        if self.event_loop == constants.EVENT_LOOP_SELECT:
+            scheduler.SCHEDULER.run()
+        else:
+            assert self.event_loop == constants.EVENT_LOOP_ASYNCIO
+            scheduler.SCHEDULER.run_asyncio()
 
     def command_clear_engine_stats(self, _cli_session):
         self.intf_traffic_stats_group.clear()
         self.intf_security_stats_group.clear()
         self.intf_lie_fsm_stats_group.clear()
         self.node_ztp_fsm_stats_group.clear()
+        scheduler.SCHEDULER.clear_loop_stats()
+        fsm.Fsm.clear_latency_stats()
 
     def command_clear_intf_stats(self, cli_session, parameters):
         cli_session.current_node.command_clear_intf_stats(cli_session, parameters)
@@ -216,6 +261,16 @@ class Engine:
         tab.add_row(["Telnet Port File", self._telnet_port_file])
         tab.add_row(["IPv4 Multicast Loopback", self.ipv4_multicast_loopback])
         tab.add_row(["IPv6 Multicast Loopback", self.ipv6_multicast_loopback])
+        tab.add_row(["Receive Batch Size", self.rx_batch_size])
+        tab.add_row(["Event Loop", self.event_loop])
+        tab.add_row(["Packet Codec", packet_codec.selected_codec()])
+        tab.add_row(["Lazy TIE Decode", packet_codec.lazy_tie_decode()])
+        tab.add_row(["In-Memory Links", self.in_memory_links])
+        if self.in_memory_links:
+            tab.add_row(["Link Loss Percent", self.link_loss_percent])
+            tab.add_row(["Link Delay", self.link_delay])
+        if self.shard_ids is not None:
+            tab.add_row(["Shards", ", ".join(str(shard_id) for shard_id in self.shard_ids)])
         tab.add_row(["Number of Nodes", self.nr_nodes()])
         tab.add_row(["Transmit Source Address", self.tx_src_address])
         tab.add_row(["Flooding Reduction Enabled", self.floodred_enabled])
@@ -224,6 +279,11 @@ class Engine:
         tab.add_row(["Flooding Reduction System Random", self.floodred_system_random])
         cli_session.print(tab.to_string())
 
+    def command_show_engine_loop(self, cli_session):
+        cli_session.print("Event Loop Latency:")
+        tab = scheduler.SCHEDULER.loop_stats_table()
+        cli_session.print(tab.to_string())
+
     def command_show_engine_stats(self, cli_session, exclude_zero=False):
         cli_session.print("All Node ZTP FSMs:")
         tab = self.node_ztp_fsm_stats_group.table(exclude_zero)
@@ -292,6 +352,14 @@ class Engine:
     def command_show_kernel_routes_pref(self, cli_session, parameters):
         cli_session.current_node.command_show_kernel_routes_pref(cli_session, parameters)
 
+    def command_show_fsm_latency(self, cli_session):
+        cli_session.print("FSM Event Processing Latency:")
+        tab = fsm.Fsm.latency_table()
+        cli_session.print(tab.to_string())
+        cli_session.print("FSM Event Queues:")
+        tab = fsm.Fsm.event_queues_table()
+        cli_session.print(tab.to_string())
+
     def command_show_lie_fsm(self, cli_session):
         interface.Interface.fsm_definition.command_show_fsm(cli_session)
 
@@ -389,10 +457,19 @@ class Engine:
     def command_help(self, cli_session):
         cli_session.help()
 
+    def command_start_profiling(self, cli_session):
+        self._profiler.command_start(cli_session)
+
+    def command_start_profiling_file(self, cli_session, parameters):
+        self._profiler.command_start(cli_session, parameters['file'])
+
     def command_stop(self, cli_session):
         cli_session.close()
         sys.exit(0)
 
+    def command_stop_profiling(self, cli_session):
+        self._profiler.command_stop(cli_session)
+
     parse_tree = {
         "clear": {
             "engine": {
@@ -417,6 +494,7 @@ class Engine:
         "show": {
             "engine": {
                 "": command_show_engine,
+                "loop": command_show_engine_loop,
                 "statistics": {
                     "": command_show_engine_stats,
                     "exclude-zero": command_show_eng_stats_ex_zero
@@ -429,6 +507,7 @@ class Engine:
                 "$family": command_show_forwarding_family,
             },
             "fsm": {
+                "latency": command_show_fsm_latency,
                 "lie": command_show_lie_fsm,
                 "ztp": command_show_ztp_fsm,
             },
@@ -493,7 +572,16 @@ class Engine:
             },
             "tie-db": command_show_tie_db,
         },
-        "stop": command_stop,
+        "start": {
+            "profiling": {
+                "": command_start_profiling,
+                "$file": command_start_profiling_file
+            }
+        },
+        "stop": {
+            "": command_stop,
+            "profiling": command_stop_profiling
+        }
     }
 
     @property
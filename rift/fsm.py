@@ -1,4 +1,6 @@
 import collections
+import enum
+import logging
 import time
 
 import sortedcontainers
@@ -50,6 +52,29 @@ class FsmDefinition:
             self.verbose_events = []
         else:
             self.verbose_events = verbose_events
+        self.verbose_events_set = frozenset(self.verbose_events)
+        self.dispatch_table = self._compile_dispatch_table()
+
+    def _compile_dispatch_table(self):
+        # Compile the transitions into a single table indexed by (from_state, event), so that
+        # processing an event is one dictionary lookup. Each entry is a tuple (to_state, actions,
+        # push_events, exit_actions, entry_actions) where the state exit and entry actions are
+        # already resolved (and empty if the transition does not change the state). Missing
+        # entries are implicit transitions.
+        dispatch_table = {}
+        for from_state, from_state_transitions in self.transitions.items():
+            for event, transition in from_state_transitions.items():
+                (to_state, actions, push_events) = FsmDefinition.parse_transition(transition)
+                if to_state is None or to_state == from_state:
+                    exit_actions = ()
+                    entry_actions = ()
+                else:
+                    exit_actions = tuple(self.state_actions.get(from_state, ((), ()))[1])
+                    entry_actions = tuple(self.state_actions.get(to_state, ((), ()))[0])
+                dispatch_table[(from_state, event)] = (to_state, tuple(actions),
+                                                       tuple(push_events), exit_actions,
+                                                       entry_actions)
+        return dispatch_table
 
     @staticmethod
     def parse_transition(transition):
@@ -172,6 +197,13 @@ class FsmDefinition:
 
 class FsmRecord:
 
+    # A record is created for every processed event, so it is kept as cheap as possible: the
+    # actions and pushed events are stored as is (action functions and event enums) and are only
+    # converted to names when the record is logged or shown in a history table.
+
+    __slots__ = ['fsm', 'seq_nr', 'time', 'skipped', 'from_state', 'event', 'verbose',
+                 'actions_and_pushed_event_objects', 'to_state', 'implicit']
+
     _next_seq_nr = 1
 
     def __init__(self, fsm, from_state, event, verbose):
@@ -183,10 +215,20 @@ class FsmRecord:
         self.from_state = from_state
         self.event = event
         self.verbose = verbose
-        self.actions_and_pushed_events = []
+        self.actions_and_pushed_event_objects = []
         self.to_state = None
         self.implicit = False
 
+    @property
+    def actions_and_pushed_events(self):
+        names = []
+        for action_or_event in self.actions_and_pushed_event_objects:
+            if isinstance(action_or_event, enum.Enum):
+                names.append(action_or_event.name)
+            else:
+                names.append(_action_to_name(action_or_event))
+        return names
+
     def log_str(self):
         log_msg = ("FSM transition sequence-nr={} from-state={} event={} "
                    "actions-and-pushed-events={} to-state={} implicit={}").format(
@@ -206,16 +248,34 @@ class Fsm:
 
     _chained_event_queue = collections.deque()
 
+    # Event processing latency histograms (indexed by event) and event queue high-water marks,
+    # shared by all FSM instances (see show fsm latency)
+
+    _latency_histograms = {}
+
+    _event_queue_high_water = 0
+
+    _chained_event_queue_high_water = 0
+
     def info(self, msg, *args):
-        if self._log:
+        if self._log and self._log.isEnabledFor(logging.INFO):
             self._log.info("[%s] %s" % (self._log_id, msg), *args)
 
     def info_or_debug(self, debug, msg, *args):
         if self._log:
             if debug:
-                self._log.debug("[%s] %s" % (self._log_id, msg), *args)
+                level = logging.DEBUG
             else:
-                self._log.info("[%s] %s" % (self._log_id, msg), *args)
+                level = logging.INFO
+            if self._log.isEnabledFor(level):
+                self._log.log(level, "[%s] %s" % (self._log_id, msg), *args)
+
+    def _will_log(self, debug):
+        if not self._log:
+            return False
+        if debug:
+            return self._log.isEnabledFor(logging.DEBUG)
+        return self._log.isEnabledFor(logging.INFO)
 
     def __init__(self, definition, action_handler, log, log_id, sum_stats_group=None):
         self._definition = definition
@@ -225,7 +285,8 @@ class Fsm:
         self._event_enum = definition.event_enum
         self._transitions = definition.transitions
         self._state_actions = definition.state_actions
-        self._verbose_events = definition.verbose_events
+        self._verbose_events = definition.verbose_events_set
+        self._dispatch_table = definition.dispatch_table
         self._state = None
         self._action_handler = action_handler
         self._records = collections.deque([], _MAX_RECORDS)
@@ -237,6 +298,7 @@ class Fsm:
         self._init_event_counters()             # Indexed by event
         self._transition_counters = {}          # Indexed by (from_state, to_state)
         self._event_transition_counters = {}    # Indexed by (from_state, event, to_state)
+        self._record_counters = {}              # Indexed by (from_state, event, to_state)
         self.info("Create FSM")
 
     def _init_event_counters(self):
@@ -262,12 +324,20 @@ class Fsm:
             # FSM instance, hence it is a chained event. (This logic only holds in a single-threaded
             # application, which is what we currently have.)
             self._chained_event_queue.append(event_tuple)
-            self._current_record.actions_and_pushed_events.append(event.name)
+            Fsm._chained_event_queue_high_water = max(Fsm._chained_event_queue_high_water,
+                                                      len(Fsm._chained_event_queue))
+            self._current_record.actions_and_pushed_event_objects.append(event)
         else:
             # Normal (external) event
             self._event_queue.append(event_tuple)
+            Fsm._event_queue_high_water = max(Fsm._event_queue_high_water, len(Fsm._event_queue))
             verbose = (event in self._verbose_events)
-            self.info_or_debug(verbose, "FSM push event, event=%s", event.name)
+            if self._will_log(verbose):
+                self.info_or_debug(verbose, "FSM push event, event=%s", event.name)
+
+    @staticmethod
+    def has_queued_events():
+        return bool(Fsm._chained_event_queue or Fsm._event_queue)
 
     @staticmethod
     def process_queued_events():
@@ -281,12 +351,56 @@ class Fsm:
             fsm = event_tuple[0]
             event = event_tuple[1]
             event_data = event_tuple[2]
+            start_time = time.perf_counter()
             fsm.process_event(event, event_data)
+            histogram = Fsm._latency_histograms.get(event)
+            if histogram is None:
+                histogram = Fsm._create_latency_histogram(event)
+            histogram.record(time.perf_counter() - start_time)
+
+    @staticmethod
+    def _create_latency_histogram(event):
+        # The event enums are nested in the class that owns the FSM (e.g. Interface.Event)
+        qualified_name = type(event).__qualname__.split('.')
+        if len(qualified_name) > 1:
+            fsm_name = qualified_name[-2]
+        else:
+            fsm_name = qualified_name[0]
+        histogram = stats.Histogram(fsm_name + " " + event.name)
+        Fsm._latency_histograms[event] = histogram
+        return histogram
+
+    @staticmethod
+    def latency_table():
+        tab = table.Table()
+        tab.add_row(["FSM", "Event"] + stats.Histogram.table_headers())
+        histograms = sorted(Fsm._latency_histograms.values(),
+                            key=lambda histogram: histogram.description())
+        for histogram in histograms:
+            (fsm_name, event_name) = histogram.description().split(' ')
+            tab.add_row([fsm_name, event_name] + histogram.table_cells())
+        return tab
+
+    @staticmethod
+    def event_queues_table():
+        tab = table.Table()
+        tab.add_row(["Queue", ["Current", "Length"], ["High-Water", "Mark"]])
+        tab.add_row(["Events", len(Fsm._event_queue), Fsm._event_queue_high_water])
+        tab.add_row(["Chained Events", len(Fsm._chained_event_queue),
+                     Fsm._chained_event_queue_high_water])
+        return tab
+
+    @staticmethod
+    def clear_latency_stats():
+        Fsm._latency_histograms = {}
+        Fsm._event_queue_high_water = len(Fsm._event_queue)
+        Fsm._chained_event_queue_high_water = len(Fsm._chained_event_queue)
 
     def invoke_actions(self, actions, event_data=None):
+        record = self._current_record
         for action in actions:
-            if self._current_record:
-                self._current_record.actions_and_pushed_events.append(_action_to_name(action))
+            if record:
+                record.actions_and_pushed_event_objects.append(action)
             if event_data:
                 action(self._action_handler, event_data)
             else:
@@ -302,6 +416,29 @@ class Fsm:
             (_, state_exit_actions) = self._state_actions[state]
             self.invoke_actions(state_exit_actions)
 
+    def _create_record_counters(self, from_state, event, to_state):
+        # We create the counters on the fly the first time a particular transition has been seen
+        # to avoid having N^2 counters where N is the number of states.
+        pair = (from_state, to_state)
+        if pair not in self._transition_counters:
+            description = "Transitions {} -> {}".format(_state_to_name(from_state),
+                                                        _state_to_name(to_state))
+            self._transition_counters[pair] = stats.Counter(self._stats_group,
+                                                            description,
+                                                            "Transition")
+        triple = (from_state, event, to_state)
+        if triple not in self._event_transition_counters:
+            description = ("Event-Transitions {} -[{}]-> {}"
+                           .format(_state_to_name(from_state),
+                                   _event_to_name(event),
+                                   _state_to_name(to_state)))
+            self._event_transition_counters[triple] = stats.Counter(self._stats_group,
+                                                                    description,
+                                                                    "Transition")
+        counters = (self._transition_counters[pair], self._event_transition_counters[triple])
+        self._record_counters[triple] = counters
+        return counters
+
     def store_current_record(self):
         record = self._current_record
         assert record is not None
@@ -312,58 +449,41 @@ class Fsm:
             record.skipped = self._verbose_records_skipped
             self._verbose_records_skipped = 0
             self._records.appendleft(record)
-        # TODO check for will log before calling log_str
-        self.info_or_debug(record.verbose, record.log_str())
-        # Also count the transition for statistics. We create a counter on the fly the first time
-        # a particular transition (from-state, to-state) has been seen to avoid have N^2 counters
-        # where N is the number of states.
+        # Only format the record if it is actually going to be logged
+        if self._will_log(record.verbose):
+            self.info_or_debug(record.verbose, record.log_str())
+        # Also count the transition for statistics.
         to_state = record.to_state
         if to_state is None:
             to_state = record.from_state
-        pair = (record.from_state, to_state)
-        if pair not in self._transition_counters:
-            description = "Transitions {} -> {}".format(_state_to_name(record.from_state),
-                                                        _state_to_name(to_state))
-            self._transition_counters[pair] = stats.Counter(self._stats_group,
-                                                            description,
-                                                            "Transition")
-        self._transition_counters[pair].increase()
         triple = (record.from_state, record.event, to_state)
-        if triple not in self._event_transition_counters:
-            description = ("Event-Transitions {} -[{}]-> {}"
-                           .format(_state_to_name(record.from_state),
-                                   _event_to_name(record.event),
-                                   _state_to_name(to_state)))
-            self._event_transition_counters[triple] = stats.Counter(self._stats_group,
-                                                                    description,
-                                                                    "Transition")
-        self._event_transition_counters[triple].increase()
+        counters = self._record_counters.get(triple)
+        if counters is None:
+            counters = self._create_record_counters(record.from_state, record.event, to_state)
+        counters[0].increase()
+        counters[1].increase()
         self._current_record = None
 
     def process_event(self, event, event_data):
         assert self._current_record is None
         self._event_counters[event].increase()
         from_state = self._state
-        verbose = (event in self._verbose_events)
-        self._current_record = FsmRecord(self, from_state, event, verbose)
-        if from_state in self._transitions:
-            from_state_transitions = self._transitions[from_state]
+        record = FsmRecord(self, from_state, event, event in self._verbose_events)
+        self._current_record = record
+        transition = self._dispatch_table.get((from_state, event))
+        if transition is None:
+            record.implicit = True
         else:
-            from_state_transitions = []
-        if event in from_state_transitions:
-            transition = from_state_transitions[event]
-            (to_state, actions, push_events) = FsmDefinition.parse_transition(transition)
+            (to_state, actions, push_events, exit_actions, entry_actions) = transition
             self.invoke_actions(actions, event_data)
             for push_event in push_events:
                 self.push_event(push_event, None)
             if to_state is not None:
-                self._current_record.to_state = to_state
-                if to_state != self._state:
-                    self.invoke_state_exit_actions(self._state)
+                record.to_state = to_state
+                if to_state != from_state:
+                    self.invoke_actions(exit_actions)
                     self._state = to_state
-                    self.invoke_state_entry_actions(to_state)
-        else:
-            self._current_record.implicit = True
+                    self.invoke_actions(entry_actions)
         self.store_current_record()
 
     def history_table(self, verbose):
@@ -8,11 +8,15 @@ import socket
 
 import constants
 import fsm
+import key
+import memory_transport
 import neighbor
 import offer
 import packet_common
+import rtx_queue
 import stats
 import table
+import tide_cache
 import timer
 import udp_rx_handler
 import utils
@@ -34,9 +38,21 @@ class Interface:
     UNDEFINED_OR_ANY_POD = 0
 
     SERVICE_QUEUES_INTERVAL = 1.0
+    # An unacknowledged TIE is retransmitted after RTX_INITIAL_INTERVAL seconds, and the interval
+    # is doubled after every retransmission, up to RTX_MAX_INTERVAL seconds
+    RTX_INITIAL_INTERVAL = 1.0
+    RTX_MAX_INTERVAL = 16.0
+
+    # Maximum number of TIRE packets sent per service interval, for each of the acknowledge and
+    # request queues. If there are more queued headers than fit in that many MTU-sized TIREs, the
+    # remaining headers are sent in the next interval(s).
+    MAX_TIRES_PER_INTERVAL = 8
 
     INCREASE_TX_NONCE_LOCAL_HOLDDOWN_TIME = 60.0
 
+    # Maximum number of outer fingerprints of sent packets that are cached
+    OUTER_FINGERPRINT_CACHE_SIZE = 1000
+
     def generate_advertised_name(self):
         return self.node.name + ':' + self.name
 
@@ -145,25 +161,19 @@ class Interface:
         # For *receiving* flooding packets, always listen on both IPv4 and also on IPv6 since we
         # don't know whether the same will choose to send on IPv4 or on IPv6
         self.rx_info("Start IPv4 flooding: receive on port %d", rx_flood_port)
-        self._flood_rx_ipv4_handler = udp_rx_handler.UdpRxHandler(
-            interface_name=self.physical_interface_name,
+        self._flood_rx_ipv4_handler = self.create_rx_handler(
             local_port=rx_flood_port,
             ipv4=True,
             multicast_address=None,
             remote_address="0.0.0.0",  # TODO: Permissive... use neighbor address?
-            receive_function=self.receive_flood_message,
-            log=self._rx_log,
-            log_id=self._log_id)
+            receive_function=self.receive_flood_messages)
         self.rx_info("Start IPv6 flooding: receive on port %d", rx_flood_port)
-        self._flood_rx_ipv6_handler = udp_rx_handler.UdpRxHandler(
-            interface_name=self.physical_interface_name,
+        self._flood_rx_ipv6_handler = self.create_rx_handler(
             local_port=rx_flood_port,
             ipv4=False,
             multicast_address=None,
             remote_address="::",
-            receive_function=self.receive_flood_message,
-            log=self._rx_log,
-            log_id=self._log_id)
+            receive_function=self.receive_flood_messages)
         # Periodically start sending TIE packets and TIRE packets
         self._service_queues_timer.start()
         # Update the node TIEs originated by this node to include this neighbor
@@ -180,6 +190,8 @@ class Interface:
         self.rx_info("Stop flooding")
         self._service_queues_timer.stop()
         self.clear_all_queues()
+        self.tide_cache.clear()
+        self.node.forget_received_tides(self)
         if self._flood_rx_ipv4_handler:
             self._flood_rx_ipv4_handler.close()
             self._flood_rx_ipv4_handler = None
@@ -275,19 +287,27 @@ class Interface:
 
     def send_protocol_packet(self, protocol_packet, flood):
         packet_info = packet_common.encode_protocol_packet(protocol_packet, self.active_outer_key)
-        self.send_packet_info(packet_info, flood)
+        # A freshly encoded packet is never sent again, so don't cache its outer fingerprint
+        self.send_packet_info(packet_info, flood, cache_outer_fingerprint=False)
 
-    def send_packet_info(self, packet_info, flood):
+    def send_packet_info(self, packet_info, flood, cache_outer_fingerprint=True):
         # In state oneway, send the undefined nonce as the reflected nonce
         if self.fsm.state == self.State.ONE_WAY:
             nonce_remote = 0
         else:
             nonce_remote = self._last_rx_lie_nonce_local
+        # TIEs and TIDEs are re-sent from the TIE-DB and from the TIDE cache, often with the same
+        # nonces, so their outer fingerprints are cached.
+        if cache_outer_fingerprint:
+            fingerprint_cache = self.outer_fingerprint_cache
+        else:
+            fingerprint_cache = None
         packet_info.update_outer_sec_env_header(
             outer_key=self.active_outer_key,
             nonce_local=self.choose_tx_nonce_local(),
             nonce_remote=nonce_remote,
-            remaining_lifetime=packet_info.remaining_tie_lifetime)
+            remaining_lifetime=packet_info.remaining_tie_lifetime,
+            fingerprint_cache=fingerprint_cache)
         protocol_packet = packet_info.protocol_packet
         if flood:
             if self._flood_tx_ipv4_socket:
@@ -917,6 +937,7 @@ class Interface:
             start=False)
         self._tx_nonce_local_wrapped = False
         self._last_rx_lie_nonce_local = 0
+        self.outer_fingerprint_cache = key.FingerprintCache(self.OUTER_FINGERPRINT_CACHE_SIZE)
         self._time_ticks_since_lie_received = None
         self._lie_accept_or_reject = "No LIE Received"
         self._lie_accept_or_reject_rule = "-"
@@ -928,15 +949,22 @@ class Interface:
         self._flood_tx_ipv6_socket = None
         self._flood_rx_ipv4_handler = None
         self._flood_rx_ipv6_handler = None
-        # The following queues (ties_tx, ties_rtx, ties_req, are ties_ack) are ordered dictionaries.
-        # The value is the header of the TIE. The index is the TIE-ID want to have two headers with
+        # The following queues (ties_tx, ties_req, are ties_ack) are ordered dictionaries. The
+        # value is the header of the TIE. The index is the TIE-ID want to have two headers with
         # same TIE-ID in the queue. The ordering is needed because we want to service the entries
         # in the queue in the same order in which they were added (FIFO).
-        # TODO: For _ties_rtx, add time to retransmit to retransmit queue
+        # The ties_tx queue only holds the TIEs that could not be sent yet. Once a TIE has been
+        # sent it moves to the ties_rtx queue, which is ordered by the time of the next
+        # retransmission instead (see rtx_queue.RetransmitQueue).
         self._ties_tx = collections.OrderedDict()   # Dict of TIEHeader
-        self._ties_rtx = collections.OrderedDict()  # Dict of TIEHeader
+        self._ties_rtx = rtx_queue.RetransmitQueue(self.RTX_INITIAL_INTERVAL,
+                                                   self.RTX_MAX_INTERVAL)
         self._ties_req = collections.OrderedDict()  # Dict of TIEHeaderWithLifeTime
         self._ties_ack = collections.OrderedDict()  # Dict of TIEHeaderWithLifeTime
+        self.tide_cache = tide_cache.TideCache()
+        self._tires_this_interval = 0
+        self._tire_capped_this_interval = False
+        self.clear_tire_stats()
         self.floodred_nbr_is_fr = self.NbrIsFRState.NOT_APPLICABLE
         self.partially_connected = None
         self.partially_connected_causes = None
@@ -1151,34 +1179,62 @@ class Interface:
             multicast_address=self._tx_lie_ipv6_mcast_address,
             port=self._tx_lie_port,
             loopback=self.node.engine.ipv6_multicast_loopback)
-        self._lie_rx_ipv4_handler = udp_rx_handler.UdpRxHandler(
-            interface_name=self.physical_interface_name,
+        self._lie_rx_ipv4_handler = self.create_rx_handler(
             local_port=self._rx_lie_port,
             ipv4=True,
             multicast_address=self._rx_lie_ipv4_mcast_address,
             remote_address=None,
-            receive_function=self.receive_lie_message,
-            log=self._rx_log,
-            log_id=self._log_id)
-        self._lie_rx_ipv6_handler = udp_rx_handler.UdpRxHandler(
-            interface_name=self.physical_interface_name,
+            receive_function=self.receive_lie_messages)
+        self._lie_rx_ipv6_handler = self.create_rx_handler(
             local_port=self._rx_lie_port,
             ipv4=False,
             multicast_address=self._rx_lie_ipv6_mcast_address,
             remote_address=None,
-            receive_function=self.receive_lie_message,
-            log=self._rx_log,
-            log_id=self._log_id)
+            receive_function=self.receive_lie_messages)
         self._flood_rx_ipv4_handler = None
         self._flood_tx_ipv4_socket = None
-        self._one_second_timer = timer.Timer(
-            1.0,
-            lambda: self.fsm.push_event(self.Event.TIMER_TICK))
-        self._service_queues_timer = timer.Timer(
+        self._one_second_timer = timer.GroupTimer(
+            interval=1.0,
+            expire_function=lambda: self.fsm.push_event(self.Event.TIMER_TICK),
+            jitter_key=self._log_id)
+        self._service_queues_timer = timer.GroupTimer(
             interval=self.SERVICE_QUEUES_INTERVAL,
             expire_function=self.service_queues,
-            periodic=True,
-            start=False)
+            start=False,
+            jitter_key=self._log_id)
+
+    def create_rx_handler(self, local_port, ipv4, multicast_address, remote_address,
+                          receive_function):
+        if self._engine.in_memory_links:
+            return memory_transport.MemoryRxHandler(
+                transport=memory_transport.MEMORY_TRANSPORT,
+                local_address=self.memory_link_address(ipv4),
+                local_port=local_port,
+                ipv4=ipv4,
+                multicast_address=multicast_address,
+                receive_function=receive_function)
+        return udp_rx_handler.UdpRxHandler(
+            interface_name=self.physical_interface_name,
+            local_port=local_port,
+            ipv4=ipv4,
+            multicast_address=multicast_address,
+            remote_address=remote_address,
+            receive_function=receive_function,
+            log=self._rx_log,
+            log_id=self._log_id,
+            batch_size=self._engine.rx_batch_size)
+
+    def memory_link_address(self, ipv4):
+        # In-memory links (see memory_transport.py) don't need real addresses, but we use the
+        # address of the physical interface anyway, so that the logs look the same
+        if ipv4:
+            return self._ipv4_address or "127.0.0.1"
+        else:
+            return self._ipv6_address or "::1"
+
+    def create_memory_tx_socket(self, ipv4, remote_address, port):
+        return memory_transport.MEMORY_TRANSPORT.create_tx_socket(
+            ipv4, self.memory_link_address(ipv4), remote_address, port)
 
     def get_config_attribute(self, config, attribute, default):
         if attribute in config:
@@ -1302,6 +1358,13 @@ class Interface:
                 self._misorder_counters[index].increase()
         self._last_rx_packet_nr[index] = packet_info.packet_nr
 
+    def receive_lie_messages(self, messages, sock):
+        for message, from_info in messages:
+            # Processing an earlier message in the batch may have caused the socket to be closed
+            if sock.fileno() == -1:
+                return
+            self.receive_lie_message(message, from_info, sock)
+
     def receive_lie_message(self, message, from_info, sock):
         packet_info = self.receive_message_common(message, from_info, sock)
         if packet_info is None:
@@ -1323,6 +1386,14 @@ class Interface:
             self.rx_warning("Received TIRE packet on LIE port (ignored)")
         self.bump_rx_counters(protocol_packet, sock, len(message))
 
+    def receive_flood_messages(self, messages, sock):
+        for message, from_info in messages:
+            # Processing an earlier message in the batch may have caused the socket to be closed
+            # (e.g. because the adjacency went down and flooding was stopped)
+            if sock.fileno() == -1:
+                return
+            self.receive_flood_message(message, from_info, sock)
+
     def receive_flood_message(self, message, from_info, sock):
         packet_info = self.receive_message_common(message, from_info, sock)
         if packet_info is None:
@@ -1331,6 +1402,10 @@ class Interface:
         flood_content = False
         if protocol_packet.content.tie is not None:
             self.process_rx_tie_packet_info(packet_info)
+            if packet_info.error:
+                # The element of a lazily decoded TIE could not be decoded
+                self.log_and_count_error(packet_info, len(message))
+                return
             flood_content = True
         if protocol_packet.content.tide:
             self.process_rx_tide_packet(protocol_packet.content.tide)
@@ -1378,7 +1453,7 @@ class Interface:
             self.ack_tie(tie_header_lifetime)
 
     def process_rx_tide_packet(self, tide_packet):
-        result = self.node.process_rx_tide_packet(tide_packet)
+        result = self.node.process_rx_tide_packet(tide_packet, self)
         (request_tie_headers_lifetime, start_sending_tie_headers, stop_sending_tie_headers) = result
         for tie_header in start_sending_tie_headers:
             self.try_to_transmit_tie(tie_header)
@@ -1499,28 +1574,31 @@ class Interface:
         return (filtered, reason)
 
     def add_tie_header_to_ties_tx(self, tie_header, tie_packet_info=None):
-        # If the TIE is not already on the send queue or if the TIE is a newer version than what's
-        # already on the send queue, then send it immediately instead of (in addition to, really)
-        # waiting for the next service timer.
-        if tie_header.tieid not in self._ties_tx:
-            send_now = True
-        elif tie_header.seq_nr > self._ties_tx[tie_header.tieid].seq_nr:
-            send_now = True
-        else:
-            send_now = False
-        self._ties_tx[tie_header.tieid] = tie_header
-        if send_now:
-            if tie_packet_info is None:
-                tie_packet_info = self.node.find_tie_packet_info(tie_header.tieid)
-            if tie_packet_info is not None:
-                self.send_packet_info(tie_packet_info, flood=True)
+        # If the same (or a newer) version of the TIE is already on the send queue or on the
+        # retransmit queue, leave it there: it will be (re-)sent when the service timer finds it
+        # due. Otherwise, send the TIE immediately instead of waiting for the next service timer.
+        tie_id = tie_header.tieid
+        if tie_id in self._ties_tx and tie_header.seq_nr <= self._ties_tx[tie_id].seq_nr:
+            return
+        if tie_id in self._ties_rtx and tie_header.seq_nr <= self._ties_rtx[tie_id].seq_nr:
+            return
+        self._ties_rtx.remove(tie_id)
+        self._ties_tx[tie_id] = tie_header
+        if tie_packet_info is None:
+            tie_packet_info = self.node.find_tie_packet_info(tie_id)
+        if tie_packet_info is not None:
+            self.transmit_tie(tie_packet_info)
+
+    def transmit_tie(self, tie_packet_info):
+        # Send the TIE and start waiting for it to be acknowledged
+        self.send_packet_info(tie_packet_info, flood=True)
+        self.move_to_rtx_queue(tie_packet_info.protocol_packet.content.tie.header)
 
     def try_to_transmit_tie(self, tie_header):
         (filtered, reason) = self.is_flood_filtered(tie_header)
         outcome = "filtered" if filtered else "allowed"
         self.tx_debug("Transmit TIE %s is %s because %s", tie_header, outcome, reason)
         if not filtered:
-            self.remove_from_ties_rtx(tie_header)
             if tie_header.tieid in self._ties_ack:
                 ack_header_lifetime = self._ties_ack[tie_header.tieid]
                 if ack_header_lifetime.header.seq_nr < tie_header.seq_nr:
@@ -1562,10 +1640,7 @@ class Interface:
             pass
 
     def remove_from_ties_rtx(self, tie_header):
-        try:
-            del self._ties_rtx[tie_header.tieid]
-        except KeyError:
-            pass
+        self._ties_rtx.remove(tie_header.tieid)
 
     def remove_from_ties_req(self, tie_header):
         try:
@@ -1589,18 +1664,20 @@ class Interface:
             self.remove_from_all_queues(tie_header_lifetime.header)
             self._ties_req[tie_header_lifetime.header.tieid] = tie_header_lifetime
 
-    # TODO: Defined in spec, but never invoked
     def move_to_rtx_queue(self, tie_header):
-        self.remove_from_ties_rtx(tie_header)
-        self._ties_rtx[tie_header.tieid] = tie_header
+        self.remove_from_ties_tx(tie_header)
+        self._ties_rtx.add(tie_header, timer.TIMER_SCHEDULER.now())
 
     # TODO: Defined in spec, but never invoked
     def clear_requests(self, tie_header):
         self.remove_from_ties_req(tie_header)
 
     def service_queues(self):
-        # TODO: For now, we have an extremely simplistic send queue service implementation. Once
-        # per second we send all queued messages. Make this more sophisticated.
+        # Once per second we send all queued TIREs (except that the number of TIREs is capped, see
+        # send_tire_packets) and all TIEs that have not been sent yet, and we retransmit the
+        # unacknowledged TIEs that are due for retransmission.
+        self._tires_this_interval = 0
+        self._tire_capped_this_interval = False
         if self._ties_ack:
             self.service_ties_ack()
         if self._ties_tx:
@@ -1609,24 +1686,49 @@ class Interface:
             self.service_ties_rtx()
         if self._ties_req:
             self.service_ties_req()
+        if self._tires_this_interval > 0:
+            self._tire_intervals_count += 1
+            self._tire_max_per_interval = max(self._tire_max_per_interval,
+                                              self._tires_this_interval)
+        if self._tire_capped_this_interval:
+            self._tire_capped_intervals_count += 1
+
+    def send_tire_packets(self, queue, tie_headers_lifetime):
+        # Send the TIE headers (which are on the given queue) in as many TIREs as needed to keep
+        # each TIRE within the MTU, but no more than MAX_TIRES_PER_INTERVAL TIREs. The headers that
+        # were sent are moved to the end of the queue, so that the headers that did not fit are the
+        # first to be sent in the next interval.
+        max_headers = packet_common.max_tire_headers(self._mtu)
+        max_headers_per_interval = max_headers * self.MAX_TIRES_PER_INTERVAL
+        if len(tie_headers_lifetime) > max_headers_per_interval:
+            tie_headers_lifetime = tie_headers_lifetime[:max_headers_per_interval]
+            self._tire_capped_this_interval = True
+        for start in range(0, len(tie_headers_lifetime), max_headers):
+            tire_packet = packet_common.make_tire_packet()
+            for tie_header_lifetime in tie_headers_lifetime[start:start+max_headers]:
+                packet_common.add_tie_header_to_tire(tire_packet, tie_header_lifetime)
+                queue.move_to_end(tie_header_lifetime.header.tieid)
+            packet_content = encoding.ttypes.PacketContent(tire=tire_packet)
+            packet_header = encoding.ttypes.PacketHeader(
+                sender=self.node.system_id,
+                level=self.node.level_value())
+            protocol_packet = encoding.ttypes.ProtocolPacket(
+                header=packet_header,
+                content=packet_content)
+            self.send_protocol_packet(protocol_packet, flood=True)
+            nr_headers = len(tire_packet.headers)
+            self._tires_sent_count += 1
+            self._tire_headers_sent_count += nr_headers
+            self._tire_max_headers = max(self._tire_max_headers, nr_headers)
+            self._tires_this_interval += 1
 
     def service_ties_ack(self):
-        tire_packet = packet_common.make_tire_packet()
         # We always send an ACK for every TIE header on the ACK queue. I.e. we always ACK the TIEs
         # that we received and accepted.
-        for tie_header_lifetime in self._ties_ack.values():
-            packet_common.add_tie_header_to_tire(tire_packet, tie_header_lifetime)
-        packet_content = encoding.ttypes.PacketContent(tire=tire_packet)
-        packet_header = encoding.ttypes.PacketHeader(
-            sender=self.node.system_id,
-            level=self.node.level_value())
-        protocol_packet = encoding.ttypes.ProtocolPacket(
-            header=packet_header,
-            content=packet_content)
-        self.send_protocol_packet(protocol_packet, flood=True)
+        self.send_tire_packets(self._ties_ack, list(self._ties_ack.values()))
 
     def service_ties_req(self):
-        tire_packet = packet_common.make_tire_packet()
+        tie_headers_lifetime = []
         for tie_header_lifetime in self._ties_req.values():
             # We don't request a TIE from our neighbor if the flooding scope rules say that the
             # neighbor is not allowed to flood the TIE to us. Why? Because the neighbor is allowed
@@ -1640,32 +1742,30 @@ class Interface:
                 self.neighbor.top_of_fabric(),
                 self.node.system_id)
             if allowed:
-                packet_common.add_tie_header_to_tire(tire_packet, tie_header_lifetime)
+                tie_headers_lifetime.append(tie_header_lifetime)
             else:
                 # TODO: log message
                 pass
-        packet_content = encoding.ttypes.PacketContent(tire=tire_packet)
-        packet_header = encoding.ttypes.PacketHeader(
-            sender=self.node.system_id,
-            level=self.node.level_value())
-        protocol_packet = encoding.ttypes.ProtocolPacket(
-            header=packet_header,
-            content=packet_content)
-        self.send_protocol_packet(protocol_packet, flood=True)
+        self.send_tire_packets(self._ties_req, tie_headers_lifetime)
 
-    def service_ties_queue(self, queue):
+    def service_ties_tx(self):
         # Note: we only look at the TIE-ID in the queue and not at the header. If we have a more
         # recent version of the TIE in the TIE-DB than the one requested, we send the one we have.
-        for tie_id in queue.keys():
+        # TIEs that are not in the TIE-DB (yet) stay on the queue.
+        for tie_id in list(self._ties_tx.keys()):
             db_tie_packet_info = self.node.find_tie_packet_info(tie_id)
             if db_tie_packet_info is not None:
-                self.send_packet_info(db_tie_packet_info, flood=True)
-
-    def service_ties_tx(self):
-        self.service_ties_queue(self._ties_tx)
+                self.transmit_tie(db_tie_packet_info)
 
     def service_ties_rtx(self):
-        self.service_ties_queue(self._ties_rtx)
+        # Only the TIEs that are due are retransmitted; they have already been rescheduled with a
+        # backed-off interval. A TIE that is no longer in the TIE-DB is not retransmitted anymore.
+        for tie_id in self._ties_rtx.due(timer.TIMER_SCHEDULER.now()):
+            db_tie_packet_info = self.node.find_tie_packet_info(tie_id)
+            if db_tie_packet_info is None:
+                self._ties_rtx.remove(tie_id)
+            else:
+                self.send_packet_info(db_tie_packet_info, flood=True)
 
     @property
     def state_name(self):
@@ -1810,12 +1910,12 @@ class Interface:
         return tab
 
     @staticmethod
-    def key_id_str(key):
-        if key is None:
+    def key_id_str(the_key):
+        if the_key is None:
             return "None"
-        if key.key_id is None:
+        if the_key.key_id is None:
             return "None"
-        return str(key.key_id)
+        return str(the_key.key_id)
 
     def intf_outer_keys_table(self):
         tab = table.Table()
@@ -1841,6 +1941,15 @@ class Interface:
         tab.add_row(["Next Sent Nonce Increase", next_inc])
         return tab
 
+    def outer_fingerprint_cache_table(self):
+        cache = self.outer_fingerprint_cache
+        tab = table.Table()
+        tab.add_row(["Cached Fingerprints", len(cache)])
+        tab.add_row(["Cache Hits", cache.hit_count])
+        tab.add_row(["Cache Misses", cache.miss_count])
+        tab.add_row(["Cache Hit Rate", cache.hit_rate_str()])
+        return tab
+
     def sockets_table(self):
         tab = table.Table()
         tab.add_row([
@@ -1883,20 +1992,34 @@ class Interface:
     def clear_stats(self):
         self._traffic_stats_group.clear()
         self.fsm.clear_stats()
+        self.clear_tire_stats()
+
+    def clear_tire_stats(self):
+        self._tires_sent_count = 0
+        self._tire_headers_sent_count = 0
+        self._tire_max_headers = 0
+        self._tire_intervals_count = 0
+        self._tire_max_per_interval = 0
+        self._tire_capped_intervals_count = 0
+
+    def max_tide_headers(self):
+        return packet_common.max_tide_headers(self._mtu)
 
     def send_tides_table(self):
         tab = table.Table()
         tab.add_row(self.cli_tides_summary_headers())
         # TODO: Make this code common with Node.send_tides_on_interface (avoid code duplication)
         if self.fsm.state == self.State.THREE_WAY:
-            tide_packet = self.node.generate_tide_packet(
+            tide_packets = self.node.generate_tide_packets(
+                max_headers=self.max_tide_headers(),
                 neighbor_direction=self.neighbor_direction(),
                 neighbor_system_id=self.neighbor.system_id,
                 neighbor_level=self.neighbor.level,
                 neighbor_is_top_of_fabric=self.neighbor.top_of_fabric(),
                 my_level=self.node.level_value(),
                 i_am_top_of_fabric=self.node.top_of_fabric())
-            tab.add_row(self.cli_tides_summary_attributes(tide_packet))
+            for tide_packet in tide_packets:
+                tab.add_row(self.cli_tides_summary_attributes(tide_packet))
         return tab
 
     @staticmethod
@@ -1984,7 +2107,28 @@ class Interface:
         return self.tie_headers_table_cmn(self._ties_tx)
 
     def ties_rtx_table(self):
-        return self.tie_headers_table_cmn(self._ties_rtx)
+        tab = table.Table()
+        tab.add_row([
+            "Direction",
+            "Originator",
+            "Type",
+            "TIE Nr",
+            "Seq Nr",
+            ["Retransmit", "Interval"],
+            ["Retransmit", "Count"],
+            ["Next", "Retransmit"]])
+        now = timer.TIMER_SCHEDULER.now()
+        for tie_header in self._ties_rtx.values():
+            (next_time, interval, count) = self._ties_rtx.retransmit_info(tie_header.tieid)
+            tab.add_row([packet_common.direction_str(tie_header.tieid.direction),
+                         tie_header.tieid.originator,
+                         packet_common.tietype_str(tie_header.tieid.tietype),
+                         tie_header.tieid.tie_nr,
+                         tie_header.seq_nr,
+                         "{:.1f} secs".format(interval),
+                         count,
+                         "{:.1f} secs".format(max(next_time - now, 0.0))])
+        return tab
 
     def ties_req_table(self):
         return self.tie_headers_lifetime_table_cmn(self._ties_req)
@@ -1992,6 +2136,32 @@ class Interface:
     def ties_ack_table(self):
         return self.tie_headers_lifetime_table_cmn(self._ties_ack)
 
+    def tire_batching_table(self):
+        if self._tires_sent_count == 0:
+            average_headers_str = "-"
+        else:
+            average_headers_str = "{:.1f}".format(self._tire_headers_sent_count /
+                                                  self._tires_sent_count)
+        if self._tire_intervals_count == 0:
+            average_tires_str = "-"
+        else:
+            average_tires_str = "{:.1f}".format(self._tires_sent_count /
+                                                self._tire_intervals_count)
+        tab = table.Table()
+        tab.add_row(["Description", "Value"])
+        tab.add_rows([
+            ["Maximum headers per TIRE (MTU)", packet_common.max_tire_headers(self._mtu)],
+            ["Maximum TIREs per interval (limit)", self.MAX_TIRES_PER_INTERVAL],
+            ["Sent TIREs", self._tires_sent_count],
+            ["Sent TIRE headers", self._tire_headers_sent_count],
+            ["Average headers per TIRE", average_headers_str],
+            ["Maximum headers per TIRE", self._tire_max_headers],
+            ["Intervals with TIREs", self._tire_intervals_count],
+            ["Average TIREs per interval", average_tires_str],
+            ["Maximum TIREs per interval", self._tire_max_per_interval],
+            ["Intervals capped by limit", self._tire_capped_intervals_count]])
+        return tab
+
     # TODO: Set TTL as follows:
     # ttl_bin = struct.pack('@i', MYTTL)
     # if addrinfo[0] == socket.AF_INET: # IPv4
@@ -2024,6 +2194,8 @@ class Interface:
         return False
 
     def create_socket_ipv4_tx_mcast(self, multicast_address, port, loopback):
+        if self._engine.in_memory_links:
+            return self.create_memory_tx_socket(True, multicast_address, port)
         try:
             sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
         except IOError as err:
@@ -2053,6 +2225,8 @@ class Interface:
         return sock
 
     def create_socket_ipv4_tx_ucast(self, remote_address, port):
+        if self._engine.in_memory_links:
+            return self.create_memory_tx_socket(True, remote_address, port)
         try:
             sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
         except IOError as err:
@@ -2068,6 +2242,8 @@ class Interface:
         return sock
 
     def create_socket_ipv6_tx_mcast(self, multicast_address, port, loopback):
+        if self._engine.in_memory_links:
+            return self.create_memory_tx_socket(False, multicast_address, port)
         if self._interface_index is None:
             self.warning("Could not create IPv6 multicast TX socket: unknown interface index")
             return None
@@ -2102,6 +2278,8 @@ class Interface:
         return sock
 
     def create_socket_ipv6_tx_ucast(self, remote_address, port):
+        if self._engine.in_memory_links:
+            return self.create_memory_tx_socket(False, remote_address, port)
         try:
             sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
         except IOError as err:
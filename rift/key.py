@@ -1,3 +1,4 @@
+import collections
 import hashlib
 import hmac
 
@@ -17,6 +18,69 @@ ALGORITHM_TO_DIGESTMOD = {
 
 ALGORITHMS = list(ALGORITHM_TO_DIGESTMOD.keys())
 
+# Maximum number of entries in each fingerprint cache of a key. This is in the same order as the
+# outer fingerprint cache of an interface: each entry holds a copy of the fingerprinted message, so
+# the cache must not grow with the size of the TIE database.
+FINGERPRINT_CACHE_SIZE = 1000
+
+class FingerprintCache:
+
+    # A bounded cache of the fingerprints computed by a key, indexed by a key chosen by the caller
+    # (e.g. the TIE-ID and sequence number of a TIE). The message from which the fingerprint was
+    # computed is stored along with it, and a cached fingerprint is only used for exactly the same
+    # message: comparing two messages is much cheaper than computing a fingerprint. When the cache
+    # is full, the least recently used entry is evicted.
+
+    def __init__(self, max_entries=FINGERPRINT_CACHE_SIZE):
+        self._max_entries = max_entries
+        self._entries = collections.OrderedDict()   # (message_parts, fingerprint) by cache_key
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, cache_key, message_parts):
+        entry = self._entries.get(cache_key)
+        if entry is not None:
+            (cached_message_parts, fingerprint) = entry
+            if self._same_message(cached_message_parts, message_parts):
+                self._entries.move_to_end(cache_key)
+                self.hit_count += 1
+                return fingerprint
+        self.miss_count += 1
+        return None
+
+    def store(self, cache_key, message_parts, fingerprint):
+        # Received message parts may be memoryviews into a receive buffer that is about to be
+        # re-used, so keep a copy.
+        message_parts = tuple(None if part is None else bytes(part) for part in message_parts)
+        self._entries[cache_key] = (message_parts, fingerprint)
+        self._entries.move_to_end(cache_key)
+        if len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def hit_rate_str(self):
+        lookup_count = self.hit_count + self.miss_count
+        if lookup_count == 0:
+            return "-"
+        return "{:.1f}%".format(100.0 * self.hit_count / lookup_count)
+
+    @staticmethod
+    def _same_message(parts_1, parts_2):
+        if len(parts_1) != len(parts_2):
+            return False
+        for (part_1, part_2) in zip(parts_1, parts_2):
+            if part_1 is None or part_2 is None:
+                if part_1 is not part_2:
+                    return False
+            elif part_1 != part_2:
+                return False
+        return True
+
 class Key:
 
     def __init__(self, key_id, algorithm, secret):
@@ -24,31 +88,43 @@ class Key:
         self.key_id = key_id
         self.algorithm = algorithm
         self.secret = secret
+        # The state of the HMAC or hash after processing the secret (but nothing else yet) is
+        # computed once, and copied for each digest.
+        if key_id == 0:
+            self._initial_state = None
+        elif "hmac" in algorithm:
+            digestmod = ALGORITHM_TO_DIGESTMOD[algorithm]
+            self._initial_state = hmac.new(secret.encode(), digestmod=digestmod)
+        else:
+            digestmod = ALGORITHM_TO_DIGESTMOD[algorithm]
+            self._initial_state = hashlib.new(name=digestmod)
+            self._initial_state.update(secret.encode())
+        # Origin fingerprints, indexed by (TIE-ID, sequence number)
+        self.origin_fingerprint_cache = FingerprintCache()
 
     def digest(self, message_parts):
         if self.key_id == 0:
             assert self.algorithm == "null"
             return b''
-        elif "hmac" in self.algorithm:
-            assert self.algorithm in ALGORITHMS
-            digestmod = ALGORITHM_TO_DIGESTMOD[self.algorithm]
-            the_hmac = hmac.new(self.secret.encode(), digestmod=digestmod)
-            for message_part in message_parts:
-                if message_part is not None:
-                    the_hmac.update(message_part)
-            return the_hmac.digest()
-        else:
-            assert self.algorithm in ALGORITHMS
-            digestmod = ALGORITHM_TO_DIGESTMOD[self.algorithm]
-            the_hash = hashlib.new(name=digestmod)
-            the_hash.update(self.secret.encode())
-            for message_part in message_parts:
-                if message_part is not None:
-                    the_hash.update(message_part)
-            return the_hash.digest()
+        the_hash = self._initial_state.copy()
+        for message_part in message_parts:
+            if message_part is not None:
+                the_hash.update(message_part)
+        return the_hash.digest()
 
     def padded_digest(self, message_parts):
         dig = self.digest(message_parts)
         if len(dig) % 4 != 0:
             dig += b'\x00' * (4 - len(dig) % 4)
         return dig
+
+    def cached_padded_digest(self, cache, cache_key, message_parts):
+        # Same as padded_digest, but re-use the digest from the cache if it was already computed
+        # for the same message.
+        if self.key_id == 0:
+            return self.padded_digest(message_parts)
+        dig = cache.lookup(cache_key, message_parts)
+        if dig is None:
+            dig = self.padded_digest(message_parts)
+            cache.store(cache_key, message_parts, dig)
+        return dig
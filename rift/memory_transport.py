@@ -0,0 +1,205 @@
+import collections
+import heapq
+import ipaddress
+import itertools
+import random
+import socket
+
+import timer
+
+# In-memory transport for simulated interfaces.
+#
+# When many nodes run in one engine, all simulated interfaces normally share a single physical
+# interface: packets go through real UDP sockets and are distinguished by multicast address and
+# port. The in-memory transport replaces those sockets by MemorySocket objects which deliver
+# packets directly to the MemoryRxHandler objects that are bound to the same port (and the same
+# multicast group for multicast), without system calls and without going through the kernel.
+#
+# Delivery follows the UDP semantics that the interfaces rely on:
+# - A packet sent to a multicast address is delivered to all receivers bound to that multicast
+#   address and the destination port.
+# - A packet sent to a unicast address is delivered to all unicast receivers bound to the
+#   destination port (the simulated interfaces are distinguished by port, not by address).
+#
+# Packets are never delivered from within sendmsg: they are queued and delivered from the event
+# loop (see Scheduler), in the order in which they were sent, optionally after a delay and with
+# random loss. The random number generator has a fixed seed so that runs are reproducible.
+
+DEFAULT_SEED = 1
+
+FIRST_EPHEMERAL_PORT = 49152
+
+class MemorySocket:
+
+    # Stand-in for a UDP socket; only the subset of the socket API used by interfaces is provided
+
+    _fileno_counter = itertools.count(1)
+
+    def __init__(self, transport, family, local_address, local_port, remote=None):
+        self._transport = transport
+        self.family = family
+        self._local_address = local_address
+        self._local_port = local_port
+        self._remote = remote   # (address, port) for connected (send) sockets
+        self._fileno = next(self._fileno_counter)
+
+    def fileno(self):
+        return self._fileno
+
+    def close(self):
+        self._fileno = -1
+
+    def _name(self, address, port):
+        if self.family == socket.AF_INET:
+            return (address, port)
+        else:
+            return (address, port, 0, 0)
+
+    def getsockname(self):
+        return self._name(self._local_address, self._local_port)
+
+    def getpeername(self):
+        if self._remote is None:
+            raise OSError("Socket is not connected")
+        return self._name(self._remote[0], self._remote[1])
+
+    def sendmsg(self, message_parts):
+        if self._fileno == -1:
+            raise OSError("Socket is closed")
+        self._transport.send(self, b"".join(message_parts))
+        return sum(len(part) for part in message_parts)
+
+class MemoryRxHandler:
+
+    # Same interface as UdpRxHandler: the receive_function is called with a list of
+    # (message, from_info) tuples and the socket
+
+    def __init__(self, transport, local_address, local_port, ipv4, multicast_address,
+                 receive_function):
+        self._transport = transport
+        self.local_port = local_port
+        if ipv4:
+            self.family = socket.AF_INET
+        else:
+            self.family = socket.AF_INET6
+        if multicast_address is None:
+            self.multicast_address = None   # Unicast receiver
+        else:
+            self.multicast_address = ipaddress.ip_address(multicast_address)
+        self._receive_function = receive_function
+        if multicast_address is None:
+            bound_address = local_address
+        else:
+            bound_address = multicast_address
+        self.sock = MemorySocket(transport, self.family, bound_address, local_port)
+        transport.bind(self)
+
+    def close(self):
+        if self.sock is not None:
+            self._transport.unbind(self)
+            self.sock.close()
+            self.sock = None
+
+    def deliver(self, batch):
+        if self.sock is not None:
+            self._receive_function(batch, self.sock)
+
+class MemoryTransport:
+
+    def __init__(self, timer_scheduler=None):
+        if timer_scheduler is None:
+            timer_scheduler = timer.TIMER_SCHEDULER
+        self._timer_scheduler = timer_scheduler
+        self._receivers = collections.defaultdict(list)   # Indexed by (family, port)
+        self._queue = []      # Heap of (deliver_time, sequence_nr, receiver, message, from_info)
+        self._sequence_nr = itertools.count()
+        self._next_ephemeral_port = FIRST_EPHEMERAL_PORT
+        self.loss_percent = 0.0
+        self.delay = 0.0
+        self._random = random.Random(DEFAULT_SEED)
+        self.nr_sent = 0
+        self.nr_delivered = 0
+        self.nr_lost = 0
+
+    def configure(self, loss_percent=0.0, delay=0.0, seed=DEFAULT_SEED):
+        self.loss_percent = loss_percent
+        self.delay = delay
+        self._random = random.Random(seed)
+
+    def create_tx_socket(self, ipv4, local_address, remote_address, remote_port):
+        if ipv4:
+            family = socket.AF_INET
+        else:
+            family = socket.AF_INET6
+            # Scoped IPv6 addresses (address%interface) are irrelevant in memory
+            remote_address = remote_address.split('%')[0]
+        local_port = self._next_ephemeral_port
+        self._next_ephemeral_port += 1
+        if self._next_ephemeral_port > 0xffff:
+            self._next_ephemeral_port = FIRST_EPHEMERAL_PORT
+        return MemorySocket(self, family, local_address, local_port,
+                            (remote_address, remote_port))
+
+    def bind(self, receiver):
+        self._receivers[(receiver.family, receiver.local_port)].append(receiver)
+
+    def unbind(self, receiver):
+        index = (receiver.family, receiver.local_port)
+        self._receivers[index].remove(receiver)
+        if not self._receivers[index]:
+            del self._receivers[index]
+
+    def nr_receivers(self):
+        return sum(len(receivers) for receivers in self._receivers.values())
+
+    def send(self, sock, message):
+        (remote_address, remote_port) = sock.getpeername()[:2]
+        remote_address = ipaddress.ip_address(remote_address)
+        is_multicast = remote_address.is_multicast
+        from_info = sock.getsockname()
+        deliver_time = self._timer_scheduler.now() + self.delay
+        self.nr_sent += 1
+        for receiver in self._receivers.get((sock.family, remote_port), []):
+            if is_multicast:
+                if receiver.multicast_address != remote_address:
+                    continue
+            elif receiver.multicast_address is not None:
+                continue
+            if self.loss_percent and self._random.uniform(0.0, 100.0) < self.loss_percent:
+                self.nr_lost += 1
+                continue
+            heapq.heappush(self._queue, (deliver_time, next(self._sequence_nr), receiver,
+                                         message, from_info))
+
+    def has_queued_packets(self):
+        return bool(self._queue)
+
+    def deliver_queued_packets(self):
+        # Only deliver the packets that were queued before we started; packets that are sent
+        # while processing the received packets are delivered in the next round, so that two
+        # chatty nodes cannot starve the rest of the event loop.
+        if not self._queue:
+            return
+        now = self._timer_scheduler.now()
+        last_sequence_nr = next(self._sequence_nr)
+        batches = collections.OrderedDict()   # Per receiver, in the order in which they were sent
+        while self._queue:
+            (deliver_time, sequence_nr, receiver, message, from_info) = self._queue[0]
+            if deliver_time > now or sequence_nr > last_sequence_nr:
+                break
+            heapq.heappop(self._queue)
+            batches.setdefault(receiver, []).append((message, from_info))
+        for receiver, batch in batches.items():
+            self.nr_delivered += len(batch)
+            receiver.deliver(batch)
+
+    def next_delivery_timeout(self):
+        # Time until the next queued packet must be delivered, or None if nothing is queued
+        if not self._queue:
+            return None
+        return max(0.0, self._queue[0][0] - self._timer_scheduler.now())
+
+    def discard_all_packets(self):
+        self._queue = []
+
+MEMORY_TRANSPORT = MemoryTransport()
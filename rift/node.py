@@ -1,5 +1,6 @@
 # pylint: disable=too-many-lines
 
+import bisect
 import collections
 import copy
 import enum
@@ -20,12 +21,16 @@ import interface
 import kernel
 import next_hop
 import offer
+import packet_codec
 import packet_common
 import rib
 import route
 import spf_dest
 import stats
 import table
+import tide_cache
+import tie_db
+import tie_fragmenter
 import timer
 import utils
 
@@ -83,6 +88,25 @@ class Node:
 
     SEND_TIDES_INTERVAL = 2.0
 
+    # A cached encoded TIDE is re-sent as is for at most this many seconds, after which it is
+    # re-encoded to refresh the remaining lifetimes of the TIE headers in it. This is much shorter
+    # than the lifetime difference that is ignored when comparing TIE headers
+    # (lifetime_diff2ignore).
+    TIDE_CACHE_MAX_AGE = 60.0
+
+    # Maximum number of TIDE packets sent to a neighbor per TIDE interval. If the TIE-DB is so large
+    # that more TIDEs are needed to cover it, the TIDE ranges are sent in rotation over multiple
+    # intervals.
+    MAX_TIDES_PER_INTERVAL = 16
+
+    # Number of TIE-DB changes that are remembered for incrementally updating cached TIDEs. If more
+    # TIEs changed since a TIDE was cached, the TIDE is regenerated from scratch.
+    TIE_DB_CHANGES_HISTORY_LENGTH = 1000
+
+    # Self-originated node TIEs and prefix TIEs are split into multiple fragments (TIEs with
+    # consecutive TIE numbers) so that each fragment fits in an IP packet of this size.
+    MAX_TIE_PACKET_SIZE = 1400
+
     # TODO: Use constant from Thrift file (it is currently not there, but Tony said he added it)
     # Don't use the actual lowest value 0 (which is enum value Illegal) for direction or tietype,
     # but value 1 (direction South) or value 2 (tietype TieTypeNode). Juniper RIFT doesn't accept
@@ -96,9 +120,9 @@ class Node:
     # KeyValueTIEType instead
     MAX_TIE_ID = encoding.ttypes.TIEID(
         direction=constants.DIR_NORTH,
-        originator=packet_common.MAX_U64,
+        originator=packet_codec.MAX_U64,
         tietype=common.ttypes.TIETypeType.KeyValueTIEType,
-        tie_nr=packet_common.MAX_U32)
+        tie_nr=packet_codec.MAX_U32)
 
     MIN_SPF_INTERVAL = 1.0
 
@@ -285,6 +309,7 @@ class Node:
         self._leaf_only = leaf_only
         self.leaf_2_leaf = leaf_2_leaf
         self._top_of_fabric_flag = top_of_fabric_flag
+        self.clear_flood_scope_index()
 
     def action_purge_offers(self):
         for purged_offer in self._rx_offers.values():
@@ -299,6 +324,7 @@ class Node:
             self._derived_level = self._highest_available_level - 1
         else:
             self._derived_level = 0
+        self.clear_flood_scope_index()
 
     def any_southbound_adjacencies(self):
         # We define a southbound adjacency as any adjacency between this node and a node that has
@@ -478,17 +504,27 @@ class Node:
         if 'interfaces' in config:
             for interface_config in self._config['interfaces']:
                 self.create_interface(interface_config)
-        self.my_node_tie_seq_nrs = {}
-        self.my_node_tie_seq_nrs[common.ttypes.TieDirectionType.South] = 0
-        self.my_node_tie_seq_nrs[common.ttypes.TieDirectionType.North] = 0
-        self.my_node_tie_packet_infos = {}     # Indexed by neighbor direction
+        # Fragments of my node TIEs: packet_info indexed by direction and then by tie_nr
+        self.my_node_tie_packet_infos = {}
+        self._my_node_tie_fragmenters = {}
+        for direction in [common.ttypes.TieDirectionType.South,
+                          common.ttypes.TieDirectionType.North]:
+            self.my_node_tie_packet_infos[direction] = {}
+            self._my_node_tie_fragmenters[direction] = tie_fragmenter.TieFragmenter(
+                self.MAX_TIE_PACKET_SIZE)
         self.peer_node_tie_packet_infos = {}   # Indexed by tie_id
         self._originating_default = False
         self._my_south_prefix_tie_packet_info = None
-        self._my_north_prefix_tie_packet_info = None
+        # Fragments of my north prefix TIE: packet_info indexed by tie_nr
+        self._my_north_prefix_tie_packet_infos = {}
+        self._my_north_prefix_tie_fragmenter = tie_fragmenter.TieFragmenter(
+            self.MAX_TIE_PACKET_SIZE)
         self._my_pos_disagg_tie_packet_info = None
-        self.tie_packet_infos = sortedcontainers.SortedDict()   # Indexed by tie_id
-        self._last_received_tide_end = self.MIN_TIE_ID
+        # The TIE-DB (tie_packet_info indexed by tie_id)
+        self.tie_packet_infos = tie_db.TieDb(self.TIE_DB_CHANGES_HISTORY_LENGTH)
+        # End of the range of the last received TIDE, indexed by the interface on which it was
+        # received
+        self._last_received_tide_end = {}
         self._defer_spf_timer = None
         self._spf_triggers_count = 0
         self._spf_triggers_deferred_count = 0
@@ -522,11 +558,10 @@ class Node:
             self.regenerate_my_node_ties()
             self.regenerate_my_north_prefix_tie()
             self.regenerate_my_south_prefix_tie()
-        self._age_ties_timer = timer.Timer(
+        self._age_ties_timer = timer.GroupTimer(
             interval=1.0,
             expire_function=self.age_ties,
-            periodic=True,
-            start=True)
+            jitter_key=self.log_id)
         self.fsm = fsm.Fsm(
             definition=self.fsm_definition,
             action_handler=self,
@@ -538,11 +573,10 @@ class Node:
             expire_function=lambda: self.fsm.push_event(self.Event.HOLD_DOWN_EXPIRED),
             periodic=False,
             start=False)
-        self._send_tides_timer = timer.Timer(
+        self._send_tides_timer = timer.GroupTimer(
             interval=self.SEND_TIDES_INTERVAL,
             expire_function=self.send_tides,
-            periodic=True,
-            start=True)
+            jitter_key=self.log_id)
         self.fsm.start()
 
     def key_id_to_key(self, key_id):
@@ -569,6 +603,12 @@ class Node:
     def generatename(self):
         return socket.gethostname().split('.')[0] + str(self._node_nr)
 
+    @staticmethod
+    def skip_node_nrs(count):
+        # Used for nodes which are created in another process (multi-process mode), so that node
+        # numbers (and hence generated names and kernel route tables) are the same in all processes
+        Node._next_node_nr += count
+
     @staticmethod
     def generate_node_random(system_random, system_id):
         assert 0 <= system_random <= 0xffffffffffffffff
@@ -789,16 +829,34 @@ class Node:
         protocol_packet.content.tie = node_tie_packet
         return protocol_packet
 
-    def regenerate_node_tie(self, direction, interface_going_down=None):
-        tie_nr = MY_NODE_TIE_NR
-        self.my_node_tie_seq_nrs[direction] += 1
-        seq_nr = self.my_node_tie_seq_nrs[direction]
-        protocol_packet = self.make_node_tie_protocol_packet(direction, tie_nr, seq_nr)
+    def originate_tie_fragment(self, protocol_packet, previous_packet_info):
+        # Originate one fragment of a self-originated TIE, with a higher sequence number than the
+        # previous version of the fragment. The fragment is not re-originated if the TIE-DB already
+        # contains the fragment with the same contents. Returns the packet_info of the new fragment,
+        # or None if it was not re-originated.
         tie_packet = protocol_packet.content.tie
+        db_tie_packet_info = self.find_tie_packet_info(tie_packet.header.tieid)
+        seq_nr = 1
+        for packet_info in [previous_packet_info, db_tie_packet_info]:
+            if packet_info is not None:
+                previous_tie_packet = packet_info.protocol_packet.content.tie
+                seq_nr = max(seq_nr, previous_tie_packet.header.seq_nr + 1)
+        if db_tie_packet_info is not None:
+            db_tie_packet = db_tie_packet_info.protocol_packet.content.tie
+            if db_tie_packet.element == tie_packet.element:
+                return None
+        tie_packet.header.seq_nr = seq_nr
+        packet_info = packet_common.encode_protocol_packet(protocol_packet, self.active_origin_key)
+        packet_common.set_lifetime(packet_info, common.constants.default_lifetime)
+        self.store_tie_packet_info(packet_info)
+        return packet_info
+
+    def regenerate_node_tie(self, direction, interface_going_down=None):
+        neighbors = {}
         for intf in self.up_interfaces(interface_going_down):
             # Did we already report the neighbor on the other end of this interface? This
             # happens if we have multiple parallel interfaces to the same neighbor.
-            if intf.neighbor.system_id in tie_packet.element.node.neighbors:
+            if intf.neighbor.system_id in neighbors:
                 continue
             # Gather all interfaces (link id pairs) from this node to the same neighbor. Once
             # again, this happens if we have multiple parallel interfaces to the same neighbor.
@@ -814,24 +872,35 @@ class Node:
                 cost=1,         # TODO: Take this from config file
                 link_ids=link_ids,
                 bandwidth=100)  # TODO: Take this from config file or interface
-            tie_packet.element.node.neighbors[intf.neighbor.system_id] = node_neighbor
-        packet_info = packet_common.encode_protocol_packet(protocol_packet, self.active_origin_key)
-        packet_common.set_lifetime(packet_info, common.constants.default_lifetime)
-        self.my_node_tie_packet_infos[direction] = packet_info
-        self.store_tie_packet_info(packet_info)
-        self.info("Regenerated node TIE for direction %s: %s",
-                  packet_common.direction_str(direction), tie_packet)
+            neighbors[intf.neighbor.system_id] = node_neighbor
+        # Spread the neighbors over as many node TIE fragments as needed, and only re-originate the
+        # fragments that changed.
+        empty_protocol_packet = self.make_node_tie_protocol_packet(direction, MY_NODE_TIE_NR, 0)
+        empty_size = packet_common.encoded_tie_packet_size(empty_protocol_packet.content.tie)
+        fragments = self._my_node_tie_fragmenters[direction].update(
+            neighbors, empty_size, packet_common.node_tie_neighbor_size)
+        my_packet_infos = self.my_node_tie_packet_infos[direction]
+        for (index, fragment_neighbors) in enumerate(fragments):
+            tie_nr = MY_NODE_TIE_NR + index
+            protocol_packet = self.make_node_tie_protocol_packet(direction, tie_nr, 0)
+            tie_packet = protocol_packet.content.tie
+            tie_packet.element.node.neighbors = dict(fragment_neighbors)
+            packet_info = self.originate_tie_fragment(protocol_packet, my_packet_infos.get(tie_nr))
+            if packet_info is not None:
+                my_packet_infos[tie_nr] = packet_info
+                self.info("Regenerated node TIE for direction %s: %s",
+                          packet_common.direction_str(direction), tie_packet)
 
     def regenerate_my_node_ties(self, interface_going_down=None):
         for direction in [common.ttypes.TieDirectionType.South,
                           common.ttypes.TieDirectionType.North]:
             self.regenerate_node_tie(direction, interface_going_down)
 
-    def make_prefix_tie_protocol_packet(self, direction, seq_nr):
+    def make_prefix_tie_protocol_packet(self, direction, seq_nr, tie_nr=MY_PREFIX_TIE_NR):
         prefix_tie_packet = packet_common.make_prefix_tie_packet(
             direction=direction,
             originator=self.system_id,
-            tie_nr=MY_PREFIX_TIE_NR,
+            tie_nr=tie_nr,
             seq_nr=seq_nr)
         packet_header = encoding.ttypes.PacketHeader(
             sender=self.system_id,
@@ -846,37 +915,52 @@ class Node:
     def regenerate_my_north_prefix_tie(self):
         config = self._config
         if ('v4prefixes' not in config) and ('v6prefixes' not in config):
-            self._my_north_prefix_tie_packet_info = None
-            tie_id = packet_common.make_tie_id(
-                direction=common.ttypes.TieDirectionType.North,
-                originator=self.system_id,
-                tie_type=common.ttypes.TIETypeType.PrefixTIEType,
-                tie_nr=MY_PREFIX_TIE_NR)
-            self.remove_tie(tie_id)
+            for tie_nr in self._my_north_prefix_tie_packet_infos:
+                tie_id = packet_common.make_tie_id(
+                    direction=common.ttypes.TieDirectionType.North,
+                    originator=self.system_id,
+                    tie_type=common.ttypes.TIETypeType.PrefixTIEType,
+                    tie_nr=tie_nr)
+                self.remove_tie(tie_id)
+            self._my_north_prefix_tie_packet_infos = {}
+            self._my_north_prefix_tie_fragmenter.clear()
             return
-        protocol_packet = self.make_prefix_tie_protocol_packet(
-            direction=common.ttypes.TieDirectionType.North,
-            seq_nr=1)
-        tie_packet = protocol_packet.content.tie
+        prefixes = {}
         if 'v4prefixes' in config:
             for v4prefix in config['v4prefixes']:
                 prefix_str = v4prefix['address'] + "/" + str(v4prefix['mask'])
                 prefix = packet_common.make_ipv4_prefix(prefix_str)
                 metric = v4prefix['metric']
                 tags = set(v4prefix.get('tags', []))
-                packet_common.add_ipv4_prefix_to_prefix_tie(tie_packet, prefix, metric, tags)
+                prefixes[prefix] = encoding.ttypes.PrefixAttributes(metric, tags)
         if 'v6prefixes' in config:
             for v6prefix in config['v6prefixes']:
                 prefix_str = v6prefix['address'] + "/" + str(v6prefix['mask'])
                 prefix = packet_common.make_ipv6_prefix(prefix_str)
                 metric = v6prefix['metric']
                 tags = set(v6prefix.get('tags', []))
-                packet_common.add_ipv6_prefix_to_prefix_tie(tie_packet, prefix, metric, tags)
-        packet_info = packet_common.encode_protocol_packet(protocol_packet, self.active_origin_key)
-        packet_common.set_lifetime(packet_info, common.constants.default_lifetime)
-        self._my_north_prefix_tie_packet_info = packet_info
-        self.store_tie_packet_info(self._my_north_prefix_tie_packet_info)
-        self.info("Regenerated north prefix TIE: %s", tie_packet)
+                prefixes[prefix] = encoding.ttypes.PrefixAttributes(metric, tags)
+        # Spread the prefixes over as many prefix TIE fragments as needed, and only re-originate the
+        # fragments that changed.
+        empty_protocol_packet = self.make_prefix_tie_protocol_packet(
+            direction=common.ttypes.TieDirectionType.North,
+            seq_nr=0)
+        empty_size = packet_common.encoded_tie_packet_size(empty_protocol_packet.content.tie)
+        fragments = self._my_north_prefix_tie_fragmenter.update(
+            prefixes, empty_size, packet_common.prefix_tie_entry_size)
+        for (index, fragment_prefixes) in enumerate(fragments):
+            tie_nr = MY_PREFIX_TIE_NR + index
+            protocol_packet = self.make_prefix_tie_protocol_packet(
+                direction=common.ttypes.TieDirectionType.North,
+                seq_nr=0,
+                tie_nr=tie_nr)
+            tie_packet = protocol_packet.content.tie
+            tie_packet.element.prefixes.prefixes = dict(fragment_prefixes)
+            packet_info = self.originate_tie_fragment(
+                protocol_packet, self._my_north_prefix_tie_packet_infos.get(tie_nr))
+            if packet_info is not None:
+                self._my_north_prefix_tie_packet_infos[tie_nr] = packet_info
+                self.info("Regenerated north prefix TIE: %s", tie_packet)
 
     def regenerate_my_pos_disagg_tie(self):
         # Gather the set of (prefix, metric, tags) containing all prefixes which we should currently
@@ -1039,39 +1123,119 @@ class Node:
     def clear_all_generated_node_ties(self):
         for direction in [common.ttypes.TieDirectionType.South,
                           common.ttypes.TieDirectionType.North]:
-            node_tie_packet_info = self.my_node_tie_packet_infos[direction]
-            if node_tie_packet_info is not None:
+            for node_tie_packet_info in self.my_node_tie_packet_infos[direction].values():
                 tie_packet = node_tie_packet_info.protocol_packet.content.tie
-                self.remove_tie(tie_packet.header)
-                self.my_node_tie_packet_infos[direction] = None
+                self.remove_tie(tie_packet.header.tieid)
+            self.my_node_tie_packet_infos[direction] = {}
+            self._my_node_tie_fragmenters[direction].clear()
 
     def send_tides(self):
-        # The current implementation prepares, encodes, and sends a unique TIDE packet for each
-        # individual neighbor. We do NOT (yet) have any optimization that attempts to prepare and
-        # encode a TIDE only once in total or once per direction (N, S, EW). See the comment in the
-        # function is_flood_allowed for a more detailed discussion on why not.
+        # A unique set of TIDE packets is sent to each individual neighbor (see the comment in the
+        # function is_flood_allowed for why). The TIDEs for each neighbor are cached, and only
+        # regenerated when the TIE-DB or the flooding scope parameters change (see
+        # cached_tide_packet_infos).
         for intf in self.interfaces_by_name.values():
             self.send_tides_on_interface(intf)
 
     def send_tides_on_interface(self, intf):
         if intf.fsm.state != interface.Interface.State.THREE_WAY:
             return
-        tide_packet = self.generate_tide_packet(
+        packet_infos = self.cached_tide_packet_infos(
+            cache=intf.tide_cache,
+            max_headers=intf.max_tide_headers(),
             neighbor_direction=intf.neighbor_direction(),
             neighbor_system_id=intf.neighbor.system_id,
             neighbor_level=intf.neighbor.level,
             neighbor_is_top_of_fabric=intf.neighbor.top_of_fabric(),
             my_level=self.level_value(),
             i_am_top_of_fabric=self.top_of_fabric())
-        self.debug("Regenerated TIDE for neighbor %s: %s", intf.neighbor.system_id, tide_packet)
-        packet_content = encoding.ttypes.PacketContent(tide=tide_packet)
-        packet_header = encoding.ttypes.PacketHeader(
-            sender=self.system_id,
-            level=self.level_value())
-        protocol_packet = encoding.ttypes.ProtocolPacket(
-            header=packet_header,
-            content=packet_content)
-        intf.send_protocol_packet(protocol_packet, flood=True)
+        for packet_info in packet_infos:
+            intf.send_packet_info(packet_info, flood=True)
+
+    def cached_tide_packet_infos(self, cache, max_headers, neighbor_direction,
+                                 neighbor_system_id, neighbor_level, neighbor_is_top_of_fabric,
+                                 my_level, i_am_top_of_fabric):
+        # Returns the encoded TIDE packets (as packet_infos) to be sent to the neighbor in this TIDE
+        # interval, using and updating the cache. The TIE-ID space is split into ranges, such
+        # that the TIDE for each range fits in the MTU. Up to MAX_TIDES_PER_INTERVAL TIDEs are sent
+        # per interval, rotating through the ranges in increasing order, so that the neighbor sees
+        # consecutive ranges (see process_rx_tide_packet).
+        self.update_tide_cache(cache, max_headers, neighbor_direction, neighbor_system_id,
+                               neighbor_level, neighbor_is_top_of_fabric, my_level,
+                               i_am_top_of_fabric)
+        now = timer.TIMER_SCHEDULER.now()
+        packet_infos = []
+        for _ in range(min(self.MAX_TIDES_PER_INTERVAL, len(cache.ranges))):
+            tide_range = cache.next_range()
+            cache.sent_count += 1
+            if tide_range.packet_info is not None:
+                if now - tide_range.encode_time < self.TIDE_CACHE_MAX_AGE:
+                    cache.hit_count += 1
+                    packet_infos.append(tide_range.packet_info)
+                    continue
+                cache.refresh_count += 1
+            else:
+                cache.encode_count += 1
+            tide_packet = self.make_tide_packet(tide_range.start_range, tide_range.end_range,
+                                                tide_range.tie_packet_infos)
+            self.debug("Regenerated TIDE for neighbor %s: %s", neighbor_system_id, tide_packet)
+            packet_content = encoding.ttypes.PacketContent(tide=tide_packet)
+            packet_header = encoding.ttypes.PacketHeader(
+                sender=self.system_id,
+                level=my_level)
+            protocol_packet = encoding.ttypes.ProtocolPacket(
+                header=packet_header,
+                content=packet_content)
+            tide_range.packet_info = packet_common.encode_protocol_packet(protocol_packet, None)
+            tide_range.encode_time = now
+            packet_infos.append(tide_range.packet_info)
+        return packet_infos
+
+    def update_tide_cache(self, cache, max_headers, neighbor_direction, neighbor_system_id,
+                          neighbor_level, neighbor_is_top_of_fabric, my_level, i_am_top_of_fabric):
+        # Bring the TIEs and the ranges in the cache up to date with the TIE-DB. If only a few TIEs
+        # changed, only the ranges that cover those TIEs are split again; the other ranges keep
+        # their encoded TIDE. The TIDEs are encoded lazily, when they are sent.
+        key = (neighbor_direction, neighbor_system_id, neighbor_level, neighbor_is_top_of_fabric,
+               my_level, i_am_top_of_fabric)
+        if cache.key == key and cache.generation == self.tie_packet_infos.generation:
+            changed_tie_ids = []
+        elif cache.key == key:
+            changed_tie_ids = self.tie_packet_infos.changed_tie_ids_since(cache.generation)
+        else:
+            changed_tie_ids = None
+        if changed_tie_ids is None:
+            # Look at every TIE in the TIE-DB
+            cache.full_count += 1
+            cache.tie_packet_infos.clear()
+            changed_tie_ids = self.tie_packet_infos.keys()
+            cache.max_headers = None
+        elif changed_tie_ids:
+            # Only look at the TIEs that changed since the TIDEs were cached
+            cache.incremental_count += 1
+        # The TIEs of which the header in the TIDE changed (or which were added to or removed from
+        # the TIDE)
+        affected_tie_ids = []
+        for tie_id in changed_tie_ids:
+            old_tie_packet_info = cache.tie_packet_infos.get(tie_id)
+            tie_packet_info = self.tie_packet_infos.get(tie_id)
+            if tie_packet_info is not None and self.include_tie_in_tide(
+                    tie_packet_info, neighbor_direction, neighbor_system_id, neighbor_level,
+                    neighbor_is_top_of_fabric, my_level, i_am_top_of_fabric):
+                cache.tie_packet_infos[tie_id] = tie_packet_info
+            else:
+                tie_packet_info = None
+                cache.tie_packet_infos.pop(tie_id, None)
+            if tie_packet_info is not old_tie_packet_info:
+                affected_tie_ids.append(tie_id)
+        cache.key = key
+        cache.generation = self.tie_packet_infos.generation
+        if cache.max_headers != max_headers:
+            cache.set_ranges(self.split_tide_ranges(cache.tie_packet_infos, max_headers))
+            cache.max_headers = max_headers
+        elif affected_tie_ids:
+            cache.set_ranges(self.resplit_tide_ranges(cache.ranges, cache.tie_packet_infos,
+                                                      affected_tie_ids, max_headers))
 
     @staticmethod
     def cli_summary_headers():
@@ -1152,6 +1316,9 @@ class Node:
         tab = intf.ties_ack_table()
         cli_session.print("Acknowledge queue:")
         cli_session.print(tab.to_string())
+        tab = intf.tire_batching_table()
+        cli_session.print("TIRE batching:")
+        cli_session.print(tab.to_string())
 
     def command_show_intf_security(self, cli_session, parameters):
         interface_name = parameters['interface']
@@ -1165,6 +1332,9 @@ class Node:
         cli_session.print("Nonces:")
         tab = intf.nonces_table()
         cli_session.print(tab.to_string())
+        cli_session.print("Outer Fingerprint Cache:")
+        tab = intf.outer_fingerprint_cache_table()
+        cli_session.print(tab.to_string())
         cli_session.print("Security Statistics:")
         tab = intf.security_stats_table(exclude_zero=False)
         cli_session.print(tab.to_string())
@@ -1203,6 +1373,9 @@ class Node:
         cli_session.print("Send TIDEs:")
         tab = intf.send_tides_table()
         cli_session.print(tab.to_string())
+        cli_session.print("TIDE Cache:")
+        tab = intf.tide_cache.stats_table()
+        cli_session.print(tab.to_string())
 
     def command_show_interface(self, cli_session, parameters):
         interface_name = parameters['interface']
@@ -1646,6 +1819,10 @@ class Node:
         self.store_tie_packet_info(packet_info)
 
     def store_tie_packet_info(self, tie_packet_info):
+        # A received TIE still refers to the receive buffer, which is about to be re-used
+        tie_packet_info.own_buffers()
+        # The flooding scope verdicts of the previous version (if any) no longer apply
+        tie_packet_info.flood_scope_verdicts = None
         tie_packet = tie_packet_info.protocol_packet.content.tie
         tie_id = tie_packet.header.tieid
         if tie_id in self.tie_packet_infos:
@@ -1656,7 +1833,7 @@ class Node:
         else:
             trigger_spf = True
             reason = "TIE " + packet_common.tie_id_str(tie_id) + " added"
-        self.tie_packet_infos[tie_id] = tie_packet_info
+        self.tie_packet_infos.store(tie_id, tie_packet_info)
         if self.is_same_level_tie(tie_packet):
             self.peer_node_tie_packet_infos[tie_packet.header.tieid] = tie_packet_info
             self.update_partially_conn_all_intfs()
@@ -1666,8 +1843,7 @@ class Node:
 
     def remove_tie(self, tie_id):
         # It is not an error to attempt to delete a TIE which is not in the database
-        if tie_id in self.tie_packet_infos:
-            del self.tie_packet_infos[tie_id]
+        if self.tie_packet_infos.remove(tie_id) is not None:
             reason = "TIE " + packet_common.tie_id_str(tie_id) + " removed"
             self.trigger_spf(reason)
         if tie_id in self.peer_node_tie_packet_infos:
@@ -1675,6 +1851,9 @@ class Node:
             self.update_partially_conn_all_intfs()
             self.regenerate_my_south_prefix_tie()
 
+    def forget_received_tides(self, rx_intf):
+        self._last_received_tide_end.pop(rx_intf, None)
+
     def find_tie_packet_info(self, tie_id):
         # Returns None if tie_id is not in database
         return self.tie_packet_infos.get(tie_id)
@@ -1689,25 +1868,42 @@ class Node:
             # TODO: Maybe do that when TIE is recevied and stored in tie-db?
             start_sending_tie_headers.append(db_tie_packet.header)
 
-    def process_rx_tide_packet(self, tide_packet):
-        request_tie_headers_lifetime = []
-        start_sending_tie_headers = []
-        stop_sending_tie_headers = []
+    def process_rx_tide_start_gap(self, tide_packet, rx_intf, start_sending_tie_headers):
         # It is assumed TIDEs are sent and received in increasing order or range. If we observe
         # a gap between the end of the range of the last TIDE (if any) and the start of the range
         # of this TIDE, then we must start sending all TIEs in our database that fall in that gap.
-        if tide_packet.start_range < self._last_received_tide_end:
+        # The neighbor may split its TIE-DB over many TIDEs (see split_tide_ranges), and different
+        # neighbors send their TIDEs independently, so the end of the last TIDE is kept per
+        # interface.
+        last_received_tide_end = self._last_received_tide_end.get(rx_intf)
+        if (last_received_tide_end is not None and
+                tide_packet.start_range < last_received_tide_end):
             # The neighbor has wrapped around: it has sent its last TIDE and is not sending the
             # first TIDE again (look for comment "wrap-around" in test_tie_db.py for an example)
             # Note - I am not completely happy with this rule since it may lead to unnecessarily
             # putting TIEs on the send queue if TIDEs are received out of order.
-            self._last_received_tide_end = self.MIN_TIE_ID
-        if tide_packet.start_range > self._last_received_tide_end:
+            last_received_tide_end = None
+        if last_received_tide_end is None:
+            # The gap starts at the beginning of the TIE-ID space (inclusive)
+            gap_start = self.MIN_TIE_ID
+            gap_start_inclusive = True
+        else:
+            # The gap starts after the end of the previous TIDE (the end itself was covered by the
+            # previous TIDE)
+            gap_start = last_received_tide_end
+            gap_start_inclusive = False
+        if tide_packet.start_range > gap_start:
             # There is a gap between the end of the previous TIDE and the start of this TIDE
             self.start_sending_db_ties_in_range(start_sending_tie_headers,
-                                                self._last_received_tide_end, True,
+                                                gap_start, gap_start_inclusive,
                                                 tide_packet.start_range, False)
-        self._last_received_tide_end = tide_packet.end_range
+        self._last_received_tide_end[rx_intf] = tide_packet.end_range
+
+    def process_rx_tide_packet(self, tide_packet, rx_intf=None):
+        request_tie_headers_lifetime = []
+        start_sending_tie_headers = []
+        stop_sending_tie_headers = []
+        self.process_rx_tide_start_gap(tide_packet, rx_intf, start_sending_tie_headers)
         # The first gap that we need to consider starts at start_range (inclusive)
         last_processed_tie_id = tide_packet.start_range
         minimum_inclusive = True
@@ -1858,7 +2054,8 @@ class Node:
             # Re-originate DB TIE with higher sequence number than the one in RX TIE
             db_tie_packet = db_tie_packet_info.protocol_packet.content.tie
             db_tie_packet.header.seq_nr = rx_tie_header.seq_nr + 1
-            self.store_tie_packet(db_tie_packet, db_tie_packet_info.rx_intf)
+            self.store_tie_packet(db_tie_packet, common.constants.default_lifetime,
+                                  db_tie_packet_info.rx_intf)
             return db_tie_packet.header
 
     def process_rx_tie_packet_info(self, rx_tie_packet_info):
@@ -1874,6 +2071,8 @@ class Node:
                 start_sending_tie_header = self.bump_own_tie(None, rx_tie_packet.header)
             else:
                 # We don't have this TIE in the database, store and ack it
+                if not packet_common.decode_lazy_tie_element(rx_tie_packet_info):
+                    return (None, None)
                 self.store_tie_packet_info(rx_tie_packet_info)
                 ack_tie_header = rx_tie_header
         else:
@@ -1893,6 +2092,8 @@ class Node:
                                                                  rx_tie_packet.header)
                 else:
                     # We did not originate the TIE, store the newer version and ack it
+                    if not packet_common.decode_lazy_tie_element(rx_tie_packet_info):
+                        return (None, None)
                     self.store_tie_packet_info(rx_tie_packet_info)
                     ack_tie_header = rx_tie_packet.header
                     # Flood the TIE
@@ -1929,7 +2130,59 @@ class Node:
                          to_node_system_id,
                          from_node_system_id,
                          from_node_level,
-                         from_node_is_top_of_fabric):
+                         from_node_is_top_of_fabric,
+                         tie_packet_info=None):
+        # The flooding scope rules are evaluated for every TIE and every neighbor, e.g. each time
+        # that the TIDEs are regenerated. For TIEs that are in the TIE-DB, the verdicts are
+        # memoized in the flood-scope index, which is kept with the stored version of the TIE
+        # (tie_packet_info, which is looked up in the TIE-DB if the caller doesn't have it at hand).
+        # Apart from the TIE itself, the verdict only depends on the class of the neighbor:
+        # direction, level, top-of-fabric flag, and whether the TIE is originated by the from-node.
+        # The one rule which depends on the system-id of the to-node (marked with [*]) is not
+        # memoized; it is cheap to evaluate anyway. The index is reset when a new version of the
+        # TIE is stored, and when the level of this node changes.
+        tie_id = tie_header.tieid
+        if (tie_id.direction == constants.DIR_SOUTH and
+                to_node_direction == constants.DIR_NORTH and
+                tie_id.tietype != common.ttypes.TIETypeType.NodeTIEType):
+            return self.evaluate_flood_scope(tie_header, to_node_direction, to_node_system_id,
+                                             from_node_system_id, from_node_level,
+                                             from_node_is_top_of_fabric)
+        if tie_packet_info is None:
+            tie_packet_info = self.tie_packet_infos.get(tie_id)
+            if tie_packet_info is None:
+                return self.evaluate_flood_scope(tie_header, to_node_direction, to_node_system_id,
+                                                 from_node_system_id, from_node_level,
+                                                 from_node_is_top_of_fabric)
+        neighbor_class = (to_node_direction,
+                          tie_id.originator == from_node_system_id,
+                          from_node_level,
+                          from_node_is_top_of_fabric)
+        verdicts = tie_packet_info.flood_scope_verdicts
+        if verdicts is None:
+            verdicts = {}
+            tie_packet_info.flood_scope_verdicts = verdicts
+        else:
+            verdict = verdicts.get(neighbor_class)
+            if verdict is not None:
+                return verdict
+        verdict = self.evaluate_flood_scope(tie_header, to_node_direction, to_node_system_id,
+                                            from_node_system_id, from_node_level,
+                                            from_node_is_top_of_fabric)
+        verdicts[neighbor_class] = verdict
+        return verdict
+
+    def clear_flood_scope_index(self):
+        for tie_packet_info in self.tie_packet_infos.values():
+            tie_packet_info.flood_scope_verdicts = None
+
+    def evaluate_flood_scope(self,
+                             tie_header,
+                             to_node_direction,
+                             to_node_system_id,
+                             from_node_system_id,
+                             from_node_level,
+                             from_node_is_top_of_fabric):
         # Note: there is exactly one rule below (the one marked with [*]) which actually depend on
         # the neighbor_system_id. If that rule wasn't there we would have been able to encode a TIDE
         # only one per direction (N, S, EW) instead of once per neighbor, and still follow all the
@@ -2025,14 +2278,16 @@ class Node:
                                        neighbor_system_id,
                                        node_system_id,
                                        node_level,
-                                       node_is_top_of_fabric):
+                                       node_is_top_of_fabric,
+                                       tie_packet_info=None):
         return self.is_flood_allowed(
             tie_header=tie_header,
             to_node_direction=neighbor_direction,
             to_node_system_id=neighbor_system_id,
             from_node_system_id=node_system_id,
             from_node_level=node_level,
-            from_node_is_top_of_fabric=node_is_top_of_fabric)
+            from_node_is_top_of_fabric=node_is_top_of_fabric,
+            tie_packet_info=tie_packet_info)
 
     def flood_allowed_from_nbr_to_node(self,
                                        tie_header,
@@ -2040,7 +2295,8 @@ class Node:
                                        neighbor_system_id,
                                        neighbor_level,
                                        neighbor_is_top_of_fabric,
-                                       node_system_id):
+                                       node_system_id,
+                                       tie_packet_info=None):
         if neighbor_direction == constants.DIR_SOUTH:
             neighbor_reverse_direction = constants.DIR_NORTH
         elif neighbor_direction == constants.DIR_NORTH:
@@ -2053,7 +2309,8 @@ class Node:
             to_node_system_id=node_system_id,
             from_node_system_id=neighbor_system_id,
             from_node_level=neighbor_level,
-            from_node_is_top_of_fabric=neighbor_is_top_of_fabric)
+            from_node_is_top_of_fabric=neighbor_is_top_of_fabric,
+            tie_packet_info=tie_packet_info)
 
     def unsol_flood_tie_packet_info(self, tie_packet_info):
         # Self-originated TIEs are not subject to unsolicited flooding
@@ -2079,7 +2336,8 @@ class Node:
                 tx_intf.neighbor.system_id,
                 tx_intf.neighbor.level,
                 tx_intf.neighbor.top_of_fabric(),
-                self.system_id)
+                self.system_id,
+                tie_packet_info)
             if not allowed:
                 continue
             # Put the packet on the transmit queue.
@@ -2090,13 +2348,113 @@ class Node:
             self.db_debug("TIE %s received on %s flooded to %d interfaces", tie_packet.header,
                           tie_packet_info.rx_intf.name, flood_count)
 
-    def generate_tide_packet(self,
-                             neighbor_direction,
-                             neighbor_system_id,
-                             neighbor_level,
-                             neighbor_is_top_of_fabric,
-                             my_level,
-                             i_am_top_of_fabric):
+    def generate_tide_packets(self,
+                              max_headers,
+                              neighbor_direction,
+                              neighbor_system_id,
+                              neighbor_level,
+                              neighbor_is_top_of_fabric,
+                              my_level,
+                              i_am_top_of_fabric):
+        # Generate the TIDE packets that together cover the entire TIE-ID space, each containing at
+        # most max_headers TIE headers.
+        #
+        # Look at every TIE in our database, and decide whether or not we want to include it in the
+        # TIDE packets. This is a rather expensive process, which is why the periodically sent
+        # TIDEs are cached (see cached_tide_packet_infos).
+        tie_packet_infos = sortedcontainers.SortedDict()
+        for tie_id, tie_packet_info in self.tie_packet_infos.items():
+            if self.include_tie_in_tide(tie_packet_info, neighbor_direction, neighbor_system_id,
+                                        neighbor_level, neighbor_is_top_of_fabric, my_level,
+                                        i_am_top_of_fabric):
+                tie_packet_infos[tie_id] = tie_packet_info
+        return [self.make_tide_packet(tide_range.start_range, tide_range.end_range,
+                                      tide_range.tie_packet_infos)
+                for tide_range in self.split_tide_ranges(tie_packet_infos, max_headers)]
+
+    def split_tide_ranges(self, tie_packet_infos, max_headers):
+        # Split the TIEs to be reported in TIDEs (a SortedDict of tie_packet_info indexed by tie_id)
+        # into ranges with at most max_headers TIEs each. The first range starts at MIN_TIE_ID, the
+        # last range ends at MAX_TIE_ID, and every other range starts at its first TIE and ends at
+        # its last TIE. The space between two consecutive ranges does not contain any TIE that we
+        # report, i.e. the neighbor treats it the same as missing headers in a TIDE.
+        ranges = self.split_tide_range(self.MIN_TIE_ID, list(tie_packet_infos.keys()),
+                                       list(tie_packet_infos.values()), max_headers)
+        return self.fix_outer_tide_ranges(ranges)
+
+    def resplit_tide_ranges(self, ranges, tie_packet_infos, affected_tie_ids, max_headers):
+        # Same as split_tide_ranges, but only split the ranges that cover the affected TIEs again.
+        # Each range covers the TIE-ID space from its start up to the start of the next range. The
+        # other ranges (and their encoded TIDEs) are kept as they are.
+        starts = [tide_range.start_range for tide_range in ranges]
+        affected_indexes = sorted({bisect.bisect_right(starts, tie_id) - 1
+                                   for tie_id in affected_tie_ids})
+        new_ranges = []
+        next_index = 0
+        for index in affected_indexes:
+            new_ranges.extend(ranges[next_index:index])
+            next_index = index + 1
+            if next_index < len(starts):
+                tie_ids = list(tie_packet_infos.irange(starts[index], starts[next_index],
+                                                       inclusive=(True, False)))
+            else:
+                tie_ids = list(tie_packet_infos.irange(starts[index]))
+            values = [tie_packet_infos[tie_id] for tie_id in tie_ids]
+            new_ranges.extend(self.split_tide_range(starts[index], tie_ids, values, max_headers))
+        new_ranges.extend(ranges[next_index:])
+        return self.fix_outer_tide_ranges(new_ranges)
+
+    @staticmethod
+    def split_tide_range(start_range, tie_ids, values, max_headers):
+        # Split the TIEs (sorted by tie_id) into ranges with at most max_headers TIEs each. The
+        # first range starts at start_range, every other range starts at its first TIE, and every
+        # range ends at its last TIE. No ranges are returned if there are no TIEs.
+        ranges = []
+        for start_index in range(0, len(tie_ids), max_headers):
+            end_index = min(start_index + max_headers, len(tie_ids))
+            if start_index > 0:
+                start_range = tie_ids[start_index]
+            ranges.append(tide_cache.TideRange(start_range, tie_ids[end_index - 1],
+                                               values[start_index:end_index]))
+        return ranges
+
+    def fix_outer_tide_ranges(self, ranges):
+        # Make the first range start at MIN_TIE_ID and the last range end at MAX_TIE_ID (replacing
+        # them by new ranges, which need to be encoded, if they don't). There is always at least
+        # one range, even if there are no TIEs.
+        if not ranges:
+            return [tide_cache.TideRange(self.MIN_TIE_ID, self.MAX_TIE_ID, [])]
+        first_range = ranges[0]
+        if first_range.start_range != self.MIN_TIE_ID:
+            ranges[0] = tide_cache.TideRange(self.MIN_TIE_ID, first_range.end_range,
+                                             first_range.tie_packet_infos)
+        last_range = ranges[-1]
+        if last_range.end_range != self.MAX_TIE_ID:
+            ranges[-1] = tide_cache.TideRange(last_range.start_range, self.MAX_TIE_ID,
+                                              last_range.tie_packet_infos)
+        return ranges
+
+    def make_tide_packet(self, start_range, end_range, tie_packet_infos):
+        # The tie_packet_infos must be sorted by tie_id
+        tide_packet = packet_common.make_tide_packet(
+            start_range=start_range,
+            end_range=end_range)
+        for tie_packet_info in tie_packet_infos:
+            packet_common.add_tie_header_to_tide(
+                tide_packet,
+                packet_common.expand_tie_header_with_lifetime(
+                    tie_packet_info.protocol_packet.content.tie.header,
+                    tie_packet_info.remaining_tie_lifetime))
+        return tide_packet
+
+    def include_tie_in_tide(self,
+                            tie_packet_info,
+                            neighbor_direction,
+                            neighbor_system_id,
+                            neighbor_level,
+                            neighbor_is_top_of_fabric,
+                            my_level,
+                            i_am_top_of_fabric):
         # The algorithm for deciding which TIE headers go into a TIDE packet are based on what is
         # described as "the solution to oscillation #1" in slide deck
         # http://bit.ly/rift-flooding-oscillations-v1. During the RIFT core team conference call on
@@ -2104,62 +2462,44 @@ class Node:
         # rules, but IMHO sections Table 3 / B.3.1. / B.3.2.1 in the draft are still ambiguous and
         # I am not sure if they specify the same behavior.
         #
-        # We generate a single TIDE packet which covers the entire range and we report all TIE
-        # headers in that single TIDE packet. We simple assume that it will fit in a single UDP
-        # packet which can be up to 64K. And if a single TIE gets added or removed we swallow the
-        # cost of regenerating and resending the entire TIDE packet.
-        tide_packet = packet_common.make_tide_packet(
-            start_range=self.MIN_TIE_ID,
-            end_range=self.MAX_TIE_ID)
-        # Look at every TIE in our database, and decide whether or not we want to include it in the
-        # TIDE packet. This is a rather expensive process, which is why we want to minimize the
-        # the number of times this function is run.
-        for tie_packet_info in self.tie_packet_infos.values():
-            tie_packet = tie_packet_info.protocol_packet.content.tie
-            tie_header = tie_packet.header
-            # The first possible reason for including a TIE header in the TIDE is to announce that
-            # we have a TIE that we want to send to the neighbor. In other words the TIE in the
-            # flooding scope from us to the neighbor.
-            (allowed, reason1) = self.flood_allowed_from_node_to_nbr(
-                tie_header,
-                neighbor_direction,
-                neighbor_system_id,
-                self.system_id,
-                my_level,
-                i_am_top_of_fabric)
-            if allowed:
-                self.db_debug("Include TIE %s in TIDE because %s (perspective us to neighbor)",
-                              tie_header, reason1)
-                packet_common.add_tie_header_to_tide(
-                    tide_packet,
-                    packet_common.expand_tie_header_with_lifetime(
-                        tie_header,
-                        tie_packet_info.remaining_tie_lifetime))
-                continue
-            # The second possible reason for including a TIE header in the TIDE is because the
-            # neighbor might be considering to send the TIE to us, and we want to let the neighbor
-            # know that we already have the TIE and what version it it.
-            (allowed, reason2) = self.flood_allowed_from_nbr_to_node(
-                tie_header,
-                neighbor_direction,
-                neighbor_system_id,
-                neighbor_level,
-                neighbor_is_top_of_fabric,
-                self.system_id)
-            if allowed:
-                self.db_debug("Include TIE %s in TIDE because %s (perspective neighbor to us)",
-                              tie_header, reason2)
-                packet_common.add_tie_header_to_tide(
-                    tide_packet,
-                    packet_common.expand_tie_header_with_lifetime(
-                        tie_header,
-                        tie_packet_info.remaining_tie_lifetime))
-                continue
-            # If we get here, we decided not to include the TIE header in the TIDE
-            self.db_debug("Exclude TIE %s from TIDE because %s (perspective us to neighbor) and "
-                          "%s (perspective neighbor to us)", tie_header, reason1, reason2)
-        return tide_packet
-
+        # Note that the decision only depends on the TIE itself (and the flooding scope parameters)
+        # and not on any other TIE in the TIE-DB. That is what allows the TIDE cache to only
+        # re-evaluate the TIEs that changed.
+        tie_header = tie_packet_info.protocol_packet.content.tie.header
+        # The first possible reason for including a TIE header in the TIDE is to announce that
+        # we have a TIE that we want to send to the neighbor. In other words the TIE in the
+        # flooding scope from us to the neighbor.
+        (allowed, reason1) = self.flood_allowed_from_node_to_nbr(
+            tie_header,
+            neighbor_direction,
+            neighbor_system_id,
+            self.system_id,
+            my_level,
+            i_am_top_of_fabric,
+            tie_packet_info)
+        if allowed:
+            self.db_debug("Include TIE %s in TIDE because %s (perspective us to neighbor)",
+                          tie_header, reason1)
+            return True
+        # The second possible reason for including a TIE header in the TIDE is because the
+        # neighbor might be considering to send the TIE to us, and we want to let the neighbor
+        # know that we already have the TIE and what version it it.
+        (allowed, reason2) = self.flood_allowed_from_nbr_to_node(
+            tie_header,
+            neighbor_direction,
+            neighbor_system_id,
+            neighbor_level,
+            neighbor_is_top_of_fabric,
+            self.system_id,
+            tie_packet_info)
+        if allowed:
+            self.db_debug("Include TIE %s in TIDE because %s (perspective neighbor to us)",
+                          tie_header, reason2)
+            return True
+        # If we get here, we decided not to include the TIE header in the TIDE
+        self.db_debug("Exclude TIE %s from TIDE because %s (perspective us to neighbor) and "
+                      "%s (perspective neighbor to us)", tie_header, reason1, reason2)
+        return False
 
     def check_sysid_partially_connected(self, look_for_sysid):
         # Check every other node and the same level, and if there is at least one other node that
@@ -2317,14 +2657,10 @@ class Node:
         return tab
 
     def age_ties(self):
-        expired_key_ids = []
-        for tie_id, tie_packet_info in self.tie_packet_infos.items():
-            tie_packet_info.remaining_tie_lifetime -= 1
-            if tie_packet_info.remaining_tie_lifetime <= 0:
-                expired_key_ids.append(tie_id)
-        for key_id in expired_key_ids:
+        # Only the TIEs that expire are touched, see TieDb.age
+        for tie_id in self.tie_packet_infos.age():
             # TODO: log a message
-            self.remove_tie(key_id)
+            self.remove_tie(tie_id)
 
     @staticmethod
     def cli_tie_db_summary_headers():
@@ -2383,7 +2719,7 @@ class Node:
         node_ties = []
         start_tie_id = packet_common.make_tie_id(direction, system_id, prefix_type, 0)
         end_tie_id = packet_common.make_tie_id(direction, system_id, prefix_type,
-                                               packet_common.MAX_U32)
+                                               packet_codec.MAX_U32)
         node_tie_ids = self.tie_packet_infos.irange(start_tie_id, end_tie_id, (True, True))
         for node_tie_id in node_tie_ids:
             node_tie_packet_info = self.tie_packet_infos[node_tie_id]
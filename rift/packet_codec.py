@@ -0,0 +1,700 @@
+import functools
+
+import thrift.protocol.TBinaryProtocol
+import thrift.protocol.TProtocol
+import thrift.transport.TTransport
+from thrift.Thrift import TType
+
+try:
+    from thrift.protocol import fastbinary
+except ImportError:
+    fastbinary = None
+
+import constants
+import encoding.ttypes
+
+# What follows are some horrible hacks to deal with the fact that Thrift only support signed 8, 16,
+# 32, and 64 bit numbers and not unsigned 8, 16, 32, and 64 bit numbers. The RIFT specification has
+# several fields are intended to contain an unsigned numbers, but that are actually specified in the
+# .thrift files as a signed numbers. Just look for the following text in the specification: "MUST be
+# interpreted in implementation as unsigned ..." where ... can be 8 bits, or 16 bits, or 32 bits, or
+# 64 bits. Keep in mind Python does not have sized integers: values of type int are unbounded (i.e.
+# they have no limit on the size and no minimum or maximum value).
+
+MAX_U64 = 0xffffffffffffffff
+MAX_S64 = 0x7fffffffffffffff
+
+MAX_U32 = 0xffffffff
+MAX_S32 = 0x7fffffff
+
+MAX_U16 = 0xffff
+MAX_S16 = 0x7fff
+
+MAX_U8 = 0xff
+MAX_S8 = 0x7f
+
+def u64_to_s64(u64):
+    return u64 if u64 <= MAX_S64 else u64 - MAX_U64 - 1
+
+def u32_to_s32(u32):
+    return u32 if u32 <= MAX_S32 else u32 - MAX_U32 - 1
+
+def u16_to_s16(u16):
+    return u16 if u16 <= MAX_S16 else u16 - MAX_U16 - 1
+
+def u8_to_s8(u08):
+    return u08 if u08 <= MAX_S8 else u08 - MAX_U8 - 1
+
+def s64_to_u64(s64):
+    return s64 if s64 >= 0 else s64 + MAX_U64 + 1
+
+def s32_to_u32(s32):
+    return s32 if s32 >= 0 else s32 + MAX_U32 + 1
+
+def s16_to_u16(s16):
+    return s16 if s16 >= 0 else s16 + MAX_U16 + 1
+
+def s8_to_u8(s08):
+    return s08 if s08 >= 0 else s08 + MAX_U8 + 1
+
+def fix_int(value, size, encode):
+    if encode:
+        # Fix before encode
+        if size == 8:
+            return u8_to_s8(value)
+        if size == 16:
+            return u16_to_s16(value)
+        if size == 32:
+            return u32_to_s32(value)
+        if size == 64:
+            return u64_to_s64(value)
+        assert False
+    else:
+        # Fix after decode
+        if size == 8:
+            return s8_to_u8(value)
+        if size == 16:
+            return s16_to_u16(value)
+        if size == 32:
+            return s32_to_u32(value)
+        if size == 64:
+            return s64_to_u64(value)
+        assert False
+    return value  # Unreachable, stop pylint from complaining about inconsistent-return-statements
+
+def fix_dict(old_dict, dict_fixes, encode):
+    (key_fixes, value_fixes) = dict_fixes
+    new_dict = {}
+    for the_key, value in old_dict.items():
+        new_key = fix_value(the_key, key_fixes, encode)
+        new_value = fix_value(value, value_fixes, encode)
+        new_dict[new_key] = new_value
+    return new_dict
+
+def fix_struct(fixed_struct, fixes, encode):
+    for fix in fixes:
+        (field_name, field_fix) = fix
+        if field_name in vars(fixed_struct):
+            field_value = getattr(fixed_struct, field_name)
+            if field_value is not None:
+                new_value = fix_value(field_value, field_fix, encode)
+                setattr(fixed_struct, field_name, new_value)
+    return fixed_struct
+
+def fix_set(old_set, fix, encode):
+    new_set = set()
+    for old_value in old_set:
+        new_value = fix_value(old_value, fix, encode)
+        new_set.add(new_value)
+    return new_set
+
+def fix_list(old_list, fix, encode):
+    new_list = []
+    for old_value in old_list:
+        new_value = fix_value(old_value, fix, encode)
+        new_list.append(new_value)
+    return new_list
+
+def fix_value(value, fix, encode):
+    if isinstance(value, set):
+        new_value = fix_set(value, fix, encode)
+    elif isinstance(value, list):
+        new_value = fix_list(value, fix, encode)
+    elif isinstance(fix, int):
+        new_value = fix_int(value, fix, encode)
+    elif isinstance(fix, tuple):
+        new_value = fix_dict(value, fix, encode)
+    elif isinstance(fix, list):
+        new_value = fix_struct(value, fix, encode)
+    else:
+        assert False
+    return new_value
+
+def fix_packet_before_encode(packet, fixes):
+    fix_struct(packet, fixes, True)
+
+def fix_packet_after_decode(packet, fixes):
+    fix_struct(packet, fixes, False)
+
+TIEID_FIXES = [
+    ('originator', 64), ('tie_nr', 32)
+]
+
+TIMESTAMP_FIXES = [
+    ('AS_sec', 64), ('AS_nsec', 32)
+]
+
+TIE_HEADER_FIXES = [
+    ('tieid', TIEID_FIXES), ('seq_nr', 32),
+    ('origination_time', TIMESTAMP_FIXES),
+    ('origination_lifetime', 32)
+]
+
+TIE_HEADER_WITH_LIFETIME_FIXES = [
+    ('header', TIE_HEADER_FIXES), ('remaining_lifetime', 32),
+]
+
+LINK_ID_PAIR_FIXES = [
+    ('local_id', 32),                      # Draft doesn't mention this needs to treated as unsigned
+    ('remote_id', 32)                      # Draft doesn't mention this needs to treated as unsigned
+]
+
+NODE_NEIGHBORS_TIE_ELEMENT_FIXES = [
+    ('level', 16), ('cost', 32), ('link_ids', LINK_ID_PAIR_FIXES), ('bandwidth', 32)
+]
+
+IP_PREFIX_FIXES = [
+    ('ipv4prefix', [
+        ('address', 32),
+        ('prefixlen', 8)                   # Draft doesn't mention this needs to treated as unsigned
+    ]),
+    ('ipv6prefix', [
+        ('prefixlen', 8)                   # Draft doesn't mention this needs to treated as unsigned
+    ])
+]
+
+PREFIX_ATTRIBUTES_FIXES = [
+    ('metric', 32), ('tags', 64),
+    ('monotonic_clock', [
+        ('timestamp', TIMESTAMP_FIXES), ('transactionid', 8)
+    ])
+]
+
+PREFIX_TIE_ELEMENT_FIXES = [
+    ('prefixes', (IP_PREFIX_FIXES, PREFIX_ATTRIBUTES_FIXES))
+]
+
+PROTOCOL_PACKET_FIXES = [
+    ('header', [
+        ('major_version', 16), ('minor_version', 16),
+        ('sender', 64), ('level', 16)]),
+    ('content', [
+        ('lie', [
+            ('local_id', 32),              # Draft doesn't mention this needs to treated as unsigned
+            ('flood_port', 16), ('link_mtu_size', 32), ('link_bandwidth', 32),
+            ('neighbor', [
+                ('originator', 64),
+                ('remote_id', 32)          # Draft doesn't mention this needs to treated as unsigned
+            ]),
+            ('pod', 32),
+            ('holdtime', 16),              # Draft doesn't mention this needs to treated as unsigned
+            ('label', 32)]),
+        ('tide', [
+            ('start_range', TIEID_FIXES),
+            ('end_range', TIEID_FIXES),
+            ('headers', TIE_HEADER_WITH_LIFETIME_FIXES)
+        ]),
+        ('tire', [
+            ('headers', TIE_HEADER_WITH_LIFETIME_FIXES)
+        ]),
+        ('tie', [
+            ('header', TIE_HEADER_FIXES),
+            ('element', [
+                ('node', [
+                    ('level', 16),
+                    ('neighbors', (64, NODE_NEIGHBORS_TIE_ELEMENT_FIXES))
+                ]),
+                ('prefixes', PREFIX_TIE_ELEMENT_FIXES),
+                ('positive_disaggregation_prefixes', PREFIX_TIE_ELEMENT_FIXES),
+                ('negative_disaggregation_prefixes', PREFIX_TIE_ELEMENT_FIXES),
+                ('external_prefixes', PREFIX_TIE_ELEMENT_FIXES),
+            ])
+        ])
+    ])
+]
+
+def fix_prot_packet_before_encode(protocol_packet):
+    fix_packet_before_encode(protocol_packet, PROTOCOL_PACKET_FIXES)
+
+def fix_prot_packet_after_decode(protocol_packet):
+    # Same as fix_packet_after_decode(protocol_packet, PROTOCOL_PACKET_FIXES), but faster
+    _fix_protocol_packet_after_decode(protocol_packet)
+
+# The copy-free encoder writes a protocol packet directly to a Thrift protocol, applying the
+# unsigned to signed fixes (see PROTOCOL_PACKET_FIXES) to each value as it is written, instead of
+# making a deep copy of the packet and fixing the copy. It produces the same bytes as the generated
+# Thrift write methods. The encoder is compiled once from the thrift_spec of the generated classes
+# and the fixes into a tree of writer functions; each writer function has signature
+# writer(protocol_out, value).
+
+_INT_FIXERS = {
+    8: u8_to_s8,
+    16: u16_to_s16,
+    32: u32_to_s32,
+    64: u64_to_s64
+}
+
+_BASE_TYPE_WRITE_METHODS = {
+    TType.BOOL: 'writeBool',
+    TType.BYTE: 'writeByte',
+    TType.I16: 'writeI16',
+    TType.I32: 'writeI32',
+    TType.I64: 'writeI64',
+    TType.DOUBLE: 'writeDouble'
+}
+
+def _compile_base_type_writer(ttype, type_spec, fix):
+    if ttype == TType.STRING:
+        if type_spec == 'BINARY':
+            method_name = 'writeBinary'
+        else:
+            method_name = 'writeString'
+    else:
+        method_name = _BASE_TYPE_WRITE_METHODS[ttype]
+    if fix is None:
+        def write_value(protocol_out, value):
+            getattr(protocol_out, method_name)(value)
+    else:
+        assert isinstance(fix, int)
+        fixer = _INT_FIXERS[fix]
+        def write_value(protocol_out, value):
+            getattr(protocol_out, method_name)(fixer(value))
+    return write_value
+
+def _compile_set_or_list_writer(ttype, type_spec, fix):
+    (element_ttype, element_type_spec, _) = type_spec
+    # As in fix_value, the fix for a set or list applies to each element
+    write_element = _compile_value_writer(element_ttype, element_type_spec, fix)
+    if ttype == TType.SET:
+        def write_set(protocol_out, value):
+            protocol_out.writeSetBegin(element_ttype, len(value))
+            for element in value:
+                write_element(protocol_out, element)
+            protocol_out.writeSetEnd()
+        return write_set
+    def write_list(protocol_out, value):
+        protocol_out.writeListBegin(element_ttype, len(value))
+        for element in value:
+            write_element(protocol_out, element)
+        protocol_out.writeListEnd()
+    return write_list
+
+def _compile_map_writer(type_spec, fix):
+    (key_ttype, key_type_spec, value_ttype, value_type_spec, _) = type_spec
+    if fix is None:
+        (key_fix, value_fix) = (None, None)
+    else:
+        (key_fix, value_fix) = fix
+    write_key = _compile_value_writer(key_ttype, key_type_spec, key_fix)
+    write_value = _compile_value_writer(value_ttype, value_type_spec, value_fix)
+    def write_map(protocol_out, value):
+        protocol_out.writeMapBegin(key_ttype, value_ttype, len(value))
+        for (the_key, the_value) in value.items():
+            write_key(protocol_out, the_key)
+            write_value(protocol_out, the_value)
+        protocol_out.writeMapEnd()
+    return write_map
+
+def _compile_struct_writer(struct_class, fixes):
+    if fixes is None:
+        fixes = []
+    fixes_by_field_name = dict(fixes)
+    # The generated write methods write the fields in field id order, which is the order of the
+    # thrift_spec
+    field_writers = []
+    for field_spec in struct_class.thrift_spec:
+        if field_spec is None:
+            continue
+        (field_id, field_ttype, field_name, field_type_spec, _) = field_spec
+        write_field_value = _compile_value_writer(field_ttype, field_type_spec,
+                                                  fixes_by_field_name.pop(field_name, None))
+        field_writers.append((field_name, field_ttype, field_id, write_field_value))
+    assert not fixes_by_field_name, \
+        "Fixes for unknown fields {} in {}".format(list(fixes_by_field_name), struct_class)
+    struct_name = struct_class.__name__
+    def write_struct(protocol_out, value):
+        protocol_out.writeStructBegin(struct_name)
+        for (field_name, field_ttype, field_id, write_field_value) in field_writers:
+            field_value = getattr(value, field_name)
+            if field_value is not None:
+                protocol_out.writeFieldBegin(field_name, field_ttype, field_id)
+                write_field_value(protocol_out, field_value)
+                protocol_out.writeFieldEnd()
+        protocol_out.writeFieldStop()
+        protocol_out.writeStructEnd()
+    return write_struct
+
+def _compile_value_writer(ttype, type_spec, fix):
+    if ttype == TType.STRUCT:
+        (struct_class, _) = type_spec
+        return _compile_struct_writer(struct_class, fix)
+    if ttype in (TType.SET, TType.LIST):
+        return _compile_set_or_list_writer(ttype, type_spec, fix)
+    if ttype == TType.MAP:
+        return _compile_map_writer(type_spec, fix)
+    return _compile_base_type_writer(ttype, type_spec, fix)
+
+_write_protocol_packet = _compile_struct_writer(encoding.ttypes.ProtocolPacket,
+                                                PROTOCOL_PACKET_FIXES)
+
+def write_protocol_packet(protocol_packet, protocol_out):
+    # Does not modify protocol_packet
+    _write_protocol_packet(protocol_out, protocol_packet)
+
+# The fast codec uses the C extension module fastbinary (which comes with the Thrift library when
+# it is built with a C compiler) to encode and decode protocol packets. Since the C extension does
+# not know that some fields are unsigned, the fixes are applied by functions compiled from
+# PROTOCOL_PACKET_FIXES: before encoding, a copy of the packet is made in which only the structs,
+# sets, lists, and maps on the path to a fixed field are copied (everything else is shared with
+# the original packet); after decoding, the fields are fixed in place. The pure Python codec
+# (the copy-free encoder and the generated read methods) is used when the C extension is not
+# available.
+
+_DECODE_INT_FIXERS = {
+    8: s8_to_u8,
+    16: s16_to_u16,
+    32: s32_to_u32,
+    64: s64_to_u64
+}
+
+def _compile_value_fixer(ttype, type_spec, fix, int_fixers, copy_structs):
+    # Returns a function which returns the fixed value, or None if the value does not need fixing
+    if fix is None:
+        return None
+    if ttype == TType.STRUCT:
+        (struct_class, _) = type_spec
+        return _compile_struct_fixer(struct_class, fix, int_fixers, copy_structs)
+    if ttype in (TType.SET, TType.LIST):
+        (element_ttype, element_type_spec, _) = type_spec
+        fix_element = _compile_value_fixer(element_ttype, element_type_spec, fix, int_fixers,
+                                           copy_structs)
+        if ttype == TType.SET:
+            # The set must be rebuilt, since fixing the elements changes their hash
+            return lambda value: {fix_element(element) for element in value}
+        return lambda value: [fix_element(element) for element in value]
+    if ttype == TType.MAP:
+        (key_ttype, key_type_spec, value_ttype, value_type_spec, _) = type_spec
+        (key_fix, value_fix) = fix
+        fix_key = _compile_value_fixer(key_ttype, key_type_spec, key_fix, int_fixers,
+                                       copy_structs)
+        fix_value_ = _compile_value_fixer(value_ttype, value_type_spec, value_fix, int_fixers,
+                                          copy_structs)
+        if fix_key is None:
+            return lambda value: {the_key: fix_value_(the_value)
+                                  for (the_key, the_value) in value.items()}
+        if fix_value_ is None:
+            return lambda value: {fix_key(the_key): the_value
+                                  for (the_key, the_value) in value.items()}
+        return lambda value: {fix_key(the_key): fix_value_(the_value)
+                              for (the_key, the_value) in value.items()}
+    assert isinstance(fix, int)
+    return int_fixers[fix]
+
+def _compile_struct_fixer(struct_class, fixes, int_fixers, copy_structs):
+    field_types = {field_spec[2]: (field_spec[1], field_spec[3])
+                   for field_spec in struct_class.thrift_spec if field_spec is not None}
+    field_fixers = []
+    for (field_name, field_fix) in fixes:
+        (field_ttype, field_type_spec) = field_types[field_name]
+        fix_field = _compile_value_fixer(field_ttype, field_type_spec, field_fix, int_fixers,
+                                         copy_structs)
+        field_fixers.append((field_name, fix_field))
+    if copy_structs:
+        def fix_struct_copy(value):
+            new_value = object.__new__(struct_class)
+            new_fields = new_value.__dict__
+            new_fields.update(value.__dict__)
+            for (field_name, fix_field) in field_fixers:
+                # Use getattr because the element of a lazy TIE packet is not in __dict__ until
+                # it has been decoded
+                field_value = getattr(value, field_name, None)
+                if field_value is not None:
+                    new_fields[field_name] = fix_field(field_value)
+            return new_value
+        return fix_struct_copy
+    def fix_struct_in_place(value):
+        # Fields that are not in __dict__ (e.g. the element of a lazy TIE packet that has not been
+        # decoded yet) are not fixed
+        fields = value.__dict__
+        for (field_name, fix_field) in field_fixers:
+            field_value = fields.get(field_name)
+            if field_value is not None:
+                fields[field_name] = fix_field(field_value)
+        return value
+    return fix_struct_in_place
+
+def _compile_fast_type_spec(ttype, type_spec, struct_specs):
+    # The generated code uses (class, thrift_spec) tuples for struct type arguments, but the C
+    # extension requires [class, thrift_spec] lists
+    if ttype == TType.STRUCT:
+        (struct_class, _) = type_spec
+        return [struct_class, _compile_fast_struct_spec(struct_class, struct_specs)]
+    if ttype in (TType.SET, TType.LIST):
+        (element_ttype, element_type_spec, is_binary) = type_spec
+        return (element_ttype,
+                _compile_fast_type_spec(element_ttype, element_type_spec, struct_specs),
+                is_binary)
+    if ttype == TType.MAP:
+        (key_ttype, key_type_spec, value_ttype, value_type_spec, is_binary) = type_spec
+        return (key_ttype,
+                _compile_fast_type_spec(key_ttype, key_type_spec, struct_specs),
+                value_ttype,
+                _compile_fast_type_spec(value_ttype, value_type_spec, struct_specs),
+                is_binary)
+    return type_spec
+
+def _compile_fast_struct_spec(struct_class, struct_specs):
+    if struct_class not in struct_specs:
+        fast_spec = []
+        for field_spec in struct_class.thrift_spec:
+            if field_spec is None:
+                fast_spec.append(None)
+            else:
+                (field_id, field_ttype, field_name, field_type_spec, default) = field_spec
+                fast_type_spec = _compile_fast_type_spec(field_ttype, field_type_spec,
+                                                         struct_specs)
+                fast_spec.append((field_id, field_ttype, field_name, fast_type_spec, default))
+        struct_specs[struct_class] = tuple(fast_spec)
+    return struct_specs[struct_class]
+
+_copy_and_fix_protocol_packet_before_encode = _compile_struct_fixer(
+    encoding.ttypes.ProtocolPacket, PROTOCOL_PACKET_FIXES, _INT_FIXERS, True)
+
+_fix_protocol_packet_after_decode = _compile_struct_fixer(
+    encoding.ttypes.ProtocolPacket, PROTOCOL_PACKET_FIXES, _DECODE_INT_FIXERS, False)
+
+_FAST_PROTOCOL_PACKET_SPEC = [
+    encoding.ttypes.ProtocolPacket,
+    _compile_fast_struct_spec(encoding.ttypes.ProtocolPacket, {})
+]
+
+FAST_CODEC_AVAILABLE = fastbinary is not None
+
+_SELECTED_CODEC = constants.CODEC_FAST if FAST_CODEC_AVAILABLE else constants.CODEC_PYTHON
+
+def select_codec(codec):
+    # Returns the codec that is actually selected, which is the pure Python codec if the fast
+    # codec is requested but not available
+    # pylint:disable=global-statement
+    global _SELECTED_CODEC
+    assert codec in constants.CODECS
+    if codec == constants.CODEC_FAST and not FAST_CODEC_AVAILABLE:
+        codec = constants.CODEC_PYTHON
+    _SELECTED_CODEC = codec
+    return codec
+
+def selected_codec():
+    return _SELECTED_CODEC
+
+def encode_protocol_packet_bytes(protocol_packet):
+    # Does not modify protocol_packet
+    if _SELECTED_CODEC == constants.CODEC_FAST:
+        fixed_protocol_packet = _copy_and_fix_protocol_packet_before_encode(protocol_packet)
+        return fastbinary.encode_binary(fixed_protocol_packet, _FAST_PROTOCOL_PACKET_SPEC)
+    transport_out = thrift.transport.TTransport.TMemoryBuffer()
+    protocol_out = thrift.protocol.TBinaryProtocol.TBinaryProtocol(transport_out)
+    write_protocol_packet(protocol_packet, protocol_out)
+    return transport_out.getvalue()
+
+# The exceptions that decoding a malformed protocol packet may raise. The pure Python codec raises
+# Thrift protocol and transport exceptions, the C extension raises built-in exceptions (e.g.
+# TypeError for an unexpected field type or OverflowError for a bad length), both raise EOFError
+# for a truncated packet, and hashing a decoded IP prefix (a map key) that has neither an IPv4 nor
+# an IPv6 prefix fails an assertion.
+DECODE_EXCEPTIONS = (thrift.protocol.TProtocol.TProtocolException,
+                     thrift.transport.TTransport.TTransportException,
+                     EOFError,
+                     TypeError,
+                     ValueError,
+                     OverflowError,
+                     AssertionError)
+
+def decode_protocol_packet_bytes(encoded_protocol_packet, lazy_tie_element=False):
+    # Returns the decoded protocol packet, without fixing it and without validating it. Raises one
+    # of DECODE_EXCEPTIONS if the encoded protocol packet cannot be decoded. If lazy_tie_element is
+    # True and the protocol packet contains a TIE, the TIE is returned as a LazyTIEPacket of which
+    # the element is not decoded yet.
+    transport_in = thrift.transport.TTransport.TMemoryBuffer(encoded_protocol_packet)
+    protocol_in = thrift.protocol.TBinaryProtocol.TBinaryProtocol(transport_in)
+    if lazy_tie_element:
+        if _SELECTED_CODEC == constants.CODEC_FAST:
+            protocol_packet = encoding.ttypes.ProtocolPacket()
+            fastbinary.decode_binary(protocol_packet, protocol_in, _FAST_LAZY_PROTOCOL_PACKET_SPEC)
+        else:
+            protocol_packet = _read_lazy_protocol_packet(protocol_in)
+        if protocol_packet.content is not None and protocol_packet.content.tie is not None:
+            protocol_packet.content.tie.set_encoded_protocol_packet(encoded_protocol_packet)
+        return protocol_packet
+    protocol_packet = encoding.ttypes.ProtocolPacket()
+    if _SELECTED_CODEC == constants.CODEC_FAST:
+        fastbinary.decode_binary(protocol_packet, protocol_in, _FAST_PROTOCOL_PACKET_SPEC)
+    else:
+        protocol_packet.read(protocol_in)
+    return protocol_packet
+
+# Lazy TIE element decoding: when a TIE is received, only the TIE header is decoded up front. The
+# TIE element (which may contain thousands of prefixes) is only decoded when it is accessed for the
+# first time. This avoids decoding the element of TIEs that turn out to be duplicates or older
+# versions of TIEs that are already in the TIE-DB, which are the majority of received TIEs when
+# there are multiple flooding paths. Lazy decoding is disabled by default; it is enabled with
+# set_lazy_tie_decode (the --lazy-tie-decode command-line option).
+
+_LAZY_TIE_DECODE = False
+
+def set_lazy_tie_decode(enabled):
+    # pylint:disable=global-statement
+    global _LAZY_TIE_DECODE
+    _LAZY_TIE_DECODE = enabled
+
+def lazy_tie_decode():
+    return _LAZY_TIE_DECODE
+
+class LazyTIEPacket(encoding.ttypes.TIEPacket):
+
+    # A TIE packet of which the element has not been decoded yet. The element attribute is not
+    # set until the element is decoded (which happens in __getattr__ when the element is accessed
+    # for the first time). From then on, the object behaves exactly like a TIEPacket.
+
+    def __init__(self, header=None):
+        # pylint:disable=super-init-not-called
+        # Don't call TIEPacket.__init__, which would set the element attribute
+        self.header = header
+        # The complete encoded protocol packet from which the element is decoded (removed once the
+        # element has been decoded)
+        self._encoded_protocol_packet = None
+
+    def set_encoded_protocol_packet(self, encoded_protocol_packet):
+        self._encoded_protocol_packet = encoded_protocol_packet
+
+    def element_decoded(self):
+        return 'element' in self.__dict__
+
+    def decode_element(self):
+        # Decodes the element from the complete encoded protocol packet. Raises an exception if the
+        # element cannot be decoded; in that case the element is set to None.
+        fields = self.__dict__
+        if 'element' in fields:
+            return
+        encoded_protocol_packet = fields.pop('_encoded_protocol_packet', None)
+        fields['element'] = None
+        if encoded_protocol_packet is None:
+            return
+        protocol_packet = decode_protocol_packet_bytes(encoded_protocol_packet)
+        tie_packet = protocol_packet.content.tie
+        if tie_packet.element is not None:
+            _fix_tie_element_after_decode(tie_packet.element)
+        fields['element'] = tie_packet.element
+
+    def __getattr__(self, name):
+        # Only called for attributes which are not set, which is the case for the element until it
+        # has been decoded
+        if name != 'element':
+            raise AttributeError(name)
+        try:
+            self.decode_element()
+        except DECODE_EXCEPTIONS:
+            pass
+        return self.__dict__['element']
+
+    def __eq__(self, other):
+        self.decode_element()
+        if isinstance(other, LazyTIEPacket):
+            other.decode_element()
+        return isinstance(other, encoding.ttypes.TIEPacket) and self.__dict__ == other.__dict__
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(encoding.ttypes.TIEPacket(header=self.header, element=self.element))
+
+def _fix_list_for_field(fixes, field_name):
+    for (name, fix) in fixes:
+        if name == field_name:
+            return fix
+    assert False, "No fixes for field " + field_name
+    return None  # Unreachable, stop pylint from complaining about inconsistent-return-statements
+
+_fix_tie_element_after_decode = _compile_struct_fixer(
+    encoding.ttypes.TIEElement,
+    _fix_list_for_field(_fix_list_for_field(_fix_list_for_field(PROTOCOL_PACKET_FIXES, 'content'),
+                                            'tie'),
+                        'element'),
+    _DECODE_INT_FIXERS, False)
+
+def _replace_fast_field_type_spec(fast_struct_spec, field_name, fast_type_spec):
+    new_fast_struct_spec = []
+    for field_spec in fast_struct_spec:
+        if field_spec is not None and field_spec[2] == field_name:
+            if fast_type_spec is None:
+                # The C extension skips fields without spec
+                field_spec = None
+            else:
+                (field_id, field_ttype, _, _, default) = field_spec
+                field_spec = (field_id, field_ttype, field_name, fast_type_spec, default)
+        new_fast_struct_spec.append(field_spec)
+    return tuple(new_fast_struct_spec)
+
+def _compile_fast_lazy_protocol_packet_spec():
+    fast_struct_specs = {}
+    _compile_fast_struct_spec(encoding.ttypes.ProtocolPacket, fast_struct_specs)
+    lazy_tie_spec = _replace_fast_field_type_spec(
+        fast_struct_specs[encoding.ttypes.TIEPacket], 'element', None)
+    content_spec = _replace_fast_field_type_spec(
+        fast_struct_specs[encoding.ttypes.PacketContent], 'tie', [LazyTIEPacket, lazy_tie_spec])
+    packet_spec = _replace_fast_field_type_spec(
+        fast_struct_specs[encoding.ttypes.ProtocolPacket], 'content',
+        [encoding.ttypes.PacketContent, content_spec])
+    return [encoding.ttypes.ProtocolPacket, packet_spec]
+
+_FAST_LAZY_PROTOCOL_PACKET_SPEC = _compile_fast_lazy_protocol_packet_spec()
+
+def _read_field_by_ttype(ttype, type_spec, protocol_in):
+    return protocol_in.readFieldByTType(ttype, type_spec)
+
+def _compile_python_struct_reader(struct_class, field_readers):
+    # Returns a function which reads a struct of the given class from a Thrift protocol. The fields
+    # in field_readers are read by the given reader function, or skipped if the reader function is
+    # None. All other fields are read by the generated code.
+    readers = {}
+    for field_spec in struct_class.thrift_spec:
+        if field_spec is None:
+            continue
+        (field_id, field_ttype, field_name, field_type_spec, _) = field_spec
+        if field_name in field_readers:
+            read_field = field_readers[field_name]
+        else:
+            read_field = functools.partial(_read_field_by_ttype, field_ttype, field_type_spec)
+        readers[(field_id, field_ttype)] = (field_name, read_field)
+    def read_struct(protocol_in):
+        struct_value = struct_class()
+        protocol_in.readStructBegin()
+        while True:
+            (_, field_ttype, field_id) = protocol_in.readFieldBegin()
+            if field_ttype == TType.STOP:
+                break
+            (field_name, read_field) = readers.get((field_id, field_ttype), (None, None))
+            if read_field is None:
+                protocol_in.skip(field_ttype)
+            else:
+                setattr(struct_value, field_name, read_field(protocol_in))
+            protocol_in.readFieldEnd()
+        protocol_in.readStructEnd()
+        return struct_value
+    return read_struct
+
+_read_lazy_protocol_packet = _compile_python_struct_reader(
+    encoding.ttypes.ProtocolPacket,
+    {'content': _compile_python_struct_reader(
+        encoding.ttypes.PacketContent,
+        {'tie': _compile_python_struct_reader(LazyTIEPacket, {'element': None})})})
@@ -1,21 +1,63 @@
-import copy
 import ipaddress
 import struct
 
 import sortedcontainers
-import thrift.protocol.TBinaryProtocol
-import thrift.transport.TTransport
+import thrift.protocol.TProtocol
 
 import common.ttypes
 import constants
 import encoding.ttypes
 import encoding.constants
 import key
+import packet_codec
 import utils
 
 RIFT_MAGIC = 0xA1F7
 
-class PacketInfo:
+# Granularity (in seconds) of the remaining TIE lifetime that is advertised in the outer security
+# envelope when outer fingerprints are cached (see PacketInfo.update_outer_sec_env_header)
+OUTER_FINGERPRINT_LIFETIME_BUCKET = 10
+
+class TieLifetime:
+
+    # The remaining lifetime of a TIE (base class of PacketInfo). While the TIE is stored in the
+    # TIE-DB, its lifetime is not decremented every second. Instead, the TIE-DB records the time at
+    # which the TIE expires, and the remaining lifetime is derived from the expire time and the
+    # current aging time of the TIE-DB when it is needed (see tie_db.TieDb).
+
+    __slots__ = ["_remaining_tie_lifetime", "_aging_tie_db", "_expire_time"]
+
+    def __init__(self, remaining_tie_lifetime=None):
+        self._remaining_tie_lifetime = remaining_tie_lifetime
+        self._aging_tie_db = None
+        self._expire_time = None
+
+    @property
+    def remaining_tie_lifetime(self):
+        if self._aging_tie_db is None:
+            return self._remaining_tie_lifetime
+        return self._expire_time - self._aging_tie_db.aging_time
+
+    @remaining_tie_lifetime.setter
+    def remaining_tie_lifetime(self, remaining_tie_lifetime):
+        assert self._aging_tie_db is None, "Lifetime of TIE in TIE-DB is derived from expire time"
+        self._remaining_tie_lifetime = remaining_tie_lifetime
+
+    def aging(self):
+        return self._aging_tie_db is not None
+
+    def start_aging(self, tie_db, expire_time):
+        self._aging_tie_db = tie_db
+        self._expire_time = expire_time
+
+    def stop_aging(self):
+        # Freeze the remaining lifetime, e.g. when the TIE is removed from the TIE-DB
+        if self._aging_tie_db is not None:
+            self._remaining_tie_lifetime = self.remaining_tie_lifetime
+            self._aging_tie_db = None
+            self._expire_time = None
+
+class PacketInfo(TieLifetime):
 
     ERR_MSG_TOO_SHORT = "Message too short"
     ERR_WRONG_MAGIC = "Wrong magic value"
@@ -55,6 +97,7 @@ class PacketInfo:
         ERR_REFLECTED_NONCE_OUT_OF_SYNC]
 
     def __init__(self):
+        super().__init__()
         # Where was the message received from?
         self.rx_intf = None
         self.address_family = None
@@ -74,7 +117,7 @@ class PacketInfo:
         self.outer_key_id = None
         self.nonce_local = None
         self.nonce_remote = None
-        self.remaining_tie_lifetime = None
+        # (The remaining TIE lifetime is kept by the TieLifetime base class)
         self.outer_fingerprint_len = None
         self.outer_fingerprint = None
         # Origin security envelope header
@@ -82,6 +125,9 @@ class PacketInfo:
         self.origin_key_id = None
         self.origin_fingerprint_len = None
         self.origin_fingerprint = None
+        # For a TIE stored in the TIE-DB: the flooding scope verdicts for this version of the TIE,
+        # indexed by neighbor class (see Node.is_flood_allowed)
+        self.flood_scope_verdicts = None
 
     def __str__(self):
         result_str = ""
@@ -122,21 +168,64 @@ class PacketInfo:
                     self.outer_sec_env_header,
                     self.encoded_protocol_packet]
 
+    def own_buffers(self):
+        # A received message is decoded without copying anything out of the receive buffer: the
+        # headers, fingerprints, and encoded protocol packet are memoryviews into the receive
+        # buffer, which is re-used for the next message once the receive batch has been processed
+        # (see udp_rx_handler). Hence, the packet info must take a copy of its buffers before it is
+        # kept any longer than that, which is only the case when a TIE is stored in the TIE-DB.
+        if not isinstance(self.encoded_protocol_packet, memoryview):
+            return
+        self.env_header = bytes(self.env_header)
+        self.outer_sec_env_header = bytes(self.outer_sec_env_header)
+        self.outer_fingerprint = bytes(self.outer_fingerprint)
+        if self.origin_sec_env_header is not None:
+            self.origin_sec_env_header = bytes(self.origin_sec_env_header)
+            self.origin_fingerprint = bytes(self.origin_fingerprint)
+        self.encoded_protocol_packet = bytes(self.encoded_protocol_packet)
+        tie_packet = self.protocol_packet.content.tie if self.protocol_packet else None
+        if isinstance(tie_packet, packet_codec.LazyTIEPacket) and not tie_packet.element_decoded():
+            tie_packet.set_encoded_protocol_packet(self.encoded_protocol_packet)
+
     def update_env_header(self, packet_nr):
         self.packet_nr = packet_nr
         self.env_header = struct.pack("!HH", RIFT_MAGIC, packet_nr)
 
+    def outer_fingerprint_cache_key(self, outer_key_id, post):
+        # Identify the packet by its contents rather than by this packet info, so that the cache
+        # does not keep packet infos alive after they have been superseded. A TIE is identified by
+        # its TIE-ID and sequence number, any other packet by a hash of its encoding. Collisions
+        # are harmless since the cache compares the full message before re-using a fingerprint.
+        if self.packet_type == constants.PACKET_TYPE_TIE:
+            tie_header = self.protocol_packet.content.tie.header
+            return (tie_id_tup(tie_header.tieid), tie_header.seq_nr, outer_key_id, post)
+        return (self.packet_type, hash(self.encoded_protocol_packet), outer_key_id, post)
+
     def update_outer_sec_env_header(self, outer_key, nonce_local, nonce_remote,
-                                    remaining_lifetime=None):
+                                    remaining_lifetime=None, fingerprint_cache=None):
+        # If a fingerprint_cache is given, the outer fingerprint is re-used from the cache when the
+        # same packet is sent again with the same nonces and lifetime. To make that happen more
+        # often, the advertised lifetime is rounded down to a multiple of
+        # OUTER_FINGERPRINT_LIFETIME_BUCKET seconds.
         if remaining_lifetime:
             remaining_tie_lifetime = remaining_lifetime
         else:
             remaining_tie_lifetime = 0xffffffff
-        post = struct.pack("!HHL", nonce_local, nonce_remote, remaining_tie_lifetime)
+        use_cache = (fingerprint_cache is not None) and outer_key and (outer_key.key_id != 0)
+        if use_cache:
+            advertised_lifetime = lifetime_bucket(remaining_tie_lifetime)
+        else:
+            advertised_lifetime = remaining_tie_lifetime
+        post = struct.pack("!HHL", nonce_local, nonce_remote, advertised_lifetime)
         if outer_key:
             self.outer_key_id = outer_key.key_id
-            self.outer_fingerprint = outer_key.padded_digest(
-                [post, self.origin_sec_env_header, self.encoded_protocol_packet])
+            message_parts = [post, self.origin_sec_env_header, self.encoded_protocol_packet]
+            if use_cache:
+                cache_key = self.outer_fingerprint_cache_key(outer_key.key_id, post)
+                self.outer_fingerprint = outer_key.cached_padded_digest(
+                    fingerprint_cache, cache_key, message_parts)
+            else:
+                self.outer_fingerprint = outer_key.padded_digest(message_parts)
             self.outer_fingerprint_len = len(self.outer_fingerprint) // 4
         else:
             self.outer_key_id = 0
@@ -144,7 +233,8 @@ class PacketInfo:
             self.outer_fingerprint_len = 0
         self.nonce_local = nonce_local
         self.nonce_remote = nonce_remote
-        self.remaining_tie_lifetime = remaining_tie_lifetime
+        if not self.aging():
+            self.remaining_tie_lifetime = remaining_tie_lifetime
         reserved = 0
         major_version = encoding.constants.protocol_major_version
         pre = struct.pack("!BBBB", reserved, major_version, self.outer_key_id,
@@ -154,7 +244,9 @@ class PacketInfo:
     def update_origin_sec_env_header(self, origin_key):
         if origin_key:
             self.origin_key_id = origin_key.key_id
-            self.origin_fingerprint = origin_key.padded_digest([self.encoded_protocol_packet])
+            tie_header = self.protocol_packet.content.tie.header
+            self.origin_fingerprint = compute_origin_fingerprint(origin_key, tie_header,
+                                                                 self.encoded_protocol_packet)
             self.origin_fingerprint_len = len(self.origin_fingerprint) // 4
         else:
             self.origin_key_id = 0
@@ -239,23 +331,11 @@ def add_missing_methods_to_thrift():
 
 def encode_protocol_packet(protocol_packet, origin_key):
     # Since Thrift does not support unsigned integer, we need to "fix" unsigned integers to be
-    # encoded as signed integers.
-    # We have to make a deep copy of the non-encoded packet, but this "fixing" involves changing
-    # various fields in the non-encoded packet from the range (0...MAX_UNSIGNED_INT) to
-    # (MIN_SIGNED_INT...MAX_SIGNED_INT) for various sizes of integers.
-    # For the longest time, I tried to avoid making a deep copy of the non-encoded packets, at least
-    # for some of the packets. For transient messages (e.g. LIEs) that is easier than for persistent
-    # messages (e.g. TIE which are stored in the database, or TIDEs which are encoded once and sent
-    # multiple times). However, in the end this turned out to be impossible or at least a
-    # bountiful source of bugs, because transient messages contain direct or indirect references
-    # to persistent objects.
-    # So, I gave up, and now always do a deep copy of the message to be encoded.
-    fixed_protocol_packet = copy.deepcopy(protocol_packet)
-    fix_prot_packet_before_encode(fixed_protocol_packet)
-    transport_out = thrift.transport.TTransport.TMemoryBuffer()
-    protocol_out = thrift.protocol.TBinaryProtocol.TBinaryProtocol(transport_out)
-    fixed_protocol_packet.write(protocol_out)
-    encoded_protocol_packet = transport_out.getvalue()
+    # encoded as signed integers. This used to be done by making a deep copy of the packet and
+    # fixing the copy (the packet itself cannot be fixed in place because transient messages such
+    # as LIEs contain references to persistent objects such as TIEs in the database). Now the
+    # fixes are applied without modifying the packet, see packet_codec.encode_protocol_packet_bytes.
+    encoded_protocol_packet = packet_codec.encode_protocol_packet_bytes(protocol_packet)
     packet_info = PacketInfo()
     packet_info.protocol_packet = protocol_packet
     packet_info.encoded_protocol_packet = encoded_protocol_packet
@@ -280,6 +360,9 @@ def encode_protocol_packet(protocol_packet, origin_key):
 
 def decode_message(rx_intf, from_info, message, active_outer_key, accept_outer_keys,
                    active_origin_key, accept_origin_keys):
+    # The message is either bytes or a memoryview into a receive buffer. In the latter case, the
+    # buffers in the returned packet info are memoryviews into the receive buffer as well, see
+    # PacketInfo.own_buffers.
     packet_info = PacketInfo()
     record_source_info(packet_info, rx_intf, from_info)
     continue_offset = decode_envelope_header(packet_info, message)
@@ -320,7 +403,7 @@ def decode_envelope_header(packet_info, message):
         packet_info.error = packet_info.ERR_MSG_TOO_SHORT
         packet_info.error_details = "Missing magic and packet number"
         return -1
-    (magic, packet_nr) = struct.unpack("!HH", message[0:4])
+    (magic, packet_nr) = struct.unpack_from("!HH", message, 0)
     if magic != RIFT_MAGIC:
         packet_info.error = packet_info.ERR_WRONG_MAGIC
         packet_info.error_details = "Expected 0x{:x}, got 0x{:x}".format(RIFT_MAGIC, magic)
@@ -338,7 +421,7 @@ def decode_outer_security_header(packet_info, message, offset):
             "Missing major version, outer key id and outer fingerprint length"
         return -1
     (_reserved, major_version, outer_key_id, outer_fingerprint_len) = \
-        struct.unpack("!BBBB", message[offset:offset+4])
+        struct.unpack_from("!BBBB", message, offset)
     offset += 4
     expected_major_version = encoding.constants.protocol_major_version
     if major_version != expected_major_version:
@@ -359,7 +442,7 @@ def decode_outer_security_header(packet_info, message, offset):
             "Missing nonce local, nonce remote and remaining tie lifetime"
         return -1
     (nonce_local, nonce_remote, remaining_tie_lifetime) = \
-        struct.unpack("!HHL", message[offset:offset+8])
+        struct.unpack_from("!HHL", message, offset)
     offset += 8
     packet_info.outer_sec_env_header = message[start_header_offset:offset]
     packet_info.outer_key_id = outer_key_id
@@ -378,7 +461,7 @@ def decode_origin_security_header(packet_info, message, offset):
         packet_info.error_details = \
             "Missing TIE origin key id and TIE origin fingerprint length"
         return -1
-    (byte1, byte2, byte3, origin_fingerprint_len) = struct.unpack("!BBBB", message[offset:offset+4])
+    (byte1, byte2, byte3, origin_fingerprint_len) = struct.unpack_from("!BBBB", message, offset)
     origin_key_id = (byte1 << 16) | (byte2 << 8) | byte3
     offset += 4
     if ((origin_key_id == 0 and origin_fingerprint_len != 0) or
@@ -400,14 +483,10 @@ def decode_origin_security_header(packet_info, message, offset):
 
 def decode_protocol_packet(packet_info, message, offset):
     encoded_protocol_packet = message[offset:]
-    transport_in = thrift.transport.TTransport.TMemoryBuffer(encoded_protocol_packet)
-    protocol_in = thrift.protocol.TBinaryProtocol.TBinaryProtocol(transport_in)
-    protocol_packet = encoding.ttypes.ProtocolPacket()
     try:
-        protocol_packet.read(protocol_in)
-    # We don't know what exception Thrift might throw
-    # pylint: disable=broad-except
-    except Exception as err:
+        protocol_packet = packet_codec.decode_protocol_packet_bytes(
+            encoded_protocol_packet, packet_codec.lazy_tie_decode())
+    except packet_codec.DECODE_EXCEPTIONS as err:
         packet_info.error = packet_info.ERR_TRIFT_DECODE
         packet_info.error_details = str(err)
         return -1
@@ -417,7 +496,7 @@ def decode_protocol_packet(packet_info, message, offset):
         packet_info.error = packet_info.ERR_TRIFT_VALIDATE
         packet_info.error_details = str(err)
         return -1
-    fix_prot_packet_after_decode(protocol_packet)
+    packet_codec.fix_prot_packet_after_decode(protocol_packet)
     packet_info.encoded_protocol_packet = encoded_protocol_packet
     packet_info.protocol_packet = protocol_packet
     if protocol_packet.content.lie:
@@ -470,12 +549,31 @@ def check_origin_fingerprint(packet_info, active_origin_key, accept_origin_keys)
             packet_info.error = packet_info.ERR_NON_ZERO_ORIGIN_KEY_ID_NOT_ACCEPTED
             packet_info.error_details = "TIE origin key id is " + str(packet_info.origin_key_id)
         return False
-    expected = use_key.padded_digest([packet_info.encoded_protocol_packet])
+    # The same version of a TIE is typically received from multiple neighbors, and is often
+    # re-encoded, but its origin fingerprint is only computed once.
+    tie_header = packet_info.protocol_packet.content.tie.header
+    expected = compute_origin_fingerprint(use_key, tie_header, packet_info.encoded_protocol_packet)
     if packet_info.origin_fingerprint != expected:
         packet_info.error = packet_info.ERR_INCORRECT_ORIGIN_FINGERPRINT
         return False
     return True
 
+def lifetime_bucket(remaining_lifetime):
+    # Round a remaining TIE lifetime down to a multiple of OUTER_FINGERPRINT_LIFETIME_BUCKET. The
+    # infinite lifetime of non-TIE packets, and lifetimes shorter than one bucket (which must not
+    # be rounded down to zero) are left alone.
+    bucket = OUTER_FINGERPRINT_LIFETIME_BUCKET
+    if remaining_lifetime == 0xffffffff or remaining_lifetime < bucket:
+        return remaining_lifetime
+    return remaining_lifetime - remaining_lifetime % bucket
+
+def compute_origin_fingerprint(origin_key, tie_header, encoded_protocol_packet):
+    # Returns the padded origin fingerprint of an encoded TIE protocol packet, which is cached per
+    # TIE version (TIE-ID and sequence number) in the key.
+    cache_key = (tie_id_tup(tie_header.tieid), tie_header.seq_nr)
+    return origin_key.cached_padded_digest(origin_key.origin_fingerprint_cache, cache_key,
+                                           [encoded_protocol_packet])
+
 def find_key_id(key_id, active_key, accept_keys):
     if active_key and active_key.key_id == key_id:
         return active_key
@@ -487,221 +585,23 @@ def find_key_id(key_id, active_key, accept_keys):
         return key.Key(0, "null", None)
     return None
 
-# What follows are some horrible hacks to deal with the fact that Thrift only support signed 8, 16,
-# 32, and 64 bit numbers and not unsigned 8, 16, 32, and 64 bit numbers. The RIFT specification has
-# several fields are intended to contain an unsigned numbers, but that are actually specified in the
-# .thrift files as a signed numbers. Just look for the following text in the specification: "MUST be
-# interpreted in implementation as unsigned ..." where ... can be 8 bits, or 16 bits, or 32 bits, or
-# 64 bits. Keep in mind Python does not have sized integers: values of type int are unbounded (i.e.
-# they have no limit on the size and no minimum or maximum value).
-
-MAX_U64 = 0xffffffffffffffff
-MAX_S64 = 0x7fffffffffffffff
-
-MAX_U32 = 0xffffffff
-MAX_S32 = 0x7fffffff
-
-MAX_U16 = 0xffff
-MAX_S16 = 0x7fff
-
-MAX_U8 = 0xff
-MAX_S8 = 0x7f
-
-def u64_to_s64(u64):
-    return u64 if u64 <= MAX_S64 else u64 - MAX_U64 - 1
-
-def u32_to_s32(u32):
-    return u32 if u32 <= MAX_S32 else u32 - MAX_U32 - 1
-
-def u16_to_s16(u16):
-    return u16 if u16 <= MAX_S16 else u16 - MAX_U16 - 1
-
-def u8_to_s8(u08):
-    return u08 if u08 <= MAX_S8 else u08 - MAX_U8 - 1
-
-def s64_to_u64(s64):
-    return s64 if s64 >= 0 else s64 + MAX_U64 + 1
-
-def s32_to_u32(s32):
-    return s32 if s32 >= 0 else s32 + MAX_U32 + 1
-
-def s16_to_u16(s16):
-    return s16 if s16 >= 0 else s16 + MAX_U16 + 1
-
-def s8_to_u8(s08):
-    return s08 if s08 >= 0 else s08 + MAX_U8 + 1
-
-def fix_int(value, size, encode):
-    if encode:
-        # Fix before encode
-        if size == 8:
-            return u8_to_s8(value)
-        if size == 16:
-            return u16_to_s16(value)
-        if size == 32:
-            return u32_to_s32(value)
-        if size == 64:
-            return u64_to_s64(value)
-        assert False
-    else:
-        # Fix after decode
-        if size == 8:
-            return s8_to_u8(value)
-        if size == 16:
-            return s16_to_u16(value)
-        if size == 32:
-            return s32_to_u32(value)
-        if size == 64:
-            return s64_to_u64(value)
-        assert False
-    return value  # Unreachable, stop pylint from complaining about inconsistent-return-statements
-
-def fix_dict(old_dict, dict_fixes, encode):
-    (key_fixes, value_fixes) = dict_fixes
-    new_dict = {}
-    for the_key, value in old_dict.items():
-        new_key = fix_value(the_key, key_fixes, encode)
-        new_value = fix_value(value, value_fixes, encode)
-        new_dict[new_key] = new_value
-    return new_dict
-
-def fix_struct(fixed_struct, fixes, encode):
-    for fix in fixes:
-        (field_name, field_fix) = fix
-        if field_name in vars(fixed_struct):
-            field_value = getattr(fixed_struct, field_name)
-            if field_value is not None:
-                new_value = fix_value(field_value, field_fix, encode)
-                setattr(fixed_struct, field_name, new_value)
-    return fixed_struct
-
-def fix_set(old_set, fix, encode):
-    new_set = set()
-    for old_value in old_set:
-        new_value = fix_value(old_value, fix, encode)
-        new_set.add(new_value)
-    return new_set
-
-def fix_list(old_list, fix, encode):
-    new_list = []
-    for old_value in old_list:
-        new_value = fix_value(old_value, fix, encode)
-        new_list.append(new_value)
-    return new_list
-
-def fix_value(value, fix, encode):
-    if isinstance(value, set):
-        new_value = fix_set(value, fix, encode)
-    elif isinstance(value, list):
-        new_value = fix_list(value, fix, encode)
-    elif isinstance(fix, int):
-        new_value = fix_int(value, fix, encode)
-    elif isinstance(fix, tuple):
-        new_value = fix_dict(value, fix, encode)
-    elif isinstance(fix, list):
-        new_value = fix_struct(value, fix, encode)
-    else:
-        assert False
-    return new_value
-
-def fix_packet_before_encode(packet, fixes):
-    fix_struct(packet, fixes, True)
-
-def fix_packet_after_decode(packet, fixes):
-    fix_struct(packet, fixes, False)
-
-TIEID_FIXES = [
-    ('originator', 64), ('tie_nr', 32)
-]
-
-TIMESTAMP_FIXES = [
-    ('AS_sec', 64), ('AS_nsec', 32)
-]
-
-TIE_HEADER_FIXES = [
-    ('tieid', TIEID_FIXES), ('seq_nr', 32),
-    ('origination_time', TIMESTAMP_FIXES),
-    ('origination_lifetime', 32)
-]
-
-TIE_HEADER_WITH_LIFETIME_FIXES = [
-    ('header', TIE_HEADER_FIXES), ('remaining_lifetime', 32),
-]
-
-LINK_ID_PAIR_FIXES = [
-    ('local_id', 32),                      # Draft doesn't mention this needs to treated as unsigned
-    ('remote_id', 32)                      # Draft doesn't mention this needs to treated as unsigned
-]
-
-NODE_NEIGHBORS_TIE_ELEMENT_FIXES = [
-    ('level', 16), ('cost', 32), ('link_ids', LINK_ID_PAIR_FIXES), ('bandwidth', 32)
-]
-
-IP_PREFIX_FIXES = [
-    ('ipv4prefix', [
-        ('address', 32),
-        ('prefixlen', 8)                   # Draft doesn't mention this needs to treated as unsigned
-    ]),
-    ('ipv6prefix', [
-        ('prefixlen', 8)                   # Draft doesn't mention this needs to treated as unsigned
-    ])
-]
-
-PREFIX_ATTRIBUTES_FIXES = [
-    ('metric', 32), ('tags', 64),
-    ('monotonic_clock', [
-        ('timestamp', TIMESTAMP_FIXES), ('transactionid', 8)
-    ])
-]
-
-PREFIX_TIE_ELEMENT_FIXES = [
-    ('prefixes', (IP_PREFIX_FIXES, PREFIX_ATTRIBUTES_FIXES))
-]
-
-PROTOCOL_PACKET_FIXES = [
-    ('header', [
-        ('major_version', 16), ('minor_version', 16),
-        ('sender', 64), ('level', 16)]),
-    ('content', [
-        ('lie', [
-            ('local_id', 32),              # Draft doesn't mention this needs to treated as unsigned
-            ('flood_port', 16), ('link_mtu_size', 32), ('link_bandwidth', 32),
-            ('neighbor', [
-                ('originator', 64),
-                ('remote_id', 32)          # Draft doesn't mention this needs to treated as unsigned
-            ]),
-            ('pod', 32),
-            ('holdtime', 16),              # Draft doesn't mention this needs to treated as unsigned
-            ('label', 32)]),
-        ('tide', [
-            ('start_range', TIEID_FIXES),
-            ('end_range', TIEID_FIXES),
-            ('headers', TIE_HEADER_WITH_LIFETIME_FIXES)
-        ]),
-        ('tire', [
-            ('headers', TIE_HEADER_WITH_LIFETIME_FIXES)
-        ]),
-        ('tie', [
-            ('header', TIE_HEADER_FIXES),
-            ('element', [
-                ('node', [
-                    ('level', 16),
-                    ('neighbors', (64, NODE_NEIGHBORS_TIE_ELEMENT_FIXES))
-                ]),
-                ('prefixes', PREFIX_TIE_ELEMENT_FIXES),
-                ('positive_disaggregation_prefixes', PREFIX_TIE_ELEMENT_FIXES),
-                ('negative_disaggregation_prefixes', PREFIX_TIE_ELEMENT_FIXES),
-                ('external_prefixes', PREFIX_TIE_ELEMENT_FIXES),
-            ])
-        ])
-    ])
-]
-
-def fix_prot_packet_before_encode(protocol_packet):
-    fix_packet_before_encode(protocol_packet, PROTOCOL_PACKET_FIXES)
-
-def fix_prot_packet_after_decode(protocol_packet):
-    fix_packet_after_decode(protocol_packet, PROTOCOL_PACKET_FIXES)
+def decode_lazy_tie_element(packet_info):
+    # Decode the element of a lazily decoded TIE, if it has not been decoded yet. Returns False
+    # (and sets the error in the packet_info) if the element could not be decoded.
+    tie_packet = packet_info.protocol_packet.content.tie
+    if not isinstance(tie_packet, packet_codec.LazyTIEPacket):
+        return True
+    try:
+        tie_packet.decode_element()
+    except packet_codec.DECODE_EXCEPTIONS as err:
+        packet_info.error = packet_info.ERR_TRIFT_DECODE
+        packet_info.error_details = str(err)
+        return False
+    if tie_packet.element is None:
+        packet_info.error = packet_info.ERR_TRIFT_VALIDATE
+        packet_info.error_details = "Required field element is unset!"
+        return False
+    return True
 
 def make_tie_id(direction, originator, tie_type, tie_nr):
     tie_id = encoding.ttypes.TIEID(
@@ -811,6 +711,71 @@ def add_tie_header_to_tide(tide_packet, tie_header):
     assert tie_header.__class__ == encoding.ttypes.TIEHeaderWithLifeTime
     tide_packet.headers.append(tie_header)
 
+# Worst case number of bytes in an IP packet carrying a TIDE, in addition to the encoded protocol
+# packet: IPv6 header (40), UDP header (8), envelope header (4), and outer security envelope header
+# (12) with the longest supported fingerprint (64 for SHA-512). TIDEs have no origin security
+# envelope header.
+TIDE_PACKET_OVERHEAD = 40 + 8 + 4 + 12 + 64
+
+_MAX_TIDE_HEADERS = {}   # Indexed by MTU
+
+def max_tide_headers(mtu):
+    # Returns the maximum number of TIE headers in a TIDE packet that is sent on a link with the
+    # given MTU.
+    if mtu not in _MAX_TIDE_HEADERS:
+        tie_id = make_tie_id(common.ttypes.TieDirectionType.South, 1,
+                             common.ttypes.TIETypeType.NodeTIEType, 1)
+        tide_packet = make_tide_packet(tie_id, tie_id)
+        packet_content = encoding.ttypes.PacketContent(tide=tide_packet)
+        _MAX_TIDE_HEADERS[mtu] = _max_tie_headers(mtu, packet_content, tide_packet.headers.append)
+    return _MAX_TIDE_HEADERS[mtu]
+
+def _max_tie_headers(mtu, packet_content, add_header):
+    # Returns the maximum number of TIE headers (with lifetime) that can be added to the packet
+    # content of a TIDE or TIRE packet that is sent on a link with the given MTU. The binary
+    # protocol encodes integers with a fixed size, so the encoded size of the packet only depends on
+    # which optional fields are present. The size of a TIE header is determined with all optional
+    # fields present, so every packet with that number of headers is guaranteed to fit. At least one
+    # header is allowed, even if the MTU is ridiculously small.
+    protocol_packet = encoding.ttypes.ProtocolPacket(
+        header=encoding.ttypes.PacketHeader(sender=1, level=1),
+        content=packet_content)
+    empty_size = len(packet_codec.encode_protocol_packet_bytes(protocol_packet))
+    origination_time = common.ttypes.IEEE802_1ASTimeStampType(AS_sec=1, AS_nsec=1)
+    tie_header = make_tie_header_with_lifetime(common.ttypes.TieDirectionType.South, 1,
+                                               common.ttypes.TIETypeType.NodeTIEType, 1, 1, 1,
+                                               origination_time)
+    tie_header.header.origination_lifetime = 1
+    add_header(tie_header)
+    header_size = len(packet_codec.encode_protocol_packet_bytes(protocol_packet)) - empty_size
+    return max(1, (mtu - TIDE_PACKET_OVERHEAD - empty_size) // header_size)
+
+# Worst case number of bytes in an IP packet carrying a TIE, in addition to the encoded protocol
+# packet: the same as for a TIDE, plus the origin security envelope header (4) with the longest
+# supported fingerprint (64).
+TIE_PACKET_OVERHEAD = TIDE_PACKET_OVERHEAD + 4 + 64
+
+def encoded_tie_packet_size(tie_packet):
+    # Returns the worst case size of an IP packet carrying the given TIE
+    protocol_packet = encoding.ttypes.ProtocolPacket(
+        header=encoding.ttypes.PacketHeader(sender=tie_packet.header.tieid.originator, level=0),
+        content=encoding.ttypes.PacketContent(tie=tie_packet))
+    return TIE_PACKET_OVERHEAD + len(packet_codec.encode_protocol_packet_bytes(protocol_packet))
+
+def prefix_tie_entry_size(prefix, attributes):
+    # Returns the number of bytes that a prefix adds to an encoded prefix TIE
+    tie_packet = make_prefix_tie_packet(common.ttypes.TieDirectionType.North, 1, 1, 1)
+    empty_size = encoded_tie_packet_size(tie_packet)
+    tie_packet.element.prefixes.prefixes[prefix] = attributes
+    return encoded_tie_packet_size(tie_packet) - empty_size
+
+def node_tie_neighbor_size(system_id, node_neighbor):
+    # Returns the number of bytes that a neighbor adds to an encoded node TIE
+    tie_packet = make_node_tie_packet("", 0, common.ttypes.TieDirectionType.North, 1, 1, 1)
+    empty_size = encoded_tie_packet_size(tie_packet)
+    tie_packet.element.node.neighbors[system_id] = node_neighbor
+    return encoded_tie_packet_size(tie_packet) - empty_size
+
 def make_tire_packet():
     tire_packet = encoding.ttypes.TIREPacket(headers=set())
     return tire_packet
@@ -819,6 +784,17 @@ def add_tie_header_to_tire(tire_packet, tie_header):
     assert tie_header.__class__ == encoding.ttypes.TIEHeaderWithLifeTime
     tire_packet.headers.add(tie_header)
 
+_MAX_TIRE_HEADERS = {}   # Indexed by MTU
+
+def max_tire_headers(mtu):
+    # Returns the maximum number of TIE headers in a TIRE packet that is sent on a link with the
+    # given MTU. TIREs have the same overhead as TIDEs (no origin security envelope header).
+    if mtu not in _MAX_TIRE_HEADERS:
+        tire_packet = make_tire_packet()
+        packet_content = encoding.ttypes.PacketContent(tire=tire_packet)
+        _MAX_TIRE_HEADERS[mtu] = _max_tie_headers(mtu, packet_content, tire_packet.headers.add)
+    return _MAX_TIRE_HEADERS[mtu]
+
 DIRECTION_TO_STR = {
     common.ttypes.TieDirectionType.South: "South",
     common.ttypes.TieDirectionType.North: "North"
@@ -0,0 +1,76 @@
+import cProfile
+import io
+import os
+import pstats
+import time
+
+# On-demand profiling of a running engine (start profiling / stop profiling CLI commands).
+#
+# The profiler is enabled from within a CLI command handler, i.e. from within the event loop, and
+# since the engine is single-threaded it profiles everything that the event loop does from then on
+# until it is disabled again. The result is written in the standard pstats format, which can be
+# analyzed with the pstats module, or visualized with tools such as snakeviz, or converted to a
+# flame graph with tools such as flameprof or gprof2dot.
+
+NR_SUMMARY_FUNCTIONS = 20
+
+def default_file_name():
+    # Include the process ID so that the worker processes in multi-process mode don't overwrite
+    # each other's output
+    file_name = "rift-profile-{}-{}.prof".format(os.getpid(), time.strftime("%Y%m%d-%H%M%S"))
+    if "RIFT_TEST_RESULTS_DIR" in os.environ:
+        file_name = os.environ["RIFT_TEST_RESULTS_DIR"] + "/" + file_name
+    return file_name
+
+class Profiler:
+
+    def __init__(self):
+        self._profile = None
+        self._file_name = None
+        self._start_time = None
+
+    @property
+    def running(self):
+        return self._profile is not None
+
+    def command_start(self, cli_session, file_name=None):
+        if self._profile is not None:
+            cli_session.print("Profiling is already running (output file {})"
+                              .format(self._file_name))
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as err:
+            # Another profiler (or debugger) is already active in this process
+            cli_session.print("Could not start profiling: {}".format(err))
+            return
+        self._profile = profile
+        if file_name is None:
+            file_name = default_file_name()
+        self._file_name = file_name
+        self._start_time = time.time()
+        cli_session.print("Profiling started (output file {})".format(self._file_name))
+
+    def command_stop(self, cli_session):
+        if self._profile is None:
+            cli_session.print("Profiling is not running")
+            return
+        self._profile.disable()
+        profile = self._profile
+        file_name = self._file_name
+        duration = time.time() - self._start_time
+        self._profile = None
+        self._file_name = None
+        self._start_time = None
+        try:
+            profile.dump_stats(file_name)
+        except OSError as err:
+            cli_session.print("Could not write profile to file {}: {}".format(file_name, err))
+            return
+        cli_session.print("Profiling stopped after {:.2f} seconds (output file {})"
+                          .format(duration, file_name))
+        stream = io.StringIO()
+        stats = pstats.Stats(profile, stream=stream)
+        stats.strip_dirs().sort_stats("cumulative").print_stats(NR_SUMMARY_FUNCTIONS)
+        cli_session.print(stream.getvalue().strip("\n"))
@@ -0,0 +1,80 @@
+import heapdict
+
+class RetransmitEntry:
+
+    __slots__ = ["tie_header", "interval", "retransmit_count"]
+
+    def __init__(self, tie_header, interval):
+        self.tie_header = tie_header
+        self.interval = interval
+        self.retransmit_count = 0
+
+class RetransmitQueue:
+
+    # The retransmit queue of an interface: the headers of the TIEs that were sent to the neighbor
+    # but that have not been acknowledged yet, indexed by tie_id.
+    #
+    # Each TIE has its own retransmit interval, which starts at the initial interval when the TIE
+    # is (re-)added to the queue and which is doubled after each retransmission, up to the maximum
+    # interval. The time of the next retransmission of each TIE is kept in an index which is ordered
+    # by time, so that servicing the queue only touches the TIEs that are actually due.
+
+    def __init__(self, initial_interval, max_interval):
+        self._initial_interval = initial_interval
+        self._max_interval = max_interval
+        self._entries = {}                       # RetransmitEntry indexed by tie_id
+        self._deadlines = heapdict.heapdict()    # Next retransmit time indexed by tie_id
+
+    def __contains__(self, tie_id):
+        return tie_id in self._entries
+
+    def __getitem__(self, tie_id):
+        return self._entries[tie_id].tie_header
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __bool__(self):
+        return bool(self._entries)
+
+    def keys(self):
+        return self._entries.keys()
+
+    def values(self):
+        return [entry.tie_header for entry in self._entries.values()]
+
+    def add(self, tie_header, now):
+        # (Re-)start retransmitting the TIE with the initial interval, replacing any other version
+        # of the same TIE that was already on the queue
+        tie_id = tie_header.tieid
+        self._entries[tie_id] = RetransmitEntry(tie_header, self._initial_interval)
+        self._deadlines[tie_id] = now + self._initial_interval
+
+    def remove(self, tie_id):
+        if self._entries.pop(tie_id, None) is not None:
+            del self._deadlines[tie_id]
+
+    def clear(self):
+        self._entries.clear()
+        self._deadlines.clear()
+
+    def due(self, now):
+        # Returns the tie_ids of the TIEs of which the retransmit time has come, in the order in
+        # which they became due. Each of them is rescheduled with a doubled interval (assuming that
+        # the caller actually retransmits it).
+        due_tie_ids = []
+        while self._deadlines:
+            (tie_id, deadline) = self._deadlines.peekitem()
+            if deadline > now:
+                break
+            entry = self._entries[tie_id]
+            entry.interval = min(2 * entry.interval, self._max_interval)
+            entry.retransmit_count += 1
+            self._deadlines[tie_id] = now + entry.interval
+            due_tie_ids.append(tie_id)
+        return due_tie_ids
+
+    def retransmit_info(self, tie_id):
+        # Returns (next retransmit time, current interval, retransmit count) for the TIE
+        entry = self._entries[tie_id]
+        return (self._deadlines[tie_id], entry.interval, entry.retransmit_count)
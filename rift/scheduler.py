@@ -1,24 +1,70 @@
-import select
+import asyncio
+import selectors
+import time
+
+import stats
+import table
+
 from timer import TIMER_SCHEDULER
 from fsm import Fsm
+from memory_transport import MEMORY_TRANSPORT
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 class Scheduler:
 
     def __init__(self):
+        # The selector picks the most efficient mechanism available on the platform (epoll on
+        # Linux, kqueue on BSD / macOS) so the per-iteration cost does not grow with the number
+        # of registered file descriptors, and we are not limited by FD_SETSIZE.
+        self._selector = selectors.DefaultSelector()
         self._handlers_by_rx_fd = {}
         self._handlers_by_tx_fd = {}
-        self._rx_fds = []
-        self._tx_fds = []
+        # Only used when running on an asyncio event loop (see run_asyncio)
+        self._loop = None
+        self._service_handle = None
+        self._timer_handle = None
+        self._loop_exception = None
+        # Per-iteration latency histograms, to see what the event loop spends its time on (see
+        # show engine loop). The handler histograms are indexed by handler class.
+        self._iteration_histogram = stats.Histogram("Iteration")
+        self._wait_histogram = stats.Histogram("Wait For I/O")
+        self._timers_histogram = stats.Histogram("Timers")
+        self._memory_links_histogram = stats.Histogram("In-Memory Links")
+        self._fsm_histogram = stats.Histogram("FSM Events")
+        self._handler_histograms = {}
+
+    def _update_selector(self, fd):
+        events = 0
+        if fd in self._handlers_by_rx_fd:
+            events |= selectors.EVENT_READ
+        if fd in self._handlers_by_tx_fd:
+            events |= selectors.EVENT_WRITE
+        registered = fd in self._selector.get_map()
+        if events == 0:
+            if registered:
+                self._selector.unregister(fd)
+        elif registered:
+            self._selector.modify(fd, events)
+        else:
+            self._selector.register(fd, events)
 
     def register_handler(self, handler, invoke_ready_to_read, invoke_ready_to_write):
         if invoke_ready_to_read:
             rx_fd = handler.rx_fd()
             self._handlers_by_rx_fd[rx_fd] = handler
-            self._rx_fds.append(rx_fd)
+            self._update_selector(rx_fd)
+            if self._loop:
+                self._loop.add_reader(rx_fd, self._asyncio_ready_to_read, rx_fd)
         if invoke_ready_to_write:
             tx_fd = handler.tx_fd()
             self._handlers_by_tx_fd[tx_fd] = handler
-            self._tx_fds.append(tx_fd)
+            self._update_selector(tx_fd)
+            if self._loop:
+                self._loop.add_writer(tx_fd, self._asyncio_ready_to_write, tx_fd)
 
     def unregister_handler(self, handler):
         if hasattr(handler, "rx_fd"):
@@ -27,27 +73,197 @@ class Scheduler:
             rx_fd = None
         if rx_fd is not None and rx_fd in self._handlers_by_rx_fd:
             del self._handlers_by_rx_fd[rx_fd]
-            self._rx_fds.remove(rx_fd)
+            self._update_selector(rx_fd)
+            if self._loop:
+                self._loop.remove_reader(rx_fd)
         if hasattr(handler, "tx_fd"):
             tx_fd = handler.tx_fd()
         else:
             tx_fd = None
         if tx_fd is not None and tx_fd in self._handlers_by_tx_fd:
             del self._handlers_by_tx_fd[tx_fd]
-            self._tx_fds.remove(tx_fd)
+            self._update_selector(tx_fd)
+            if self._loop:
+                self._loop.remove_writer(tx_fd)
+
+    def nr_registered_fds(self):
+        return len(self._selector.get_map())
+
+    @staticmethod
+    def _min_timeout(timeout1, timeout2):
+        if timeout1 is None:
+            return timeout2
+        if timeout2 is None:
+            return timeout1
+        return min(timeout1, timeout2)
+
+    def _handler_histogram(self, handler):
+        handler_class = type(handler)
+        histogram = self._handler_histograms.get(handler_class)
+        if histogram is None:
+            histogram = stats.Histogram("Handler " + handler_class.__name__)
+            self._handler_histograms[handler_class] = histogram
+        return histogram
+
+    def _run_timers_and_events(self):
+        # Returns the time after which this function must be called again at the latest (None if
+        # there is nothing to do until some handler is invoked)
+        start_time = time.perf_counter()
+        timeout = TIMER_SCHEDULER.trigger_all_expired_timers()
+        timers_time = time.perf_counter()
+        self._timers_histogram.record(timers_time - start_time)
+        # Packets on in-memory links (if any) are delivered here instead of by a handler
+        if MEMORY_TRANSPORT.has_queued_packets():
+            MEMORY_TRANSPORT.deliver_queued_packets()
+            memory_links_time = time.perf_counter()
+            self._memory_links_histogram.record(memory_links_time - timers_time)
+        else:
+            memory_links_time = timers_time
+        Fsm.process_queued_events()
+        self._fsm_histogram.record(time.perf_counter() - memory_links_time)
+        return self._min_timeout(timeout, MEMORY_TRANSPORT.next_delivery_timeout())
+
+    def _invoke_ready_to_read(self, handler):
+        start_time = time.perf_counter()
+        handler.ready_to_read()
+        self._handler_histogram(handler).record(time.perf_counter() - start_time)
+
+    def _invoke_ready_to_write(self, handler):
+        start_time = time.perf_counter()
+        handler.ready_to_write()
+        self._handler_histogram(handler).record(time.perf_counter() - start_time)
+
+    def run_one_iteration(self):
+        # Process timers in two places because FSM event processing might cause timers to be
+        # created, and timer expire processing might cause FSM events to be queued.
+        start_time = time.perf_counter()
+        timeout = self._run_timers_and_events()
+        wait_start_time = time.perf_counter()
+        ready = self._selector.select(timeout)
+        wait_time = time.perf_counter() - wait_start_time
+        self._wait_histogram.record(wait_time)
+        for key, mask in ready:
+            fd = key.fd
+            # A handler which was invoked earlier in this iteration may have unregistered the
+            # handler for this fd (e.g. an interface closing its sockets), so look it up again.
+            if mask & selectors.EVENT_READ:
+                handler = self._handlers_by_rx_fd.get(fd)
+                if handler is not None:
+                    self._invoke_ready_to_read(handler)
+            if mask & selectors.EVENT_WRITE:
+                handler = self._handlers_by_tx_fd.get(fd)
+                if handler is not None:
+                    self._invoke_ready_to_write(handler)
+        # The iteration time is the time that the loop was busy, i.e. without waiting for I/O
+        self._iteration_histogram.record(time.perf_counter() - start_time - wait_time)
+
+    def loop_stats_table(self):
+        tab = table.Table()
+        tab.add_row(["Activity"] + stats.Histogram.table_headers())
+        histograms = [self._iteration_histogram,
+                      self._wait_histogram,
+                      self._timers_histogram,
+                      self._memory_links_histogram,
+                      self._fsm_histogram]
+        histograms.extend(sorted(self._handler_histograms.values(),
+                                 key=lambda histogram: histogram.description()))
+        for histogram in histograms:
+            tab.add_row([histogram.description()] + histogram.table_cells())
+        return tab
+
+    def clear_loop_stats(self):
+        self._iteration_histogram.clear()
+        self._wait_histogram.clear()
+        self._timers_histogram.clear()
+        self._memory_links_histogram.clear()
+        self._fsm_histogram.clear()
+        self._handler_histograms = {}
 
     def run(self):
         while True:
-            # Process timers in two places because FSM event processing might cause timers to be
-            # created, and timer expire processing might cause FSM events to be queued.
-            timeout = TIMER_SCHEDULER.trigger_all_expired_timers()
-            Fsm.process_queued_events()
-            rx_ready, tx_ready, _ = select.select(self._rx_fds, self._tx_fds, [], timeout)
-            for rx_fd in rx_ready:
-                handler = self._handlers_by_rx_fd[rx_fd]
-                handler.ready_to_read()
-            for tx_fd in tx_ready:
-                handler = self._handlers_by_tx_fd[tx_fd]
-                handler.ready_to_write()
+            self.run_one_iteration()
+
+    # The asyncio mode runs the same handlers, timers, and FSMs on an asyncio event loop (uvloop if
+    # it is installed) so that other asyncio based I/O can be added to the engine. File descriptors
+    # are watched with add_reader / add_writer, and timers and FSM event processing run in a loop
+    # callback which is scheduled after every handler invocation and when the next timer expires.
+
+    def create_asyncio_loop(self, use_uvloop=True):
+        if use_uvloop and uvloop is not None:
+            loop = uvloop.new_event_loop()
+        else:
+            loop = asyncio.new_event_loop()
+        return loop
+
+    def run_asyncio(self, loop=None):
+        if loop is None:
+            loop = self.create_asyncio_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        self._loop_exception = None
+        loop.set_exception_handler(self._asyncio_exception)
+        for rx_fd in self._handlers_by_rx_fd:
+            loop.add_reader(rx_fd, self._asyncio_ready_to_read, rx_fd)
+        for tx_fd in self._handlers_by_tx_fd:
+            loop.add_writer(tx_fd, self._asyncio_ready_to_write, tx_fd)
+        self._asyncio_schedule_service()
+        try:
+            loop.run_forever()
+        finally:
+            for rx_fd in self._handlers_by_rx_fd:
+                loop.remove_reader(rx_fd)
+            for tx_fd in self._handlers_by_tx_fd:
+                loop.remove_writer(tx_fd)
+            self._service_handle = None
+            self._timer_handle = None
+            self._loop = None
+        if self._loop_exception is not None:
+            raise self._loop_exception
+
+    def stop_asyncio(self):
+        if self._loop:
+            self._loop.stop()
+
+    def _asyncio_exception(self, loop, context):
+        # Same behavior as the select loop: an exception in a handler stops the engine, instead of
+        # being logged and ignored as asyncio does by default.
+        exception = context.get("exception")
+        if exception is None:
+            loop.default_exception_handler(context)
+            return
+        self._loop_exception = exception
+        loop.stop()
+
+    def _asyncio_ready_to_read(self, rx_fd):
+        handler = self._handlers_by_rx_fd.get(rx_fd)
+        if handler is not None:
+            self._invoke_ready_to_read(handler)
+        self._asyncio_schedule_service()
+
+    def _asyncio_ready_to_write(self, tx_fd):
+        handler = self._handlers_by_tx_fd.get(tx_fd)
+        if handler is not None:
+            self._invoke_ready_to_write(handler)
+        self._asyncio_schedule_service()
+
+    def _asyncio_schedule_service(self):
+        if self._service_handle is None:
+            self._service_handle = self._loop.call_soon(self._asyncio_service)
+
+    def _asyncio_service(self):
+        self._service_handle = None
+        if self._timer_handle is not None:
+            self._timer_handle.cancel()
+            self._timer_handle = None
+        # Process timers in two places because FSM event processing might cause timers to be
+        # created, and timer expire processing might cause FSM events to be queued.
+        # (The asyncio loop does the waiting, so there is no wait or iteration time here.)
+        self._run_timers_and_events()
+        timeout = TIMER_SCHEDULER.trigger_all_expired_timers()
+        timeout = self._min_timeout(timeout, MEMORY_TRANSPORT.next_delivery_timeout())
+        if Fsm.has_queued_events() or timeout == 0.0:
+            self._asyncio_schedule_service()
+        elif timeout is not None:
+            self._timer_handle = self._loop.call_later(timeout, self._asyncio_service)
 
 SCHEDULER = Scheduler()
@@ -0,0 +1,384 @@
+import atexit
+import logging
+import os
+import pickle
+import random
+import signal
+import socket
+import struct
+import sys
+import traceback
+
+import sortedcontainers
+
+import cli_listen_handler
+import cli_session_handler
+import engine
+import node
+import scheduler
+import table
+
+# Multi-process mode: each shard in the configuration runs in its own worker process, which runs
+# a normal engine for the nodes in that shard. The parent process only runs the CLI. Commands
+# which operate on the current node are forwarded to the worker process that owns the current
+# node; commands which operate on the engine or on all nodes are sent to all worker processes.
+#
+# The parent and each worker process are connected by a stream socket pair (the control channel).
+# Each message on the control channel is a pickled Python object preceded by a 4-byte length.
+#
+# Requests from the parent to a worker:
+#   ("command", function_name, node_name, parameters) => CLI output text
+#   ("node_rows", method_name) => list of rows, one for each node in the shard
+# Message from a worker to the parent when the worker has created its nodes:
+#   ("ready", node_names)
+
+_LENGTH_FORMAT = "!I"
+_LENGTH_SIZE = struct.calcsize(_LENGTH_FORMAT)
+
+def send_message(sock, message):
+    data = pickle.dumps(message)
+    sock.sendall(struct.pack(_LENGTH_FORMAT, len(data)) + data)
+
+def _receive_exactly(sock, nr_bytes):
+    data = bytearray()
+    while len(data) < nr_bytes:
+        chunk = sock.recv(nr_bytes - len(data))
+        if not chunk:
+            raise EOFError("Control channel closed")
+        data += chunk
+    return bytes(data)
+
+def receive_message(sock):
+    (length,) = struct.unpack(_LENGTH_FORMAT, _receive_exactly(sock, _LENGTH_SIZE))
+    return pickle.loads(_receive_exactly(sock, length))
+
+class CaptureCliSession:
+
+    # Stands in for the CLI session when a worker process executes a forwarded command; the
+    # output is collected and sent back to the parent process.
+
+    def __init__(self, current_node):
+        self.current_node = current_node
+        self._output = []
+
+    def print(self, message, add_newline=True):
+        self._output.append(message)
+        if add_newline:
+            self._output.append('\n')
+
+    def set_current_node(self, new_node):
+        self.current_node = new_node
+
+    def output(self):
+        return "".join(self._output)
+
+class ShardCommandHandler:
+
+    # Runs in the worker process: executes the requests received on the control channel
+
+    def __init__(self, sock, eng):
+        self._sock = sock
+        self._engine = eng
+        scheduler.SCHEDULER.register_handler(self, True, False)
+
+    def rx_fd(self):
+        return self._sock.fileno()
+
+    def ready_to_read(self):
+        try:
+            request = receive_message(self._sock)
+        except (EOFError, OSError):
+            # The parent process is gone; there is no way to reach this shard anymore
+            scheduler.SCHEDULER.unregister_handler(self)
+            sys.exit(0)
+        if request[0] == "command":
+            (_, function_name, node_name, parameters) = request
+            session = CaptureCliSession(self._engine.node_by_name(node_name))
+            command_function = getattr(self._engine, function_name)
+            if parameters:
+                command_function(session, parameters)
+            else:
+                command_function(session)
+            reply = session.output()
+        else:
+            assert request[0] == "node_rows"
+            (_, method_name) = request
+            reply = [getattr(self._engine.node_by_name(node_name), method_name)()
+                     for node_name in self._engine.node_names()]
+        send_message(self._sock, reply)
+
+class ShardProcess:
+
+    # Parent process side of one worker process
+
+    def __init__(self, shard_id, cpu, engine_args, siblings):
+        self.shard_id = shard_id
+        self.cpu = cpu
+        (self._sock, child_sock) = socket.socketpair()
+        self.pid = os.fork()
+        if self.pid == 0:
+            # Only the parent process may hold the control channels, otherwise a worker would not
+            # notice that the parent process is gone.
+            self.close_control_channel()
+            for sibling in siblings:
+                sibling.close_control_channel()
+            self._run_worker(child_sock, engine_args)
+        child_sock.close()
+        (_, self.node_names) = receive_message(self._sock)
+
+    def _run_worker(self, sock, engine_args):
+        exit_code = 1
+        try:
+            if self.cpu is not None:
+                os.sched_setaffinity(0, [self.cpu])
+            # Don't use the same random numbers (e.g. nonces) in all worker processes
+            random.seed()
+            eng = engine.Engine(shard_ids=[self.shard_id], **engine_args)
+            ShardCommandHandler(sock, eng)
+            send_message(sock, ("ready", eng.node_names()))
+            eng.run()
+        except SystemExit as err:
+            exit_code = err.code if isinstance(err.code, int) else 0
+        except BaseException:  # pylint:disable=broad-except
+            traceback.print_exc()
+        # Never return into (or run the exit handlers of) the code of the parent process
+        os._exit(exit_code)  # pylint:disable=protected-access
+
+    @property
+    def running(self):
+        return self._sock is not None
+
+    def close_control_channel(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def request(self, message):
+        # Returns None if the worker process is not running (anymore)
+        if self._sock is None:
+            return None
+        try:
+            send_message(self._sock, message)
+            return receive_message(self._sock)
+        except (EOFError, OSError):
+            self.close_control_channel()
+            return None
+
+    def stop(self):
+        self.close_control_channel()
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+            os.waitpid(self.pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+
+class ShardNode:
+
+    # Parent process stand-in for a node which runs in a worker process (only used as the current
+    # node of CLI sessions)
+
+    def __init__(self, name, shard_process):
+        self.name = name
+        self.shard_process = shard_process
+
+def make_forwarding_command(function_name):
+    def forwarding_command(front_end, cli_session, parameters=None):
+        front_end.forward_command(cli_session, function_name, parameters)
+    return forwarding_command
+
+def make_parse_tree(engine_parse_tree, front_end_class):
+    # Same commands as the engine, but everything that is not handled by the front end itself is
+    # forwarded to the worker process that owns the current node.
+    parse_tree = {}
+    for token, subtree in engine_parse_tree.items():
+        if callable(subtree):
+            function_name = subtree.__name__
+            if hasattr(front_end_class, function_name):
+                parse_tree[token] = getattr(front_end_class, function_name)
+            else:
+                parse_tree[token] = make_forwarding_command(function_name)
+        else:
+            parse_tree[token] = make_parse_tree(subtree, front_end_class)
+    return parse_tree
+
+class ShardFrontEnd:
+
+    def __init__(self, interactive, telnet_port_file, log_level, config, pin_cpus, engine_args):
+        self._interactive = interactive
+        self._telnet_port_file = telnet_port_file
+        self._shard_processes = []
+        self._nodes = sortedcontainers.SortedDict()
+        engine_args = dict(engine_args,
+                           interactive=interactive,
+                           telnet_port_file=telnet_port_file,
+                           log_level=log_level,
+                           config=config)
+        if pin_cpus and hasattr(os, "sched_getaffinity"):
+            cpus = sorted(os.sched_getaffinity(0))
+        else:
+            cpus = None
+        atexit.register(self.stop_shard_processes)
+        # Fork all worker processes before the parent opens any sockets of its own
+        for shard_config in config.get('shards', []):
+            if not shard_config.get('nodes'):
+                continue
+            if cpus:
+                cpu = cpus[len(self._shard_processes) % len(cpus)]
+            else:
+                cpu = None
+            shard_process = ShardProcess(shard_config['id'], cpu, engine_args,
+                                         self._shard_processes)
+            self._shard_processes.append(shard_process)
+            for node_name in shard_process.node_names:
+                self._nodes[node_name] = ShardNode(node_name, shard_process)
+        logging.basicConfig(
+            filename=engine.log_file_name(),
+            format='%(asctime)s:%(levelname)s:%(name)s:%(message)s',
+            level=log_level)
+        cli_log = logging.getLogger('cli')
+        if self._nodes:
+            first_node = self._nodes.peekitem(0)[1]
+        else:
+            first_node = None
+        if self._interactive:
+            engine.make_terminal_unbuffered()
+            self._cli_listen_handler = None
+            self._interactive_cli_session_handler = cli_session_handler.CliSessionHandler(
+                sock=None,
+                rx_fd=sys.stdin.fileno(),
+                tx_fd=sys.stdout.fileno(),
+                parse_tree=self.parse_tree,
+                command_handler=self,
+                log=cli_log,
+                node=first_node)
+        else:
+            self._cli_listen_handler = cli_listen_handler.CliListenHandler(
+                command_tree=self.parse_tree,
+                command_handler=self,
+                log=cli_log,
+                default_node=first_node)
+            self._interactive_cli_session_handler = None
+            if self._telnet_port_file is None:
+                print("Command Line Interface (CLI) available on port {}"
+                      .format(self._cli_listen_handler.port))
+            else:
+                try:
+                    with open(self._telnet_port_file, 'w') as file:
+                        print(self._cli_listen_handler.port, file=file)
+                except IOError:
+                    pass # TODO: Log an error
+
+    def run(self):
+        # The parent process only runs the CLI, the plain select loop is all it needs
+        scheduler.SCHEDULER.run()
+
+    def stop_shard_processes(self):
+        for shard_process in self._shard_processes:
+            shard_process.stop()
+
+    def forward_command(self, cli_session, function_name, parameters):
+        current_node = cli_session.current_node
+        if current_node is None:
+            shard_process = self._shard_processes[0]
+            node_name = None
+        else:
+            shard_process = current_node.shard_process
+            node_name = current_node.name
+        output = shard_process.request(("command", function_name, node_name, parameters))
+        if output is None:
+            cli_session.print("Shard {} is not running".format(shard_process.shard_id))
+        else:
+            cli_session.print(output, False)
+
+    def forward_command_to_all(self, cli_session, function_name, shard_parameters=None):
+        # If given, shard_parameters is a function which returns the parameters for a shard
+        for shard_process in self._shard_processes:
+            cli_session.print("Shard {}:".format(shard_process.shard_id))
+            if shard_parameters is None:
+                parameters = None
+            else:
+                parameters = shard_parameters(shard_process)
+            output = shard_process.request(("command", function_name, None, parameters))
+            if output is None:
+                cli_session.print("Shard {} is not running".format(shard_process.shard_id))
+            else:
+                cli_session.print(output, False)
+
+    def node_rows(self, method_name):
+        rows = []
+        for shard_process in self._shard_processes:
+            shard_rows = shard_process.request(("node_rows", method_name))
+            if shard_rows is not None:
+                rows.extend(shard_rows)
+        return sorted(rows, key=lambda row: row[0])
+
+    def command_clear_engine_stats(self, cli_session):
+        self.forward_command_to_all(cli_session, "command_clear_engine_stats")
+
+    def command_show_engine(self, cli_session):
+        tab = table.Table()
+        tab.add_row(["Shard", "Process ID", "CPU", "Running", ["Number", "of Nodes"]])
+        for shard_process in self._shard_processes:
+            tab.add_row([shard_process.shard_id,
+                         shard_process.pid,
+                         shard_process.cpu,
+                         shard_process.running,
+                         len(shard_process.node_names)])
+        cli_session.print(tab.to_string())
+        self.forward_command_to_all(cli_session, "command_show_engine")
+
+    def command_show_engine_loop(self, cli_session):
+        self.forward_command_to_all(cli_session, "command_show_engine_loop")
+
+    def command_show_engine_stats(self, cli_session):
+        self.forward_command_to_all(cli_session, "command_show_engine_stats")
+
+    def command_show_eng_stats_ex_zero(self, cli_session):
+        self.forward_command_to_all(cli_session, "command_show_eng_stats_ex_zero")
+
+    def command_show_fsm_latency(self, cli_session):
+        self.forward_command_to_all(cli_session, "command_show_fsm_latency")
+
+    def command_show_nodes(self, cli_session):
+        tab = table.Table()
+        tab.add_row(node.Node.cli_summary_headers())
+        tab.add_rows(self.node_rows("cli_summary_attributes"))
+        cli_session.print(tab.to_string())
+
+    def command_show_nodes_level(self, cli_session):
+        tab = table.Table()
+        tab.add_row(node.Node.cli_level_headers())
+        tab.add_rows(self.node_rows("cli_level_attributes"))
+        cli_session.print(tab.to_string())
+
+    def command_start_profiling(self, cli_session):
+        self.forward_command_to_all(cli_session, "command_start_profiling")
+
+    def command_start_profiling_file(self, cli_session, parameters):
+        # Each worker process writes its own profile: add the shard ID to the file name
+        (root, extension) = os.path.splitext(parameters['file'])
+        def shard_parameters(shard_process):
+            return {'file': "{}-shard-{}{}".format(root, shard_process.shard_id, extension)}
+        self.forward_command_to_all(cli_session, "command_start_profiling_file", shard_parameters)
+
+    def command_stop_profiling(self, cli_session):
+        self.forward_command_to_all(cli_session, "command_stop_profiling")
+
+    def command_set_node(self, cli_session, parameters):
+        node_name = parameters['node']
+        if node_name in self._nodes:
+            cli_session.set_current_node(self._nodes[node_name])
+        else:
+            cli_session.print("Node {} does not exist".format(node_name))
+
+    def command_exit(self, cli_session):
+        cli_session.close()
+
+    def command_help(self, cli_session):
+        cli_session.help()
+
+    def command_stop(self, cli_session):
+        cli_session.close()
+        sys.exit(0)
+
+ShardFrontEnd.parse_tree = make_parse_tree(engine.Engine.parse_tree, ShardFrontEnd)
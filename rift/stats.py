@@ -1,3 +1,4 @@
+import bisect
 import operator
 import time
 
@@ -6,7 +7,12 @@ import table
 
 RATE_HISTORY = 10            # Look at up to last N samples to calculate "recent rate"
 
-TIME_FUNCTION = time.time    # So that we can stub it for unit testing
+# So that we can stub it for unit testing. Named like a constant because it is a module-level
+# setting, even though pylint classifies a function object as a variable.
+TIME_FUNCTION = time.time    # pylint: disable=invalid-name
+
+# Upper bounds (in seconds) of the buckets of latency histograms; the last bucket has no bound
+HISTOGRAM_BUCKET_BOUNDS = [0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0]
 
 def secs_to_dmhs_str(secs):
     mins = 0
@@ -193,3 +199,68 @@ class Counter(StatBase):
 
     def increase(self):
         self.add_values([1])
+
+def duration_display_str(secs):
+    if secs < 0.001:
+        return "{:.1f}us".format(secs * 1000000.0)
+    elif secs < 1.0:
+        return "{:.2f}ms".format(secs * 1000.0)
+    else:
+        return "{:.3f}s".format(secs)
+
+class Histogram:
+
+    # Latency histogram with one bucket per order of magnitude (see HISTOGRAM_BUCKET_BOUNDS).
+    # Recording a sample is cheap enough to be done for every event loop activity.
+
+    def __init__(self, description):
+        self._description = description
+        self.clear()
+
+    def clear(self):
+        self._buckets = [0] * (len(HISTOGRAM_BUCKET_BOUNDS) + 1)
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+
+    def record(self, secs):
+        self._buckets[bisect.bisect_left(HISTOGRAM_BUCKET_BOUNDS, secs)] += 1
+        self._count += 1
+        self._total += secs
+        self._max = max(self._max, secs)
+
+    def description(self):
+        return self._description
+
+    def count(self):
+        return self._count
+
+    def buckets(self):
+        return self._buckets
+
+    def average(self):
+        if self._count == 0:
+            return 0.0
+        return self._total / self._count
+
+    def maximum(self):
+        return self._max
+
+    @staticmethod
+    def table_headers():
+        headers = ["Samples", "Average", "Maximum"]
+        lower_bound_str = "0"
+        for bound in HISTOGRAM_BUCKET_BOUNDS:
+            upper_bound_str = duration_display_str(bound).replace(".0us", "us")
+            upper_bound_str = upper_bound_str.replace(".00ms", "ms").replace(".000s", "s")
+            headers.append([lower_bound_str + " -", upper_bound_str])
+            lower_bound_str = upper_bound_str
+        headers.append([lower_bound_str + " -", "Up"])
+        return headers
+
+    def table_cells(self):
+        cells = [self._count,
+                 duration_display_str(self.average()),
+                 duration_display_str(self._max)]
+        cells.extend(self._buckets)
+        return cells
@@ -0,0 +1,89 @@
+import bisect
+
+import sortedcontainers
+
+import table
+
+class TideRange:
+
+    # One TIDE packet out of the TIDE packets that together cover the entire TIE-ID space
+
+    def __init__(self, start_range, end_range, tie_packet_infos):
+        self.start_range = start_range
+        self.end_range = end_range
+        self.tie_packet_infos = tie_packet_infos
+        # The encoded TIDE, and when it was encoded (None if not encoded yet)
+        self.packet_info = None
+        self.encode_time = None
+
+class TideCache:
+
+    # Caches the TIDE packets that a node periodically sends on an interface, so that the TIDEs do
+    # not have to be regenerated and re-encoded from scratch every TIDE interval. See
+    # Node.cached_tide_packet_infos for how the cache is maintained.
+
+    def __init__(self):
+        # The flooding scope parameters of the neighbor and of the node (direction, system-id,
+        # level, and top-of-fabric flag of the neighbor; level and top-of-fabric flag of the node)
+        # for which the cached TIDEs were generated
+        self.key = None
+        # The TIE-DB generation at which the cached TIDEs were generated
+        self.generation = None
+        # The TIEs which are included in the TIDEs (tie_packet_info indexed by tie_id)
+        self.tie_packet_infos = sortedcontainers.SortedDict()
+        # The maximum number of TIE headers per TIDE for which the ranges were split
+        self.max_headers = None
+        # The ranges (TideRange objects), in increasing order, and the index of the range to be
+        # sent next
+        self.ranges = []
+        self.next_range_index = 0
+        # Statistics
+        self.sent_count = 0
+        self.hit_count = 0
+        self.refresh_count = 0
+        self.encode_count = 0
+        self.incremental_count = 0
+        self.full_count = 0
+
+    def clear(self):
+        self.key = None
+        self.generation = None
+        self.tie_packet_infos.clear()
+        self.max_headers = None
+        self.ranges = []
+        self.next_range_index = 0
+
+    def set_ranges(self, ranges):
+        # Continue the rotation where it was: with the new range that covers the start of the range
+        # that was going to be sent next, so that no part of the TIE-ID space is skipped
+        if self.ranges:
+            next_start_range = self.ranges[self.next_range_index].start_range
+            starts = [tide_range.start_range for tide_range in ranges]
+            self.next_range_index = max(bisect.bisect_right(starts, next_start_range) - 1, 0)
+        else:
+            self.next_range_index = 0
+        self.ranges = ranges
+
+    def next_range(self):
+        tide_range = self.ranges[self.next_range_index]
+        self.next_range_index = (self.next_range_index + 1) % len(self.ranges)
+        return tide_range
+
+    def hit_rate_str(self):
+        if self.sent_count == 0:
+            return "-"
+        return "{:.1f}%".format(100.0 * self.hit_count / self.sent_count)
+
+    def stats_table(self):
+        tab = table.Table()
+        tab.add_row(["Description", "Value"])
+        tab.add_rows([
+            ["TIDE ranges", len(self.ranges)],
+            ["Sent TIDEs", self.sent_count],
+            ["Re-sent cached TIDEs", self.hit_count],
+            ["Re-encoded to refresh lifetimes", self.refresh_count],
+            ["Encoded after TIE-DB change", self.encode_count],
+            ["Incrementally updated", self.incremental_count],
+            ["Fully regenerated", self.full_count],
+            ["Hit rate", self.hit_rate_str()]])
+        return tab
@@ -0,0 +1,133 @@
+import collections
+import enum
+import itertools
+
+import heapdict
+import sortedcontainers
+
+class ChangeType(enum.Enum):
+    ADD = 1
+    UPDATE = 2
+    REMOVE = 3
+
+# One entry in the change journal of the TIE-DB
+TieDbChange = collections.namedtuple("TieDbChange", ["generation", "tie_id", "change_type"])
+
+class TieDb:
+
+    # The TIE database: the stored TIEs (tie_packet_info) indexed by, and sorted by, tie_id.
+    #
+    # Every change (a TIE being added, updated, or removed) increments the generation number of
+    # the TIE-DB and is recorded in a bounded change journal. A consumer that needs to keep
+    # something in sync with the TIE-DB (e.g. the cached TIDEs of an interface) remembers the
+    # generation at which it last looked at the TIE-DB, and later asks for the changes since that
+    # generation instead of rescanning the whole TIE-DB. If the journal no longer goes back that
+    # far, the consumer has to fall back to a full rescan.
+    #
+    # The TIE-DB can be read like a (sorted) dictionary, but all modifications must go through
+    # store, remove, and clear so that they are recorded in the journal.
+    #
+    # The TIE-DB also ages the stored TIEs. Instead of decrementing the remaining lifetime of every
+    # TIE every second, the TIE-DB keeps an aging time (in seconds, advanced by age) and the expire
+    # time of each TIE in an index which is ordered by expire time. The remaining lifetime of a
+    # stored TIE is derived from its expire time when it is needed (see
+    # packet_common.TieLifetime), and aging only touches the TIEs that actually expire.
+
+    DEFAULT_JOURNAL_LENGTH = 1000
+
+    def __init__(self, journal_length=DEFAULT_JOURNAL_LENGTH):
+        self._tie_packet_infos = sortedcontainers.SortedDict()
+        self.generation = 0
+        self._journal = collections.deque([], journal_length)
+        self.aging_time = 0
+        self._expire_index = heapdict.heapdict()    # Expire time indexed by tie_id
+
+    def __contains__(self, tie_id):
+        return tie_id in self._tie_packet_infos
+
+    def __getitem__(self, tie_id):
+        return self._tie_packet_infos[tie_id]
+
+    def __iter__(self):
+        return iter(self._tie_packet_infos)
+
+    def __len__(self):
+        return len(self._tie_packet_infos)
+
+    def get(self, tie_id, default=None):
+        return self._tie_packet_infos.get(tie_id, default)
+
+    def keys(self):
+        return self._tie_packet_infos.keys()
+
+    def values(self):
+        return self._tie_packet_infos.values()
+
+    def items(self):
+        return self._tie_packet_infos.items()
+
+    def irange(self, minimum=None, maximum=None, inclusive=(True, True)):
+        return self._tie_packet_infos.irange(minimum, maximum, inclusive)
+
+    def store(self, tie_id, tie_packet_info):
+        old_tie_packet_info = self._tie_packet_infos.get(tie_id)
+        if old_tie_packet_info is None:
+            change_type = ChangeType.ADD
+        else:
+            change_type = ChangeType.UPDATE
+            if old_tie_packet_info is not tie_packet_info:
+                old_tie_packet_info.stop_aging()
+        expire_time = self.aging_time + tie_packet_info.remaining_tie_lifetime
+        tie_packet_info.start_aging(self, expire_time)
+        self._expire_index[tie_id] = expire_time
+        self._tie_packet_infos[tie_id] = tie_packet_info
+        self._record_change(tie_id, change_type)
+
+    def remove(self, tie_id):
+        # Returns the removed tie_packet_info, or None if the TIE was not in the TIE-DB
+        tie_packet_info = self._tie_packet_infos.pop(tie_id, None)
+        if tie_packet_info is not None:
+            tie_packet_info.stop_aging()
+            self._expire_index.pop(tie_id, None)
+            self._record_change(tie_id, ChangeType.REMOVE)
+        return tie_packet_info
+
+    def clear(self):
+        for tie_id in list(self._tie_packet_infos.keys()):
+            self.remove(tie_id)
+
+    def age(self, secs=1):
+        # Advance the aging time, and return the tie_ids of the TIEs that expired (i.e. of which
+        # the remaining lifetime dropped to zero or below). The expired TIEs are not removed; that
+        # is up to the caller.
+        self.aging_time += secs
+        expired_tie_ids = []
+        while self._expire_index:
+            (tie_id, expire_time) = self._expire_index.peekitem()
+            if expire_time > self.aging_time:
+                break
+            self._expire_index.popitem()
+            expired_tie_ids.append(tie_id)
+        return expired_tie_ids
+
+    def _record_change(self, tie_id, change_type):
+        self.generation += 1
+        self._journal.append(TieDbChange(self.generation, tie_id, change_type))
+
+    def changes_since(self, generation):
+        # Returns the changes (TieDbChange tuples, oldest first) after the given generation, or
+        # None if the journal does not go back that far
+        nr_changes = self.generation - generation
+        if nr_changes > len(self._journal):
+            return None
+        changes = list(itertools.islice(reversed(self._journal), nr_changes))
+        changes.reverse()
+        return changes
+
+    def changed_tie_ids_since(self, generation):
+        # Returns the set of tie_ids that were added, updated, or removed after the given
+        # generation, or None if the journal does not go back that far
+        changes = self.changes_since(generation)
+        if changes is None:
+            return None
+        return set(change.tie_id for change in changes)
@@ -0,0 +1,83 @@
+class TieFragmenter:
+
+    # Assigns the entries of a self-originated TIE (the prefixes of a prefix TIE, or the neighbors
+    # of a node TIE) to fragments, i.e. to multiple TIEs with consecutive TIE numbers, such that
+    # each fragment fits in a packet of at most max_size bytes.
+    #
+    # The assignment is stable: an entry stays in the same fragment for as long as it exists and
+    # that fragment does not overflow. New entries are added to the first fragment that has room
+    # for them, or to a new fragment at the end. Hence adding, changing, or removing an entry
+    # normally only changes a single fragment, and only that fragment needs to be re-originated
+    # and re-flooded. Fragments are never removed, even if they become empty, because an empty
+    # fragment must still be re-originated to flush the entries that it used to contain.
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._fragments = []        # The entries of each fragment (value indexed by key)
+        self._fragment_sizes = []   # Sum of the sizes of the entries in each fragment
+        self._entry_sizes = {}      # Size of each entry, indexed by key
+        self._fragment_index = {}   # Index of the fragment containing each entry, indexed by key
+
+    def clear(self):
+        self._fragments = []
+        self._fragment_sizes = []
+        self._entry_sizes = {}
+        self._fragment_index = {}
+
+    def nr_fragments(self):
+        return len(self._fragments)
+
+    def fragment_index(self, key):
+        return self._fragment_index.get(key)
+
+    def update(self, entries, empty_size, entry_size_function):
+        # Update the assignment for the new set of entries (value indexed by key). The empty_size
+        # is the size of a fragment without any entries, and entry_size_function(key, value)
+        # returns the number of bytes that an entry adds to a fragment. Returns the list of
+        # fragments (at least one), each a dictionary with the entries (value indexed by key) of
+        # that fragment.
+        budget = self.max_size - empty_size
+        new_keys = [key for key in entries if key not in self._fragment_index]
+        for (index, fragment) in enumerate(self._fragments):
+            for (key, value) in list(fragment.items()):
+                if key not in entries:
+                    self._remove_entry(index, key)
+                elif entries[key] != value:
+                    fragment[key] = entries[key]
+                    new_entry_size = entry_size_function(key, entries[key])
+                    self._fragment_sizes[index] += new_entry_size - self._entry_sizes[key]
+                    self._entry_sizes[key] = new_entry_size
+        # Move entries out of fragments that overflowed (because an entry or the empty size grew),
+        # starting with the most recently added entries.
+        displaced_keys = []
+        for (index, fragment) in enumerate(self._fragments):
+            while len(fragment) > 1 and self._fragment_sizes[index] > budget:
+                key = next(reversed(fragment))
+                self._remove_entry(index, key)
+                displaced_keys.append(key)
+        for key in displaced_keys + new_keys:
+            entry_size = entry_size_function(key, entries[key])
+            self._add_entry(key, entries[key], entry_size, budget)
+        # There is always at least one fragment, even if there are no entries at all
+        if not self._fragments:
+            self._fragments.append({})
+            self._fragment_sizes.append(0)
+        return self._fragments
+
+    def _add_entry(self, key, value, entry_size, budget):
+        for (index, fragment) in enumerate(self._fragments):
+            if (not fragment) or (self._fragment_sizes[index] + entry_size <= budget):
+                break
+        else:
+            self._fragments.append({})
+            self._fragment_sizes.append(0)
+            index = len(self._fragments) - 1
+        self._fragments[index][key] = value
+        self._fragment_sizes[index] += entry_size
+        self._entry_sizes[key] = entry_size
+        self._fragment_index[key] = index
+
+    def _remove_entry(self, index, key):
+        del self._fragments[index][key]
+        self._fragment_sizes[index] -= self._entry_sizes.pop(key)
+        del self._fragment_index[key]
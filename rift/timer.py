@@ -1,59 +1,197 @@
-from datetime import datetime
-from sortedcontainers import SortedDict
+import functools
+import math
+import time
+import zlib
+
+# The timer scheduler is a hierarchical timing wheel, as described in "Hashed and Hierarchical
+# Timing Wheels" (Varghese and Lauck) and as used in the classic Linux kernel timer code.
+#
+# Time is divided into ticks of TICK_SECS. Level 0 of the wheel has one slot per tick and contains
+# the timers that expire in the next 2^LEVEL_BITS[0] ticks. Each slot in level 1 covers as many
+# ticks as the whole of level 0, each slot in level 2 covers as many ticks as the whole of level 1,
+# etc. Whenever a level wraps around, the timers in the next slot of the level above are cascaded
+# down.
+#
+# Starting, stopping and expiring a timer are O(1) operations (cascading is amortized O(1) per
+# level). A timer never expires before its expire time, but it may expire up to one tick late.
 
 class TimerScheduler:
 
+    TICK_SECS = 0.01
+    # Level 0 covers 2.56 seconds, so that the time to the next expire is exact for all the
+    # frequently running timers. All levels together cover 2^26 ticks, i.e. about 7.7 days.
+    LEVEL_BITS = [8, 6, 6, 6]
+    LEVEL_SHIFTS = [0, 8, 14, 20]
+    NR_LEVELS = len(LEVEL_BITS)
+    # Timers further in the future than this are parked in the highest level and re-cascaded until
+    # they are close enough.
+    MAX_DELTA_TICKS = (1 << sum(LEVEL_BITS)) - 1
+    # Number of phases into which each tick group is divided (see TickGroup)
+    TICK_GROUP_PHASES = 10
+
     def __init__(self):
-        self._epoch = datetime.now()
-        self._timers_by_expire_time = SortedDict()
+        self._epoch = time.monotonic()
+        # The next tick that has not been processed yet
+        self._current_tick = 0
+        # Each slot is a dict of timer -> expire tick (a dict, not a set, to keep insertion order)
+        self._levels = [[{} for _ in range(1 << bits)] for bits in self.LEVEL_BITS]
+        self._level_counts = [0] * self.NR_LEVELS
+        # For each scheduled timer, the slot and level it is in (for O(1) unschedule)
+        self._slot_by_timer = {}
+        self._tick_groups = {}   # Indexed by interval
 
     def now(self):
-        absolute_now = datetime.now()
-        time_since_epoch = absolute_now - self._epoch
-        return time_since_epoch.total_seconds()
+        return time.monotonic() - self._epoch
+
+    def nr_scheduled_timers(self):
+        return len(self._slot_by_timer)
+
+    def tick_group(self, interval):
+        group = self._tick_groups.get(interval)
+        if group is None:
+            group = TickGroup(interval, self.TICK_GROUP_PHASES, self)
+            self._tick_groups[interval] = group
+        return group
 
     def schedule(self, timer):
         expire_time = timer.expire_time()
         assert expire_time is not None
-        if expire_time in self._timers_by_expire_time:
-            self._timers_by_expire_time[expire_time].append(timer)
-        else:
-            self._timers_by_expire_time[expire_time] = [timer]
+        if timer in self._slot_by_timer:
+            self._unlink(timer)
+        # Round up, so that the timer never expires before its expire time
+        expire_tick = math.ceil(expire_time / self.TICK_SECS)
+        self._insert(timer, expire_tick)
 
     def unschedule(self, timer):
-        expire_time = timer.expire_time()
-        assert expire_time is not None
-        assert expire_time in self._timers_by_expire_time
-        timers_with_matching_expire = self._timers_by_expire_time[expire_time]
-        assert timer in timers_with_matching_expire
-        timers_with_matching_expire.remove(timer)
-        if timers_with_matching_expire == []:
-            self._timers_by_expire_time.pop(expire_time)
+        if timer in self._slot_by_timer:
+            self._unlink(timer)
+
+    def _insert(self, timer, expire_tick):
+        delta = expire_tick - self._current_tick
+        if delta < 0:
+            # Already expired; expire it when the next tick is processed
+            placement_tick = self._current_tick
+            delta = 0
+        elif delta > self.MAX_DELTA_TICKS:
+            placement_tick = self._current_tick + self.MAX_DELTA_TICKS
+            delta = self.MAX_DELTA_TICKS
+        else:
+            placement_tick = expire_tick
+        level = 0
+        while delta >= (1 << (self.LEVEL_SHIFTS[level] + self.LEVEL_BITS[level])):
+            level += 1
+        index = self._slot_index(placement_tick, level)
+        slot = self._levels[level][index]
+        slot[timer] = expire_tick
+        self._slot_by_timer[timer] = (slot, level)
+        self._level_counts[level] += 1
+
+    def _slot_index(self, tick, level):
+        return (tick >> self.LEVEL_SHIFTS[level]) & ((1 << self.LEVEL_BITS[level]) - 1)
+
+    def _unlink(self, timer):
+        (slot, level) = self._slot_by_timer.pop(timer)
+        del slot[timer]
+        self._level_counts[level] -= 1
+
+    def _cascade(self, tick):
+        # Called when level 0 wraps around. Move the timers in the next slot of level 1 down; if
+        # level 1 wraps around as well, do the same for level 2, etc.
+        for level in range(1, self.NR_LEVELS):
+            index = self._slot_index(tick, level)
+            slot = self._levels[level][index]
+            if slot:
+                self._levels[level][index] = {}
+                for timer in slot:
+                    del self._slot_by_timer[timer]
+                self._level_counts[level] -= len(slot)
+                for timer, expire_tick in slot.items():
+                    self._insert(timer, expire_tick)
+            if index != 0:
+                break
+
+    def _next_expire_tick(self):
+        # Return the first tick at which a timer may expire (or at which timers need to be
+        # cascaded down from a higher level), or None if no timers are scheduled.
+        if not self._slot_by_timer:
+            return None
+        # A timer in level 0 may expire later than the cascade of a timer in a higher level (which
+        # may expire soon after it has been cascaded), so all levels are always considered.
+        current = self._current_tick
+        next_tick = None
+        if self._level_counts[0]:
+            level_0 = self._levels[0]
+            mask = len(level_0) - 1
+            for offset in range(len(level_0)):
+                if level_0[(current + offset) & mask]:
+                    next_tick = current + offset
+                    break
+        for level in range(1, self.NR_LEVELS):
+            if self._level_counts[level] == 0:
+                continue
+            shift = self.LEVEL_SHIFTS[level]
+            slots = self._levels[level]
+            mask = len(slots) - 1
+            base = current >> shift
+            # The slot at the current index is only due now if we are exactly on its boundary;
+            # otherwise it has already been cascaded and contains timers for the next rotation.
+            first_offset = 0 if current & ((1 << shift) - 1) == 0 else 1
+            for offset in range(first_offset, first_offset + len(slots)):
+                if slots[(base + offset) & mask]:
+                    level_tick = (base + offset) << shift
+                    if next_tick is None or level_tick < next_tick:
+                        next_tick = level_tick
+                    break
+        return next_tick
 
     def trigger_all_expired_timers(self):
         # Trigger all expired timers and return time until next expire
         now = self.now()
-        while True:
-            if not self._timers_by_expire_time:
-                return None
-            next_expire_time = self._timers_by_expire_time.peekitem(0)[0]
-            if next_expire_time > now:
-                return next_expire_time - now
-            expired_timers = self._timers_by_expire_time.popitem(0)[1]
-            for timer in expired_timers:
-                timer.trigger_expire()
+        now_tick = int(now / self.TICK_SECS)
+        while self._current_tick <= now_tick:
+            if not self._slot_by_timer:
+                self._current_tick = now_tick + 1
+                break
+            tick = self._current_tick
+            index = self._slot_index(tick, 0)
+            if index == 0:
+                self._cascade(tick)
+            elif self._level_counts[0] == 0:
+                # Nothing can expire before the next cascade; skip ahead
+                level_0_bits = self.LEVEL_BITS[0]
+                next_cascade_tick = ((tick >> level_0_bits) + 1) << level_0_bits
+                self._current_tick = min(next_cascade_tick, now_tick + 1)
+                continue
+            self._current_tick = tick + 1
+            expired_timers = self._levels[0][index]
+            if not expired_timers:
+                continue
+            self._levels[0][index] = {}
+            for timer in list(expired_timers):
+                # The expire function of a previous timer may have stopped this timer
+                if timer in expired_timers:
+                    self._unlink(timer)
+                    timer.trigger_expire()
+        next_expire_tick = self._next_expire_tick()
+        if next_expire_tick is None:
+            return None
+        return max(0.0, next_expire_tick * self.TICK_SECS - now)
 
     def stop_all_timers(self):
-        while self._timers_by_expire_time:
-            timers = self._timers_by_expire_time.peekitem(0)[1]
-            for timer in timers:
-                timer.stop()
+        for group in self._tick_groups.values():
+            group.stop_all_members()
+        for timer in list(self._slot_by_timer):
+            timer.stop()
+            self.unschedule(timer)
 
 TIMER_SCHEDULER = TimerScheduler()
 
 class Timer:
 
-    def __init__(self, interval, expire_function, periodic=True, start=True):
+    def __init__(self, interval, expire_function, periodic=True, start=True, scheduler=None):
+        if scheduler is None:
+            scheduler = TIMER_SCHEDULER
+        self._scheduler = scheduler
         self._running = False
         self._periodic = periodic
         self._interval = interval
@@ -76,33 +214,149 @@ class Timer:
 
     def remaining_time_str(self):
         if self._running:
-            secs_left = self._expire_time - TIMER_SCHEDULER.now()
+            secs_left = self._expire_time - self._scheduler.now()
             return "{:06f} secs".format(secs_left)
         else:
             return "Stopped"
 
-    def start(self):
+    def start(self, first_interval=None):
+        # The first_interval, if given, is used instead of the interval for the first expire
         if self._running:
             self.stop()
+        if first_interval is None:
+            first_interval = self._interval
         self._running = True
-        self._expire_time = TIMER_SCHEDULER.now() + self._interval
-        TIMER_SCHEDULER.schedule(self)
+        self._expire_time = self._scheduler.now() + first_interval
+        self._scheduler.schedule(self)
 
     def stop(self):
         if self._running:
-            TIMER_SCHEDULER.unschedule(self)
+            self._scheduler.unschedule(self)
             self._running = False
             self._expire_time = None
 
     def trigger_expire(self):
         if self._expire_function is not None:
             self._expire_function()
+        if not self._running:
+            # The expire function stopped the timer
+            return
         if self._periodic:
             # Next expire is not now + interval but current expire_time + interval because the
             # expire function may be called too late when the system is busy, in which case we
             # try to catch up.
             self._expire_time += self._interval
-            TIMER_SCHEDULER.schedule(self)
+            self._scheduler.schedule(self)
         else:
             self._running = False
             self._expire_time = None
+
+class TickGroup:
+
+    # A tick group coalesces all periodic work with the same interval: one timer expiration
+    # dispatches all members of the group in a single pass, instead of each member having its own
+    # timer which expires in its own scheduler pass.
+    #
+    # To avoid that all members run in the same burst, the interval is divided into a fixed number
+    # of phases. Each member is assigned to a phase based on a hash of its jitter key (e.g. the
+    # name of the interface), so the assignment is the same every time the engine runs. Phase P
+    # expires at times N * interval + P * interval / nr_phases on the scheduler clock. Members
+    # without a jitter key are assigned to phase 0.
+
+    def __init__(self, interval, nr_phases, scheduler):
+        self._interval = interval
+        self._nr_phases = nr_phases
+        self._scheduler = scheduler
+        self._members_by_phase = [{} for _ in range(nr_phases)]
+        self._timers_by_phase = [Timer(interval=interval,
+                                       expire_function=functools.partial(self._dispatch, phase),
+                                       periodic=True,
+                                       start=False,
+                                       scheduler=scheduler)
+                                 for phase in range(nr_phases)]
+
+    def interval(self):
+        return self._interval
+
+    def nr_members(self):
+        return sum(len(members) for members in self._members_by_phase)
+
+    def phase_for_key(self, jitter_key):
+        if jitter_key is None:
+            return 0
+        return zlib.crc32(jitter_key.encode()) % self._nr_phases
+
+    def add_member(self, member, phase):
+        self._members_by_phase[phase][member] = None
+        phase_timer = self._timers_by_phase[phase]
+        if not phase_timer.running():
+            now = self._scheduler.now()
+            offset = phase * self._interval / self._nr_phases
+            next_expire_time = math.floor((now - offset) / self._interval) * self._interval
+            next_expire_time += offset
+            while next_expire_time <= now:
+                next_expire_time += self._interval
+            phase_timer.start(first_interval=next_expire_time - now)
+
+    def remove_member(self, member, phase):
+        members = self._members_by_phase[phase]
+        members.pop(member, None)
+        if not members:
+            self._timers_by_phase[phase].stop()
+
+    def remaining_time_str(self, phase):
+        return self._timers_by_phase[phase].remaining_time_str()
+
+    def stop_all_members(self):
+        for members in self._members_by_phase:
+            for member in list(members):
+                member.stop()
+
+    def _dispatch(self, phase):
+        members = self._members_by_phase[phase]
+        for member in list(members):
+            # The expire function of a previous member may have stopped this member
+            if member in members:
+                member.trigger_expire()
+
+class GroupTimer:
+
+    # A periodic timer with the same interface as Timer, but which is a member of the tick group
+    # for its interval instead of having its own timer. The first expire happens at the next
+    # expire of its phase in the tick group, i.e. somewhere between 0 and interval seconds after
+    # it is started.
+
+    def __init__(self, interval, expire_function, start=True, jitter_key=None, scheduler=None):
+        if scheduler is None:
+            scheduler = TIMER_SCHEDULER
+        self._group = scheduler.tick_group(interval)
+        self._phase = self._group.phase_for_key(jitter_key)
+        self._expire_function = expire_function
+        self._running = False
+        if start:
+            self.start()
+
+    def running(self):
+        return self._running
+
+    def interval(self):
+        return self._group.interval()
+
+    def remaining_time_str(self):
+        if self._running:
+            return self._group.remaining_time_str(self._phase)
+        else:
+            return "Stopped"
+
+    def start(self):
+        self._running = True
+        self._group.add_member(self, self._phase)
+
+    def stop(self):
+        if self._running:
+            self._running = False
+            self._group.remove_member(self, self._phase)
+
+    def trigger_expire(self):
+        if self._expire_function is not None:
+            self._expire_function()
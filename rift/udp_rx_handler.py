@@ -3,6 +3,7 @@ import platform
 import socket
 import struct
 
+import constants
 import scheduler
 import utils
 
@@ -78,12 +79,39 @@ for symbol in SYMBOLS:
     if not hasattr(socket, symbol):
         setattr(socket, symbol, SYMBOLS[symbol])
 
+class RxBufferPool:
+
+    # A pool of receive buffers, shared by all UDP receive handlers. Messages are received directly
+    # into a buffer from the pool, and passed to the receive function as a memoryview into that
+    # buffer, without copying them. The buffers are returned to the pool once the receive function
+    # has processed the batch; the receive function must copy anything it wants to keep beyond
+    # that (see PacketInfo.own_buffers). Since batches are processed one at a time, the pool only
+    # needs to grow to the batch size, regardless of the number of sockets.
+
+    def __init__(self, buffer_size):
+        self._buffer_size = buffer_size
+        self._free_buffers = []
+        self.nr_allocated = 0
+
+    def acquire(self):
+        if self._free_buffers:
+            return self._free_buffers.pop()
+        self.nr_allocated += 1
+        return memoryview(bytearray(self._buffer_size))
+
+    def release(self, buffers):
+        self._free_buffers.extend(buffers)
+
 class UdpRxHandler:
 
     MAX_SIZE = 65535
 
+    # The only ancillary data we ask for is IP_PKTINFO / IPV6_PKTINFO
+    ANCILLARY_SIZE = socket.CMSG_SPACE(max(ctypes.sizeof(in_pktinfo), ctypes.sizeof(in6_pktinfo)))
+
+    # The receive_function is called with a list of (message, from_info) tuples and the socket
     def __init__(self, interface_name, local_port, ipv4, multicast_address, remote_address,
-                 receive_function, log, log_id):
+                 receive_function, log, log_id, batch_size=constants.DEFAULT_RX_BATCH_SIZE):
         self._interface_name = interface_name
         self._local_port = local_port
         self._ipv4 = ipv4                             # IPv4 if True, IPv6 if False
@@ -92,6 +120,7 @@ class UdpRxHandler:
         self._receive_function = receive_function
         self._log = log
         self._log_id = log_id
+        self._batch_size = batch_size
         self._local_ipv4_address = utils.interface_ipv4_address(interface_name)
         self._local_ipv6_address = utils.interface_ipv6_address(interface_name)
         try:
@@ -110,6 +139,9 @@ class UdpRxHandler:
             else:
                 self.sock = self.create_socket_ipv6_rx_ucast()
         if self.sock:
+            # Non-blocking, so that ready_to_read can drain all pending messages until it gets
+            # EWOULDBLOCK
+            self.sock.setblocking(False)
             scheduler.SCHEDULER.register_handler(self, True, False)
 
     def warning(self, msg, *args):
@@ -128,27 +160,51 @@ class UdpRxHandler:
             return None
 
     def ready_to_read(self):
-        ancillary_size = socket.CMSG_LEN(self.MAX_SIZE)
+        # Receive up to batch_size messages (or until there are no more pending messages) in
+        # one go, instead of going through a complete scheduler iteration for each message.
+        batch = []
+        buffers = []
+        buffer = None
         try:
-            message, ancillary_messages, _msg_flags, from_info = \
-                self.sock.recvmsg(self.MAX_SIZE, ancillary_size)
-        except (IOError, OSError) as err:
-            self.warning("Socket receive failed: %s", err)
-        else:
-            if not MACOS:
-                rx_interface_index = None
-                for anc in ancillary_messages:
-                    # pylint:disable=no-member
-                    if anc[0] == socket.SOL_IP and anc[1] == socket.IP_PKTINFO:
-                        packet_info = in_pktinfo.from_buffer_copy(anc[2])
-                        rx_interface_index = packet_info.ipi_ifindex
-                    elif anc[0] == socket.SOL_IPV6 and anc[1] == socket.IPV6_PKTINFO:
-                        packet_info = in6_pktinfo.from_buffer_copy(anc[2])
-                        rx_interface_index = packet_info.ipi6_ifindex
-                if rx_interface_index and (rx_interface_index != self._interface_index):
-                    # Message received on "wrong" interface; ignore
-                    return
-            self._receive_function(message, from_info, self.sock)
+            while len(batch) < self._batch_size:
+                if buffer is None:
+                    buffer = RX_BUFFER_POOL.acquire()
+                try:
+                    nbytes, ancillary_messages, _msg_flags, from_info = \
+                        self.sock.recvmsg_into([buffer], self.ANCILLARY_SIZE)
+                except BlockingIOError:
+                    break
+                except (IOError, OSError) as err:
+                    self.warning("Socket receive failed: %s", err)
+                    break
+                if not MACOS and not self.received_on_this_interface(ancillary_messages):
+                    # Re-use the buffer for the next message
+                    continue
+                buffers.append(buffer)
+                batch.append((buffer[:nbytes], from_info))
+                buffer = None
+            if batch:
+                self._receive_function(batch, self.sock)
+        finally:
+            # Return the buffers to the pool, even if receiving or processing the batch failed
+            if buffer is not None:
+                buffers.append(buffer)
+            RX_BUFFER_POOL.release(buffers)
+
+    def received_on_this_interface(self, ancillary_messages):
+        rx_interface_index = None
+        for anc in ancillary_messages:
+            # pylint:disable=no-member
+            if anc[0] == socket.SOL_IP and anc[1] == socket.IP_PKTINFO:
+                packet_info = in_pktinfo.from_buffer_copy(anc[2])
+                rx_interface_index = packet_info.ipi_ifindex
+            elif anc[0] == socket.SOL_IPV6 and anc[1] == socket.IPV6_PKTINFO:
+                packet_info = in6_pktinfo.from_buffer_copy(anc[2])
+                rx_interface_index = packet_info.ipi6_ifindex
+        if rx_interface_index and (rx_interface_index != self._interface_index):
+            # Message received on "wrong" interface; ignore
+            return False
+        return True
 
     @staticmethod
     def enable_addr_and_port_reuse(sock):
@@ -281,3 +337,5 @@ class UdpRxHandler:
                 # Warn, but keep going; this socket option is not supported on macOS
                 self.warning("Could not set IPV6_RECVPKTINFO socket option: %s", err)
         return sock
+
+RX_BUFFER_POOL = RxBufferPool(UdpRxHandler.MAX_SIZE)
@@ -25,10 +25,15 @@ class RiftExpectSession:
 
     expect_timeout = 1.0
 
-    def __init__(self, topology_file=None, converge_secs=start_converge_secs, log_debug=True):
+    def __init__(self, topology_file=None, converge_secs=start_converge_secs, log_debug=True,
+                 multi_process=False, in_memory_links=False):
         rift_cmd = "rift --interactive --non-passive"
         if log_debug:
             rift_cmd += " --log-level debug"
+        if multi_process:
+            rift_cmd += " --multi-process"
+        if in_memory_links:
+            rift_cmd += " --in-memory-links"
         self._topology_file = topology_file
         if topology_file is not None:
             rift_cmd += " topology/{}.yaml".format(topology_file)
@@ -1,4 +1,5 @@
 import enum
+import logging
 import re
 
 import pytest
@@ -243,3 +244,55 @@ def test_fsm_basic(dog):
     assert dog.poops == 1
     assert dog.total_actions == 1
     dog.reset_action_counters()
+
+def test_latency_stats(dog):
+    fsm.Fsm.clear_latency_stats()
+    dog.fsm_instance.start()
+    dog.fsm_instance.push_event(dog.Event.PET)
+    dog.fsm_instance.push_event(dog.Event.SEE_SQUIRREL)
+    fsm.Fsm.process_queued_events()
+    # The chained WAIT event is also measured
+    latency_table = fsm.Fsm.latency_table().to_string()
+    assert re.search(r"\| Dog +\| PET +\| 1 +\|", latency_table)
+    assert re.search(r"\| Dog +\| SEE_SQUIRREL +\| 1 +\|", latency_table)
+    assert re.search(r"\| Dog +\| WAIT +\| 1 +\|", latency_table)
+    queues_table = fsm.Fsm.event_queues_table().to_string()
+    assert re.search(r"\| Events +\| 0 +\| 2 +\|", queues_table)
+    assert re.search(r"\| Chained Events +\| 0 +\| 1 +\|", queues_table)
+    fsm.Fsm.clear_latency_stats()
+    assert "PET" not in fsm.Fsm.latency_table().to_string()
+
+def test_dispatch_table(dog):
+    dispatch_table = dog.fsm_definition.dispatch_table
+    # Transition with state change: state exit and entry actions are resolved in the table
+    (to_state, actions, push_events, exit_actions, entry_actions) = \
+        dispatch_table[(dog.State.SITTING, dog.Event.SEE_SQUIRREL)]
+    assert to_state == dog.State.BARKING
+    assert [action.__name__ for action in actions] == ["action_growl", "action_jump"]
+    assert push_events == (dog.Event.WAIT,)
+    assert exit_actions == ()
+    assert [action.__name__ for action in entry_actions] == ["action_bark"]
+    # Transition back to the same state: no state exit and entry actions
+    (to_state, _, _, exit_actions, entry_actions) = \
+        dispatch_table[(dog.State.BARKING, dog.Event.WAIT)]
+    assert to_state == dog.State.BARKING
+    assert exit_actions == ()
+    assert entry_actions == ()
+    # Implicit transition
+    assert (dog.State.BARKING, dog.Event.SEE_SQUIRREL) not in dispatch_table
+
+def test_lazy_log_formatting(dog, monkeypatch):
+    log = logging.getLogger("test_fsm")
+    log.setLevel(logging.WARNING)
+    dog.fsm_instance = fsm.Fsm(dog.fsm_definition, dog, log, "dog")
+    def fail_log_str(_record):
+        assert False, "FSM record formatted while logging is disabled"
+    monkeypatch.setattr(fsm.FsmRecord, "log_str", fail_log_str)
+    dog.fsm_instance.start()
+    dog.fsm_instance.push_event(dog.Event.SEE_SQUIRREL)
+    fsm.Fsm.process_queued_events()
+    assert dog.fsm_instance.state == dog.State.BARKING
+    # The history is still recorded, and names are produced when it is shown
+    history = dog.fsm_instance.history_table(verbose=True).to_string()
+    assert re.search(r"\| SITTING +\| SEE_SQUIRREL +\| growl +\| BARKING +\|", history)
+    assert re.search(r"\| +\| +\| +\| +\| +\| WAIT +\| +\|", history)
@@ -0,0 +1,113 @@
+import logging
+
+import common.ttypes
+import constants
+import encoding.ttypes
+import engine
+import node
+import packet_common
+import timer
+
+SOUTH = constants.DIR_SOUTH
+PREFIX = common.ttypes.TIETypeType.PrefixTIEType
+
+def make_test_interface():
+    test_engine = engine.Engine(
+        passive_nodes=[],
+        run_which_nodes=[],
+        interactive=False,
+        telnet_port_file=None,
+        ipv4_multicast_loopback=False,
+        ipv6_multicast_loopback=False,
+        log_level=logging.CRITICAL,
+        config={}
+    )
+    node_config = {
+        "name": "node1",
+        "systemid": 1,
+        "level": 0,
+        "skip-self-orginated-ties": True
+    }
+    test_node = node.Node(node_config, test_engine)
+    return test_node.create_interface({"name": "if1"})
+
+def test_tire_batching():
+    packet_common.add_missing_methods_to_thrift()
+    intf = make_test_interface()
+    sent_tire_packets = []
+    intf.send_protocol_packet = \
+        lambda protocol_packet, flood: sent_tire_packets.append(protocol_packet.content.tire)
+    max_headers = packet_common.max_tire_headers(1400)
+    max_headers_per_interval = max_headers * intf.MAX_TIRES_PER_INTERVAL
+    nr_headers = max_headers_per_interval + max_headers // 2
+    for tie_nr in range(nr_headers):
+        intf.ack_tie(packet_common.make_tie_header_with_lifetime(SOUTH, 55, PREFIX, tie_nr, 1, 600))
+    # The first interval sends the maximum number of full TIREs
+    intf.service_queues()
+    assert len(sent_tire_packets) == intf.MAX_TIRES_PER_INTERVAL
+    assert all(len(tire_packet.headers) == max_headers for tire_packet in sent_tire_packets)
+    sent_tie_nrs = set()
+    for tire_packet in sent_tire_packets:
+        sent_tie_nrs |= {header.header.tieid.tie_nr for header in tire_packet.headers}
+    assert sent_tie_nrs == set(range(max_headers_per_interval))
+    # The next interval starts with the headers that did not fit in the previous interval
+    del sent_tire_packets[:]
+    intf.service_queues()
+    first_tie_nrs = {header.header.tieid.tie_nr for header in sent_tire_packets[0].headers}
+    assert set(range(max_headers_per_interval, nr_headers)) <= first_tie_nrs
+    tab_str = intf.tire_batching_table().to_string()
+    assert "| Sent TIREs                         | 16    |" in tab_str
+    assert "| Maximum TIREs per interval         | 8     |" in tab_str
+    assert "| Intervals capped by limit          | 2     |" in tab_str
+
+def make_tie_packet_info(tie_nr, seq_nr):
+    tie_packet = packet_common.make_prefix_tie_packet(SOUTH, 55, tie_nr, seq_nr)
+    tie_packet_info = packet_common.PacketInfo()
+    tie_packet_info.protocol_packet = encoding.ttypes.ProtocolPacket(
+        header=encoding.ttypes.PacketHeader(sender=55, level=1),
+        content=encoding.ttypes.PacketContent(tie=tie_packet))
+    return tie_packet_info
+
+def test_tie_retransmit_backoff(monkeypatch):
+    packet_common.add_missing_methods_to_thrift()
+    intf = make_test_interface()
+    sent_seq_nrs = []
+    intf.send_packet_info = \
+        lambda packet_info, flood: sent_seq_nrs.append(
+            packet_info.protocol_packet.content.tie.header.seq_nr)
+    tie_packet_info = make_tie_packet_info(1, 7)
+    tie_header = tie_packet_info.protocol_packet.content.tie.header
+    intf.node.find_tie_packet_info = lambda _tie_id: tie_packet_info
+    now = [100.0]
+    monkeypatch.setattr(timer.TIMER_SCHEDULER, "now", lambda: now[0])
+    # The TIE is sent immediately, and moves to the retransmit queue
+    intf.add_tie_header_to_ties_tx(tie_header, tie_packet_info)
+    assert sent_seq_nrs == [7]
+    assert "| South     | 55         | Prefix | 1      | 7      | 1.0 secs   | 0          |" in \
+        intf.ties_rtx_table().to_string()
+    # Trying to send the same version again does not send it again before it is due
+    intf.add_tie_header_to_ties_tx(tie_header)
+    assert sent_seq_nrs == [7]
+    # It is retransmitted after 1, 2, 4, 8, 16, and 16 seconds
+    retransmit_times = []
+    while now[0] < 150.0:
+        now[0] += 1.0
+        nr_sent = len(sent_seq_nrs)
+        intf.service_queues()
+        if len(sent_seq_nrs) > nr_sent:
+            retransmit_times.append(now[0] - 100.0)
+    assert retransmit_times == [1.0, 3.0, 7.0, 15.0, 31.0, 47.0]
+    # A newer version is sent immediately, and restarts the backoff
+    tie_packet_info = make_tie_packet_info(1, 8)
+    tie_header = tie_packet_info.protocol_packet.content.tie.header
+    intf.add_tie_header_to_ties_tx(tie_header)
+    assert sent_seq_nrs[-1] == 8
+    nr_sent = len(sent_seq_nrs)
+    now[0] += 1.0
+    intf.service_queues()
+    assert len(sent_seq_nrs) == nr_sent + 1
+    # Once the TIE has been acknowledged, it is no longer retransmitted
+    intf.tie_been_acked(tie_header)
+    now[0] += 100.0
+    intf.service_queues()
+    assert len(sent_seq_nrs) == nr_sent + 1
@@ -0,0 +1,56 @@
+import hashlib
+import hmac
+
+import key
+
+MESSAGE_PARTS = [b'header', None, b'payload']
+
+def test_digest():
+    for algorithm in key.ALGORITHMS:
+        if algorithm == "null":
+            continue
+        test_key = key.Key(1, algorithm, "secret")
+        digestmod = key.ALGORITHM_TO_DIGESTMOD[algorithm]
+        if "hmac" in algorithm:
+            expected = hmac.new(b"secret", b"headerpayload", digestmod=digestmod).digest()
+        else:
+            expected = hashlib.new(digestmod, b"secretheaderpayload").digest()
+        # The precomputed state is copied, not modified, for each digest
+        assert test_key.digest(MESSAGE_PARTS) == expected
+        assert test_key.digest(MESSAGE_PARTS) == expected
+        assert len(test_key.padded_digest(MESSAGE_PARTS)) % 4 == 0
+    null_key = key.Key(0, "null", None)
+    assert null_key.digest(MESSAGE_PARTS) == b''
+
+def test_cached_padded_digest():
+    test_key = key.Key(1, "hmac-sha-256", "secret")
+    cache = key.FingerprintCache()
+    expected = test_key.padded_digest(MESSAGE_PARTS)
+    assert test_key.cached_padded_digest(cache, "a", MESSAGE_PARTS) == expected
+    assert (cache.hit_count, cache.miss_count) == (0, 1)
+    # Same message, possibly in a receive buffer
+    message_parts = [memoryview(b'header'), None, memoryview(bytearray(b'payload'))]
+    assert test_key.cached_padded_digest(cache, "a", message_parts) == expected
+    assert (cache.hit_count, cache.miss_count) == (1, 1)
+    assert cache.hit_rate_str() == "50.0%"
+    # Same cache key, but different message
+    other_message_parts = [b'header', None, b'other payload']
+    assert (test_key.cached_padded_digest(cache, "a", other_message_parts) ==
+            test_key.padded_digest(other_message_parts))
+    assert (cache.hit_count, cache.miss_count) == (1, 2)
+    assert (test_key.cached_padded_digest(cache, "a", [b'header', b'', b'payload']) ==
+            test_key.padded_digest([b'header', b'', b'payload']))
+    assert (cache.hit_count, cache.miss_count) == (1, 3)
+
+def test_fingerprint_cache_eviction():
+    test_key = key.Key(1, "sha-256", "secret")
+    cache = key.FingerprintCache(max_entries=2)
+    test_key.cached_padded_digest(cache, "a", MESSAGE_PARTS)
+    test_key.cached_padded_digest(cache, "b", MESSAGE_PARTS)
+    test_key.cached_padded_digest(cache, "a", MESSAGE_PARTS)
+    test_key.cached_padded_digest(cache, "c", MESSAGE_PARTS)
+    assert len(cache) == 2
+    # The least recently used entry (b) was evicted
+    assert cache.lookup("a", MESSAGE_PARTS) is not None
+    assert cache.lookup("b", MESSAGE_PARTS) is None
+    assert cache.lookup("c", MESSAGE_PARTS) is not None
@@ -0,0 +1,97 @@
+import memory_transport
+import timer
+
+class ManualClockTimerScheduler(timer.TimerScheduler):
+
+    def __init__(self):
+        timer.TimerScheduler.__init__(self)
+        self.manual_now = 0.0
+
+    def now(self):
+        return self.manual_now
+
+class Receiver:
+
+    def __init__(self, transport, port, ipv4=True, multicast_address=None):
+        self.messages = []
+        self.handler = memory_transport.MemoryRxHandler(
+            transport=transport,
+            local_address="192.0.2.1" if ipv4 else "fd00::1",
+            local_port=port,
+            ipv4=ipv4,
+            multicast_address=multicast_address,
+            receive_function=self.receive)
+
+    def receive(self, messages, sock):
+        assert sock is self.handler.sock
+        self.messages.extend(messages)
+
+def test_multicast_and_unicast():
+    transport = memory_transport.MemoryTransport(ManualClockTimerScheduler())
+    mcast_receiver = Receiver(transport, 20001, multicast_address="224.0.1.1")
+    other_group_receiver = Receiver(transport, 20001, multicast_address="224.0.1.2")
+    ucast_receiver = Receiver(transport, 20001)
+    ipv6_receiver = Receiver(transport, 20001, ipv4=False, multicast_address="FF02::0078")
+    assert transport.nr_receivers() == 4
+    mcast_sock = transport.create_tx_socket(True, "192.0.2.2", "224.0.1.1", 20001)
+    ucast_sock = transport.create_tx_socket(True, "192.0.2.2", "192.0.2.1", 20001)
+    ipv6_sock = transport.create_tx_socket(False, "fd00::2", "ff02::78%eth0", 20001)
+    mcast_sock.sendmsg([b"multi", b"cast"])
+    ucast_sock.sendmsg([b"unicast"])
+    ipv6_sock.sendmsg([b"ipv6"])
+    # Nothing is delivered from within sendmsg
+    assert mcast_receiver.messages == []
+    assert transport.next_delivery_timeout() == 0.0
+    transport.deliver_queued_packets()
+    assert not transport.has_queued_packets()
+    assert mcast_receiver.messages == [(b"multicast", ("192.0.2.2", mcast_sock.getsockname()[1]))]
+    assert other_group_receiver.messages == []
+    assert [message for (message, _) in ucast_receiver.messages] == [b"unicast"]
+    (message, from_info) = ipv6_receiver.messages[0]
+    assert message == b"ipv6"
+    assert len(from_info) == 4
+    # Closed receivers no longer receive anything
+    mcast_receiver.handler.close()
+    mcast_sock.sendmsg([b"again"])
+    transport.deliver_queued_packets()
+    assert len(mcast_receiver.messages) == 1
+    assert transport.nr_receivers() == 3
+
+def test_packets_sent_during_delivery_wait_for_next_round():
+    transport = memory_transport.MemoryTransport(ManualClockTimerScheduler())
+    sock = transport.create_tx_socket(True, "192.0.2.2", "192.0.2.1", 10001)
+    receiver = Receiver(transport, 10001)
+    def echo(messages, _sock):
+        receiver.messages.extend(messages)
+        sock.sendmsg([b"echo"])
+    receiver.handler._receive_function = echo   # pylint:disable=protected-access
+    sock.sendmsg([b"ping"])
+    transport.deliver_queued_packets()
+    assert len(receiver.messages) == 1
+    transport.deliver_queued_packets()
+    assert len(receiver.messages) == 2
+
+def test_delay_and_loss():
+    clock = ManualClockTimerScheduler()
+    transport = memory_transport.MemoryTransport(clock)
+    transport.configure(loss_percent=50.0, delay=0.5)
+    receiver = Receiver(transport, 10001)
+    sock = transport.create_tx_socket(True, "192.0.2.2", "192.0.2.1", 10001)
+    for _ in range(200):
+        sock.sendmsg([b"x"])
+    assert transport.next_delivery_timeout() == 0.5
+    transport.deliver_queued_packets()
+    assert receiver.messages == []
+    clock.manual_now = 0.5
+    transport.deliver_queued_packets()
+    assert transport.nr_sent == 200
+    assert transport.nr_lost + len(receiver.messages) == 200
+    assert 50 < transport.nr_lost < 150
+    # The same seed gives the same losses
+    transport.configure(loss_percent=50.0, delay=0.5)
+    receiver.messages = []
+    for _ in range(200):
+        sock.sendmsg([b"x"])
+    clock.manual_now = 1.0
+    transport.deliver_queued_packets()
+    assert len(receiver.messages) == 200 - transport.nr_lost // 2
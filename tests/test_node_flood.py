@@ -4,7 +4,9 @@ import common.ttypes
 import constants
 import encoding.ttypes
 import node
+import packet_codec
 import packet_common
+import tide_cache
 import timer
 
 # pylint: disable=line-too-long
@@ -497,6 +499,56 @@ def test_process_tie():
     test_node = make_test_node(db_tie_info_list)
     check_process_tie(test_node)
 
+def lazily_decoded_rx_tie_packet_info(rx_tie_info):
+    rx_tie_packet = make_rx_tie_packet(rx_tie_info)
+    header = encoding.ttypes.PacketHeader(sender=MY_SYSTEM_ID, level=MY_LEVEL)
+    content = encoding.ttypes.PacketContent(tie=rx_tie_packet)
+    protocol_packet = encoding.ttypes.ProtocolPacket(header=header, content=content)
+    packet_info = packet_common.encode_protocol_packet(protocol_packet, None)
+    packet_info.update_env_header(0)
+    packet_info.update_outer_sec_env_header(None, 111, 222, rx_tie_info[5])
+    message = b''.join(packet_info.message_parts())
+    try:
+        packet_codec.set_lazy_tie_decode(True)
+        rx_tie_packet_info = packet_common.decode_message(None, None, message, None, None, None,
+                                                          None)
+    finally:
+        packet_codec.set_lazy_tie_decode(False)
+    assert not rx_tie_packet_info.error
+    return rx_tie_packet_info
+
+def test_process_lazily_decoded_tie():
+    packet_common.add_missing_methods_to_thrift()
+    db_tie_info_list = [
+        # pylint:disable=bad-whitespace
+        # Direction Origin Type     TieNr SeqNr Lifetime
+        ( NORTH,    5,     PREFIX,  8,    12,   100)]
+    test_node = make_test_node(db_tie_info_list)
+    # Same version as in the TIE-DB: ack it without decoding the element
+    rx_tie_packet_info = lazily_decoded_rx_tie_packet_info(
+        ( NORTH,    5,     PREFIX,  8,    12,   100,      TIE_SAME))
+    (_, ack_tie_header) = test_node.process_rx_tie_packet_info(rx_tie_packet_info)
+    assert ack_tie_header is not None
+    assert not rx_tie_packet_info.protocol_packet.content.tie.element_decoded()
+    # Newer version than in the TIE-DB: decode the element, and store and ack it
+    rx_tie_packet_info = lazily_decoded_rx_tie_packet_info(
+        ( NORTH,    5,     PREFIX,  8,    13,   100,      TIE_OLDER))
+    (_, ack_tie_header) = test_node.process_rx_tie_packet_info(rx_tie_packet_info)
+    assert ack_tie_header is not None
+    assert rx_tie_packet_info.protocol_packet.content.tie.element_decoded()
+    db_tie_packet_info = test_node.find_tie_packet_info(ack_tie_header.tieid)
+    assert db_tie_packet_info is rx_tie_packet_info
+    assert db_tie_packet_info.protocol_packet.content.tie.element.prefixes is not None
+    # Missing from the TIE-DB, but the element cannot be decoded: drop it
+    rx_tie_packet_info = lazily_decoded_rx_tie_packet_info(
+        ( NORTH,    5,     PREFIX,  9,    1,    100,      TIE_MISSING))
+    rx_tie_packet = rx_tie_packet_info.protocol_packet.content.tie
+    rx_tie_packet.set_encoded_protocol_packet(rx_tie_packet_info.encoded_protocol_packet[:-5])
+    result = test_node.process_rx_tie_packet_info(rx_tie_packet_info)
+    assert result == (None, None)
+    assert rx_tie_packet_info.error == packet_common.PacketInfo.ERR_TRIFT_DECODE
+    assert test_node.find_tie_packet_info(rx_tie_packet.header.tieid) is None
+
 def test_is_flood_allowed():
     packet_common.add_missing_methods_to_thrift()
     test_node = make_test_node()
@@ -569,7 +621,48 @@ def test_is_flood_allowed():
         assert allowed == expected_allowed, expected_reason
         assert reason == expected_reason
 
-def test_generate_tide_packet():
+def test_flood_scope_index():
+    packet_common.add_missing_methods_to_thrift()
+    test_node = make_test_node([
+        # pylint:disable=bad-whitespace
+        # Direction Origin  Type    TieNr SeqNr Lifetime
+        ( SOUTH,     55,     NODE,   8,    12,   550),
+        ( SOUTH,     55,     PREFIX, 2,    4,    600)])
+    evaluated = []
+    evaluate_flood_scope = test_node.evaluate_flood_scope
+    def counting_evaluate_flood_scope(*args):
+        evaluated.append(args)
+        return evaluate_flood_scope(*args)
+    test_node.evaluate_flood_scope = counting_evaluate_flood_scope
+    node_tie_id = packet_common.make_tie_id(SOUTH, 55, NODE, 8)
+    prefix_tie_id = packet_common.make_tie_id(SOUTH, 55, PREFIX, 2)
+    def flood_allowed(tie_id, neighbor_direction, neighbor_system_id):
+        tie_header = test_node.find_tie_packet_info(tie_id).protocol_packet.content.tie.header
+        (allowed, _reason) = test_node.flood_allowed_from_node_to_nbr(
+            tie_header, neighbor_direction, neighbor_system_id, MY_SYSTEM_ID, MY_LEVEL, False)
+        return allowed
+    # The verdict for a neighbor class is only evaluated once per TIE version
+    assert flood_allowed(node_tie_id, SOUTH, 20)
+    assert flood_allowed(node_tie_id, SOUTH, 21)
+    assert len(evaluated) == 1
+    assert not flood_allowed(node_tie_id, NORTH, 20)
+    assert len(evaluated) == 2
+    # The rule which depends on the neighbor system-id is evaluated for every neighbor
+    assert flood_allowed(prefix_tie_id, NORTH, 55)
+    assert not flood_allowed(prefix_tie_id, NORTH, 56)
+    assert len(evaluated) == 4
+    # Storing a new version of the TIE (here with a different originator level) invalidates it
+    new_node_tie_packet = packet_common.make_node_tie_packet(
+        name=MY_NAME, level=MY_LEVEL + 1, direction=SOUTH, originator=55, tie_nr=8, seq_nr=13)
+    test_node.store_tie_packet(new_node_tie_packet, 600)
+    assert not flood_allowed(node_tie_id, SOUTH, 20)
+    assert flood_allowed(node_tie_id, NORTH, 20)
+    assert len(evaluated) == 6
+    # So does a change of the level of the node
+    test_node.action_store_level(MY_LEVEL)
+    assert test_node.find_tie_packet_info(node_tie_id).flood_scope_verdicts is None
+
+def test_generate_tide_packets():
     packet_common.add_missing_methods_to_thrift()
     db_tie_info_list = [
         # pylint:disable=bad-whitespace
@@ -577,19 +670,252 @@ def test_generate_tide_packet():
         ( SOUTH,     55,           PREFIX,  2,    4,    600),     # No : Non-node S-TIE to S, not self-originated
         ( SOUTH,     MY_SYSTEM_ID, PREFIX,  18,   903,  400)]     # Yes: Non-node S-TIE to S, self-originated
     test_node = make_test_node(db_tie_info_list)
-    tide_packet = test_node.generate_tide_packet(
+    tide_packets = test_node.generate_tide_packets(
+        max_headers=10,
         neighbor_direction=SOUTH,
         neighbor_system_id=55,
         neighbor_level=8,
         neighbor_is_top_of_fabric=False,
         my_level=MY_LEVEL,
         i_am_top_of_fabric=True)
+    assert len(tide_packets) == 1
+    tide_packet = tide_packets[0]
     assert tide_packet.start_range == node.Node.MIN_TIE_ID
     assert tide_packet.end_range == node.Node.MAX_TIE_ID
     assert len(tide_packet.headers) == 1
     expected_header = packet_common.make_tie_header_with_lifetime(SOUTH, MY_SYSTEM_ID, PREFIX, 18, 903, 400)
     assert tide_packet.headers[0] == expected_header
 
+def test_generate_tide_packets_ranges():
+    packet_common.add_missing_methods_to_thrift()
+    db_tie_info_list = [(SOUTH, MY_SYSTEM_ID, PREFIX, tie_nr, 1, 600) for tie_nr in range(1, 6)]
+    test_node = make_test_node(db_tie_info_list)
+    tide_packets = test_node.generate_tide_packets(
+        max_headers=2,
+        neighbor_direction=SOUTH,
+        neighbor_system_id=55,
+        neighbor_level=8,
+        neighbor_is_top_of_fabric=False,
+        my_level=MY_LEVEL,
+        i_am_top_of_fabric=True)
+    assert len(tide_packets) == 3
+    assert tide_packets[0].start_range == node.Node.MIN_TIE_ID
+    assert tide_packets[0].end_range == packet_common.make_tie_id(SOUTH, MY_SYSTEM_ID, PREFIX, 2)
+    assert tide_packets[1].start_range == packet_common.make_tie_id(SOUTH, MY_SYSTEM_ID, PREFIX, 3)
+    assert tide_packets[1].end_range == packet_common.make_tie_id(SOUTH, MY_SYSTEM_ID, PREFIX, 4)
+    assert tide_packets[2].start_range == packet_common.make_tie_id(SOUTH, MY_SYSTEM_ID, PREFIX, 5)
+    assert tide_packets[2].end_range == node.Node.MAX_TIE_ID
+    assert [len(tide_packet.headers) for tide_packet in tide_packets] == [2, 2, 1]
+
+def test_max_tide_headers():
+    packet_common.add_missing_methods_to_thrift()
+    mtu = 1400
+    max_headers = packet_common.max_tide_headers(mtu)
+    assert max_headers > 1
+    db_tie_info_list = [(NORTH, 1000 + tie_nr, PREFIX, tie_nr, 1, 600)
+                        for tie_nr in range(3 * max_headers)]
+    test_node = make_test_node(db_tie_info_list)
+    tide_packets = test_node.generate_tide_packets(
+        max_headers=max_headers,
+        neighbor_direction=NORTH,
+        neighbor_system_id=55,
+        neighbor_level=10,
+        neighbor_is_top_of_fabric=False,
+        my_level=MY_LEVEL,
+        i_am_top_of_fabric=False)
+    assert len(tide_packets) == 3
+    for tide_packet in tide_packets:
+        protocol_packet = encoding.ttypes.ProtocolPacket(
+            header=encoding.ttypes.PacketHeader(sender=MY_SYSTEM_ID, level=MY_LEVEL),
+            content=encoding.ttypes.PacketContent(tide=tide_packet))
+        encoded_size = len(packet_codec.encode_protocol_packet_bytes(protocol_packet))
+        assert encoded_size + packet_common.TIDE_PACKET_OVERHEAD <= mtu
+
+def cached_tide_packets(test_node, cache, max_headers=100, neighbor_system_id=55):
+    packet_infos = test_node.cached_tide_packet_infos(
+        cache=cache,
+        max_headers=max_headers,
+        neighbor_direction=SOUTH,
+        neighbor_system_id=neighbor_system_id,
+        neighbor_level=8,
+        neighbor_is_top_of_fabric=False,
+        my_level=MY_LEVEL,
+        i_am_top_of_fabric=True)
+    tide_packets = [packet_info.protocol_packet.content.tide for packet_info in packet_infos]
+    if len(cache.ranges) <= node.Node.MAX_TIDES_PER_INTERVAL:
+        expected_tide_packets = test_node.generate_tide_packets(
+            max_headers=max_headers,
+            neighbor_direction=SOUTH,
+            neighbor_system_id=neighbor_system_id,
+            neighbor_level=8,
+            neighbor_is_top_of_fabric=False,
+            my_level=MY_LEVEL,
+            i_am_top_of_fabric=True)
+        # The cached TIDEs are the same as TIDEs generated from scratch
+        assert tide_packets == expected_tide_packets
+    return packet_infos
+
+def cached_single_tide_packet(test_node, cache, **kwargs):
+    packet_infos = cached_tide_packets(test_node, cache, **kwargs)
+    assert len(packet_infos) == 1
+    return packet_infos[0]
+
+def test_cached_tide_packets():
+    packet_common.add_missing_methods_to_thrift()
+    db_tie_info_list = [
+        # pylint:disable=bad-whitespace
+        # Direction Origin         Type     TieNr SeqNr Lifetime  Allowed in TIDE
+        ( SOUTH,     55,           PREFIX,  2,    4,    600),     # No : Non-node S-TIE to S, not self-originated
+        ( SOUTH,     MY_SYSTEM_ID, PREFIX,  18,   903,  400)]     # Yes: Non-node S-TIE to S, self-originated
+    test_node = make_test_node(db_tie_info_list)
+    cache = tide_cache.TideCache()
+    # First TIDE is generated from scratch
+    packet_info_1 = cached_single_tide_packet(test_node, cache)
+    assert len(packet_info_1.protocol_packet.content.tide.headers) == 1
+    assert cache.full_count == 1
+    # Nothing changed, the same encoded TIDE is re-sent
+    packet_info_2 = cached_single_tide_packet(test_node, cache)
+    assert packet_info_2 is packet_info_1
+    assert cache.hit_count == 1
+    # Adding a TIE only re-evaluates that TIE
+    test_node.store_tie_packet(packet_common.make_prefix_tie_packet(SOUTH, MY_SYSTEM_ID, 19, 5), 500)
+    packet_info_3 = cached_single_tide_packet(test_node, cache)
+    assert len(packet_info_3.protocol_packet.content.tide.headers) == 2
+    assert cache.incremental_count == 1
+    # Removing a TIE
+    test_node.remove_tie(packet_common.make_tie_id(SOUTH, MY_SYSTEM_ID, PREFIX, 18))
+    packet_info_4 = cached_single_tide_packet(test_node, cache)
+    assert len(packet_info_4.protocol_packet.content.tide.headers) == 1
+    assert cache.incremental_count == 2
+    # Ageing does not change the TIE-DB generation, but lifetimes are refreshed eventually
+    test_node.age_ties()
+    cache.ranges[0].encode_time -= node.Node.TIDE_CACHE_MAX_AGE
+    packet_info_5 = cached_single_tide_packet(test_node, cache)
+    assert packet_info_5 is not packet_info_4
+    assert cache.refresh_count == 1
+    assert packet_info_5.protocol_packet.content.tide.headers[0].remaining_lifetime == 499
+    # A different neighbor requires a full regeneration
+    cached_tide_packets(test_node, cache, neighbor_system_id=66)
+    assert cache.full_count == 2
+    assert cache.sent_count == 6
+    assert cache.hit_rate_str() == "16.7%"
+    # A different MTU only requires splitting the ranges again
+    test_node.store_tie_packet(packet_common.make_prefix_tie_packet(SOUTH, MY_SYSTEM_ID, 20, 5), 500)
+    assert len(cached_tide_packets(test_node, cache, neighbor_system_id=66)) == 1
+    assert len(cached_tide_packets(test_node, cache, max_headers=1, neighbor_system_id=66)) == 2
+    assert cache.full_count == 2
+
+def test_cached_tide_packets_rotation():
+    packet_common.add_missing_methods_to_thrift()
+    nr_ranges = node.Node.MAX_TIDES_PER_INTERVAL + 4
+    db_tie_info_list = [(SOUTH, MY_SYSTEM_ID, PREFIX, tie_nr, 1, 600)
+                        for tie_nr in range(2 * nr_ranges)]
+    test_node = make_test_node(db_tie_info_list)
+    cache = tide_cache.TideCache()
+    all_tide_packets = test_node.generate_tide_packets(
+        max_headers=2,
+        neighbor_direction=SOUTH,
+        neighbor_system_id=55,
+        neighbor_level=8,
+        neighbor_is_top_of_fabric=False,
+        my_level=MY_LEVEL,
+        i_am_top_of_fabric=True)
+    assert len(all_tide_packets) == nr_ranges
+    # Each interval sends the next MAX_TIDES_PER_INTERVAL ranges, wrapping around at the end
+    sent_tide_packets = []
+    for _ in range(2):
+        packet_infos = cached_tide_packets(test_node, cache, max_headers=2)
+        assert len(packet_infos) == node.Node.MAX_TIDES_PER_INTERVAL
+        sent_tide_packets += [packet_info.protocol_packet.content.tide
+                              for packet_info in packet_infos]
+    assert sent_tide_packets == (all_tide_packets + all_tide_packets)[:len(sent_tide_packets)]
+
+def test_cached_tide_packets_affected_range():
+    packet_common.add_missing_methods_to_thrift()
+    db_tie_info_list = [(SOUTH, MY_SYSTEM_ID, PREFIX, tie_nr, 1, 600) for tie_nr in range(10)]
+    test_node = make_test_node(db_tie_info_list)
+    cache = tide_cache.TideCache()
+    packet_infos_1 = cached_tide_packets(test_node, cache, max_headers=2)
+    assert len(packet_infos_1) == 5
+    assert cache.encode_count == 5
+    # Changing a TIE only re-encodes the TIDE for the range that covers it
+    test_node.store_tie_packet(packet_common.make_prefix_tie_packet(SOUTH, MY_SYSTEM_ID, 5, 2), 600)
+    packet_infos_2 = cached_tide_packets(test_node, cache, max_headers=2)
+    assert cache.encode_count == 6
+    assert [packet_info_2 is packet_info_1
+            for (packet_info_1, packet_info_2) in zip(packet_infos_1, packet_infos_2)] == \
+        [True, True, False, True, True]
+    # Adding a TIE to a full range only splits that range
+    test_node.store_tie_packet(packet_common.make_prefix_tie_packet(SOUTH, MY_SYSTEM_ID, 20, 1), 600)
+    packet_infos_3 = cached_tide_packets(test_node, cache, max_headers=2)
+    assert cache.encode_count == 8
+    assert packet_infos_3[:4] == packet_infos_2[:4]
+    assert len(packet_infos_3) == 6
+    assert cache.full_count == 1
+
+def test_cached_tide_packets_rotation_after_change():
+    packet_common.add_missing_methods_to_thrift()
+    nr_ranges = node.Node.MAX_TIDES_PER_INTERVAL + 4
+    db_tie_info_list = [(SOUTH, MY_SYSTEM_ID, PREFIX, tie_nr, 1, 600)
+                        for tie_nr in range(0, 4 * nr_ranges, 2)]
+    test_node = make_test_node(db_tie_info_list)
+    cache = tide_cache.TideCache()
+    cached_tide_packets(test_node, cache, max_headers=2)
+    next_start_range = cache.ranges[cache.next_range_index].start_range
+    # Splitting a range that was already sent does not skip any range in the rotation
+    test_node.store_tie_packet(packet_common.make_prefix_tie_packet(SOUTH, MY_SYSTEM_ID, 1, 1), 600)
+    packet_infos = cached_tide_packets(test_node, cache, max_headers=2)
+    assert packet_infos[0].protocol_packet.content.tide.start_range == next_start_range
+
+def test_tide_cache_journal_overflow():
+    packet_common.add_missing_methods_to_thrift()
+    test_node = make_test_node()
+    cache = tide_cache.TideCache()
+    cached_tide_packets(test_node, cache)
+    for tie_nr in range(node.Node.TIE_DB_CHANGES_HISTORY_LENGTH + 1):
+        test_node.store_tie_packet(
+            packet_common.make_prefix_tie_packet(SOUTH, MY_SYSTEM_ID, tie_nr, 1), 500)
+    # Too many changes to update the cached TIDEs incrementally
+    packet_infos = cached_tide_packets(test_node, cache)
+    assert cache.full_count == 2
+    assert sum(len(packet_info.protocol_packet.content.tide.headers)
+               for packet_info in packet_infos) == node.Node.TIE_DB_CHANGES_HISTORY_LENGTH + 1
+
+def test_process_tide_ranges():
+    packet_common.add_missing_methods_to_thrift()
+    # The neighbor reports these TIEs in three TIDEs
+    tide_tie_nrs = [1, 2, 4, 5, 6]
+    tide_packets = []
+    for (start_tie_nr, end_tie_nr, tie_nrs) in [(None, 2, [1, 2]), (4, 5, [4, 5]), (6, None, [6])]:
+        if start_tie_nr is None:
+            start_range = node.Node.MIN_TIE_ID
+        else:
+            start_range = packet_common.make_tie_id(SOUTH, 55, PREFIX, start_tie_nr)
+        if end_tie_nr is None:
+            end_range = node.Node.MAX_TIE_ID
+        else:
+            end_range = packet_common.make_tie_id(SOUTH, 55, PREFIX, end_tie_nr)
+        tide_packet = packet_common.make_tide_packet(start_range, end_range)
+        for tie_nr in tie_nrs:
+            packet_common.add_tie_header_to_tide(
+                tide_packet,
+                packet_common.make_tie_header_with_lifetime(SOUTH, 55, PREFIX, tie_nr, 1, 600))
+        tide_packets.append(tide_packet)
+    # We have the same TIEs, plus TIE 3 which is in the gap between the first and second TIDE
+    db_tie_info_list = [(SOUTH, 55, PREFIX, tie_nr, 1, 600) for tie_nr in tide_tie_nrs + [3]]
+    test_node = make_test_node(db_tie_info_list)
+    for _ in range(2):
+        start_sending = []
+        for tide_packet in tide_packets:
+            (request, start, stop) = test_node.process_rx_tide_packet(tide_packet, "if1")
+            assert not request
+            start_sending += start
+            # A TIDE received from another neighbor does not affect the gap processing
+            test_node.process_rx_tide_packet(tide_packets[1], "if2")
+            assert len(stop) == len(tide_packet.headers)
+        # Only the TIE in the gap is sent, and TIEs at the end of a range are not sent
+        assert start_sending == [packet_common.make_tie_header(SOUTH, 55, PREFIX, 3, 1)]
+
 def test_age_ties():
     packet_common.add_missing_methods_to_thrift()
     db_tie_info_list = [
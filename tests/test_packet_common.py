@@ -1,4 +1,15 @@
+import copy
+import gc
+import weakref
+
+import pytest
+import thrift.protocol.TBinaryProtocol
+import thrift.transport.TTransport
+
 import common.ttypes
+import constants
+import key
+import packet_codec
 import packet_common
 
 import encoding.ttypes
@@ -21,35 +32,35 @@ def test_tietype_str():
     assert packet_common.tietype_str(888) == "888"
 
 def max_system_id(fudge=0):
-    return packet_common.MAX_U64 - fudge
+    return packet_codec.MAX_U64 - fudge
 
 def max_tieid():
     return encoding.ttypes.TIEID(
         direction=common.ttypes.TieDirectionType.North,
-        originator=packet_common.MAX_U64,
+        originator=packet_codec.MAX_U64,
         tietype=common.ttypes.TIETypeType.ExternalPrefixTIEType,
-        tie_nr=packet_common.MAX_U32
+        tie_nr=packet_codec.MAX_U32
     )
 
 def max_tie_header(fudge=0):
     return encoding.ttypes.TIEHeader(
         tieid=max_tieid(),
-        seq_nr=packet_common.MAX_U32 - fudge,
+        seq_nr=packet_codec.MAX_U32 - fudge,
         origination_time=common.ttypes.IEEE802_1ASTimeStampType(
-            AS_sec=packet_common.MAX_U64,
-            AS_nsec=packet_common.MAX_U32
+            AS_sec=packet_codec.MAX_U64,
+            AS_nsec=packet_codec.MAX_U32
         ),
-        origination_lifetime=packet_common.MAX_U32
+        origination_lifetime=packet_codec.MAX_U32
     )
 
 def max_tie_header_lifetime(fudge=0):
     return encoding.ttypes.TIEHeaderWithLifeTime(
         header=max_tie_header(fudge),
-        remaining_lifetime=packet_common.MAX_U32 - 1,    # Actual max is not allowed
+        remaining_lifetime=packet_codec.MAX_U32 - 1,    # Actual max is not allowed
     )
 
 def max_link_id(fudge=0):
-    return packet_common.MAX_U32 - fudge
+    return packet_codec.MAX_U32 - fudge
 
 def max_link_id_pair(fudge=0):
     return encoding.ttypes.LinkIDPair(
@@ -59,21 +70,21 @@ def max_link_id_pair(fudge=0):
 
 def max_neighbor():
     return encoding.ttypes.NodeNeighborsTIEElement(
-        level=packet_common.MAX_U16,
-        cost=packet_common.MAX_U32,
+        level=packet_codec.MAX_U16,
+        cost=packet_codec.MAX_U32,
         link_ids=set([
             max_link_id_pair(0),
             max_link_id_pair(1),
             max_link_id_pair(2),
         ]),
-        bandwidth=packet_common.MAX_U32
+        bandwidth=packet_codec.MAX_U32
     )
 
 def max_ipv4_prefix(fudge=0):
     return common.ttypes.IPPrefixType(
         ipv4prefix=common.ttypes.IPv4PrefixType(
-            address=packet_common.MAX_U32 - fudge,
-            prefixlen=packet_common.MAX_U8
+            address=packet_codec.MAX_U32 - fudge,
+            prefixlen=packet_codec.MAX_U8
         ),
         ipv6prefix=None
     )
@@ -83,24 +94,24 @@ def max_ipv6_prefix():
         ipv4prefix=None,
         ipv6prefix=common.ttypes.IPv6PrefixType(
             address=b'ffffffffffffffffffffffffffffffff',
-            prefixlen=packet_common.MAX_U8
+            prefixlen=packet_codec.MAX_U8
         )
     )
 
 def max_prefix_attributes():
     return encoding.ttypes.PrefixAttributes(
-        metric=packet_common.MAX_U32,
+        metric=packet_codec.MAX_U32,
         tags=set([
-            packet_common.MAX_U32,
-            packet_common.MAX_U32 - 1,
-            packet_common.MAX_U32 - 2
+            packet_codec.MAX_U32,
+            packet_codec.MAX_U32 - 1,
+            packet_codec.MAX_U32 - 2
         ]),
         monotonic_clock=common.ttypes.PrefixSequenceType(
             timestamp=common.ttypes.IEEE802_1ASTimeStampType(
-                AS_sec=packet_common.MAX_U64,
-                AS_nsec=packet_common.MAX_U32
+                AS_sec=packet_codec.MAX_U64,
+                AS_nsec=packet_codec.MAX_U32
             ),
-            transactionid=packet_common.MAX_U8
+            transactionid=packet_codec.MAX_U8
         )
     )
 
@@ -113,29 +124,28 @@ def max_prefix_tie_element():
         }
     )
 
-def test_fix_lie_packet():
-    packet_common.add_missing_methods_to_thrift()
-    lie_protocol_packet = encoding.ttypes.ProtocolPacket(
+def make_lie_packet():
+    return encoding.ttypes.ProtocolPacket(
         header=encoding.ttypes.PacketHeader(
-            major_version=packet_common.MAX_U16,
-            minor_version=packet_common.MAX_U16,
-            sender=packet_common.MAX_U64,
-            level=packet_common.MAX_U16
+            major_version=packet_codec.MAX_U16,
+            minor_version=packet_codec.MAX_U16,
+            sender=packet_codec.MAX_U64,
+            level=packet_codec.MAX_U16
         ),
         content=encoding.ttypes.PacketContent(
             lie=encoding.ttypes.LIEPacket(
                 name="name",
-                local_id=packet_common.MAX_U32,
-                flood_port=packet_common.MAX_U16,
-                link_mtu_size=packet_common.MAX_U32,
-                link_bandwidth=packet_common.MAX_U32,
+                local_id=packet_codec.MAX_U32,
+                flood_port=packet_codec.MAX_U16,
+                link_mtu_size=packet_codec.MAX_U32,
+                link_bandwidth=packet_codec.MAX_U32,
                 neighbor=encoding.ttypes.Neighbor(
-                    originator=packet_common.MAX_U64,
-                    remote_id=packet_common.MAX_U32
+                    originator=packet_codec.MAX_U64,
+                    remote_id=packet_codec.MAX_U32
                 ),
-                pod=packet_common.MAX_U32,
-                # nonce=packet_common.MAX_U16,
-                # last_neighbor_nonce=packet_common.MAX_U16,
+                pod=packet_codec.MAX_U32,
+                # nonce=packet_codec.MAX_U16,
+                # last_neighbor_nonce=packet_codec.MAX_U16,
                 node_capabilities=encoding.ttypes.NodeCapabilities(
                     flood_reduction=True,
                     hierarchy_indications=common.ttypes.HierarchyIndications.leaf_only
@@ -143,16 +153,20 @@ def test_fix_lie_packet():
                 link_capabilities=encoding.ttypes.LinkCapabilities(
                     bfd=False,
                 ),
-                holdtime=packet_common.MAX_U16,
+                holdtime=packet_codec.MAX_U16,
                 not_a_ztp_offer=True,
                 you_are_flood_repeater=True,
-                label=packet_common.MAX_U32
+                label=packet_codec.MAX_U32
             ),
             tide=None,
             tire=None,
             tie=None
         )
     )
+
+def test_fix_lie_packet():
+    packet_common.add_missing_methods_to_thrift()
+    lie_protocol_packet = make_lie_packet()
     packet_info = packet_common.encode_protocol_packet(lie_protocol_packet, None)
     packet_info.update_env_header(0)
     packet_info.update_outer_sec_env_header(None, 111, 222)
@@ -161,14 +175,13 @@ def test_fix_lie_packet():
     assert not decoded_packet_info.error
     assert packet_info.protocol_packet == decoded_packet_info.protocol_packet
 
-def test_fix_tide_packet():
-    packet_common.add_missing_methods_to_thrift()
-    tide_protocol_packet = encoding.ttypes.ProtocolPacket(
+def make_tide_packet():
+    return encoding.ttypes.ProtocolPacket(
         header=encoding.ttypes.PacketHeader(
-            major_version=packet_common.MAX_U16,
-            minor_version=packet_common.MAX_U16,
-            sender=packet_common.MAX_U64,
-            level=packet_common.MAX_U16
+            major_version=packet_codec.MAX_U16,
+            minor_version=packet_codec.MAX_U16,
+            sender=packet_codec.MAX_U64,
+            level=packet_codec.MAX_U16
         ),
         content=encoding.ttypes.PacketContent(
             lie=None,
@@ -185,6 +198,10 @@ def test_fix_tide_packet():
             tie=None
         )
     )
+
+def test_fix_tide_packet():
+    packet_common.add_missing_methods_to_thrift()
+    tide_protocol_packet = make_tide_packet()
     packet_info = packet_common.encode_protocol_packet(tide_protocol_packet, None)
     packet_info.update_env_header(0)
     packet_info.update_outer_sec_env_header(None, 111, 222)
@@ -193,14 +210,13 @@ def test_fix_tide_packet():
     assert not decoded_packet_info.error
     assert packet_info.protocol_packet == decoded_packet_info.protocol_packet
 
-def test_fix_tire_packet():
-    packet_common.add_missing_methods_to_thrift()
-    tire_protocol_packet = encoding.ttypes.ProtocolPacket(
+def make_tire_packet():
+    return encoding.ttypes.ProtocolPacket(
         header=encoding.ttypes.PacketHeader(
-            major_version=packet_common.MAX_U16,
-            minor_version=packet_common.MAX_U16,
-            sender=packet_common.MAX_U64,
-            level=packet_common.MAX_U16
+            major_version=packet_codec.MAX_U16,
+            minor_version=packet_codec.MAX_U16,
+            sender=packet_codec.MAX_U64,
+            level=packet_codec.MAX_U16
         ),
         content=encoding.ttypes.PacketContent(
             lie=None,
@@ -215,6 +231,10 @@ def test_fix_tire_packet():
             tie=None
         )
     )
+
+def test_fix_tire_packet():
+    packet_common.add_missing_methods_to_thrift()
+    tire_protocol_packet = make_tire_packet()
     packet_info = packet_common.encode_protocol_packet(tire_protocol_packet, None)
     packet_info.update_env_header(0)
     packet_info.update_outer_sec_env_header(None, 111, 222)
@@ -223,14 +243,13 @@ def test_fix_tire_packet():
     assert not decoded_packet_info.error
     assert packet_info.protocol_packet == decoded_packet_info.protocol_packet
 
-def test_fix_node_tie_packet():
-    packet_common.add_missing_methods_to_thrift()
-    tie_protocol_packet = encoding.ttypes.ProtocolPacket(
+def make_node_tie_packet():
+    return encoding.ttypes.ProtocolPacket(
         header=encoding.ttypes.PacketHeader(
-            major_version=packet_common.MAX_U16,
-            minor_version=packet_common.MAX_U16,
-            sender=packet_common.MAX_U64,
-            level=packet_common.MAX_U16
+            major_version=packet_codec.MAX_U16,
+            minor_version=packet_codec.MAX_U16,
+            sender=packet_codec.MAX_U64,
+            level=packet_codec.MAX_U16
         ),
         content=encoding.ttypes.PacketContent(
             lie=None,
@@ -240,7 +259,7 @@ def test_fix_node_tie_packet():
                 header=max_tie_header(),
                 element=encoding.ttypes.TIEElement(
                     node=encoding.ttypes.NodeTIEElement(
-                        level=packet_common.MAX_U16,
+                        level=packet_codec.MAX_U16,
                         neighbors={
                             max_system_id(0): max_neighbor(),
                             max_system_id(1): max_neighbor(),
@@ -264,6 +283,10 @@ def test_fix_node_tie_packet():
             )
         )
     )
+
+def test_fix_node_tie_packet():
+    packet_common.add_missing_methods_to_thrift()
+    tie_protocol_packet = make_node_tie_packet()
     packet_info = packet_common.encode_protocol_packet(tie_protocol_packet, None)
     packet_info.update_env_header(0)
     packet_info.update_outer_sec_env_header(None, 111, 222, 10)
@@ -272,14 +295,13 @@ def test_fix_node_tie_packet():
     assert not decoded_packet_info.error
     assert packet_info.protocol_packet == decoded_packet_info.protocol_packet
 
-def test_fix_prefixes_tie_packet():
-    packet_common.add_missing_methods_to_thrift()
-    tie_protocol_packet = encoding.ttypes.ProtocolPacket(
+def make_prefixes_tie_packet():
+    return encoding.ttypes.ProtocolPacket(
         header=encoding.ttypes.PacketHeader(
-            major_version=packet_common.MAX_U16,
-            minor_version=packet_common.MAX_U16,
-            sender=packet_common.MAX_U64,
-            level=packet_common.MAX_U16
+            major_version=packet_codec.MAX_U16,
+            minor_version=packet_codec.MAX_U16,
+            sender=packet_codec.MAX_U64,
+            level=packet_codec.MAX_U16
         ),
         content=encoding.ttypes.PacketContent(
             lie=None,
@@ -298,6 +320,10 @@ def test_fix_prefixes_tie_packet():
             )
         )
     )
+
+def test_fix_prefixes_tie_packet():
+    packet_common.add_missing_methods_to_thrift()
+    tie_protocol_packet = make_prefixes_tie_packet()
     packet_info = packet_common.encode_protocol_packet(tie_protocol_packet, None)
     packet_info.update_env_header(0)
     packet_info.update_outer_sec_env_header(None, 111, 222, 10)
@@ -306,14 +332,13 @@ def test_fix_prefixes_tie_packet():
     assert not decoded_packet_info.error
     assert packet_info.protocol_packet == decoded_packet_info.protocol_packet
 
-def test_fix_positive_disaggregation_prefixes_tie_packet():
-    packet_common.add_missing_methods_to_thrift()
-    tie_protocol_packet = encoding.ttypes.ProtocolPacket(
+def make_positive_disaggregation_prefixes_tie_packet():
+    return encoding.ttypes.ProtocolPacket(
         header=encoding.ttypes.PacketHeader(
-            major_version=packet_common.MAX_U16,
-            minor_version=packet_common.MAX_U16,
-            sender=packet_common.MAX_U64,
-            level=packet_common.MAX_U16
+            major_version=packet_codec.MAX_U16,
+            minor_version=packet_codec.MAX_U16,
+            sender=packet_codec.MAX_U64,
+            level=packet_codec.MAX_U16
         ),
         content=encoding.ttypes.PacketContent(
             lie=None,
@@ -332,6 +357,10 @@ def test_fix_positive_disaggregation_prefixes_tie_packet():
             )
         )
     )
+
+def test_fix_positive_disaggregation_prefixes_tie_packet():
+    packet_common.add_missing_methods_to_thrift()
+    tie_protocol_packet = make_positive_disaggregation_prefixes_tie_packet()
     packet_info = packet_common.encode_protocol_packet(tie_protocol_packet, None)
     packet_info.update_env_header(0)
     packet_info.update_outer_sec_env_header(None, 111, 222, 10)
@@ -340,14 +369,13 @@ def test_fix_positive_disaggregation_prefixes_tie_packet():
     assert not decoded_packet_info.error
     assert packet_info.protocol_packet == decoded_packet_info.protocol_packet
 
-def test_fix_negative_disaggregation_prefixes_tie_packet():
-    packet_common.add_missing_methods_to_thrift()
-    tie_protocol_packet = encoding.ttypes.ProtocolPacket(
+def make_negative_disaggregation_prefixes_tie_packet():
+    return encoding.ttypes.ProtocolPacket(
         header=encoding.ttypes.PacketHeader(
-            major_version=packet_common.MAX_U16,
-            minor_version=packet_common.MAX_U16,
-            sender=packet_common.MAX_U64,
-            level=packet_common.MAX_U16
+            major_version=packet_codec.MAX_U16,
+            minor_version=packet_codec.MAX_U16,
+            sender=packet_codec.MAX_U64,
+            level=packet_codec.MAX_U16
         ),
         content=encoding.ttypes.PacketContent(
             lie=None,
@@ -366,6 +394,10 @@ def test_fix_negative_disaggregation_prefixes_tie_packet():
             )
         )
     )
+
+def test_fix_negative_disaggregation_prefixes_tie_packet():
+    packet_common.add_missing_methods_to_thrift()
+    tie_protocol_packet = make_negative_disaggregation_prefixes_tie_packet()
     packet_info = packet_common.encode_protocol_packet(tie_protocol_packet, None)
     packet_info.update_env_header(0)
     packet_info.update_outer_sec_env_header(None, 111, 222, 10)
@@ -374,14 +406,13 @@ def test_fix_negative_disaggregation_prefixes_tie_packet():
     assert not decoded_packet_info.error
     assert packet_info.protocol_packet == decoded_packet_info.protocol_packet
 
-def test_fix_external_prefixes_tie_packet():
-    packet_common.add_missing_methods_to_thrift()
-    tie_protocol_packet = encoding.ttypes.ProtocolPacket(
+def make_external_prefixes_tie_packet():
+    return encoding.ttypes.ProtocolPacket(
         header=encoding.ttypes.PacketHeader(
-            major_version=packet_common.MAX_U16,
-            minor_version=packet_common.MAX_U16,
-            sender=packet_common.MAX_U64,
-            level=packet_common.MAX_U16
+            major_version=packet_codec.MAX_U16,
+            minor_version=packet_codec.MAX_U16,
+            sender=packet_codec.MAX_U64,
+            level=packet_codec.MAX_U16
         ),
         content=encoding.ttypes.PacketContent(
             lie=None,
@@ -400,6 +431,10 @@ def test_fix_external_prefixes_tie_packet():
             )
         )
     )
+
+def test_fix_external_prefixes_tie_packet():
+    packet_common.add_missing_methods_to_thrift()
+    tie_protocol_packet = make_external_prefixes_tie_packet()
     packet_info = packet_common.encode_protocol_packet(tie_protocol_packet, None)
     packet_info.update_env_header(0)
     packet_info.update_outer_sec_env_header(None, 111, 222, 10)
@@ -408,14 +443,13 @@ def test_fix_external_prefixes_tie_packet():
     assert not decoded_packet_info.error
     assert packet_info.protocol_packet == decoded_packet_info.protocol_packet
 
-def test_fix_key_value_tie_packet():
-    packet_common.add_missing_methods_to_thrift()
-    tie_protocol_packet = encoding.ttypes.ProtocolPacket(
+def make_key_value_tie_packet():
+    return encoding.ttypes.ProtocolPacket(
         header=encoding.ttypes.PacketHeader(
-            major_version=packet_common.MAX_U16,
-            minor_version=packet_common.MAX_U16,
-            sender=packet_common.MAX_U64,
-            level=packet_common.MAX_U16
+            major_version=packet_codec.MAX_U16,
+            minor_version=packet_codec.MAX_U16,
+            sender=packet_codec.MAX_U64,
+            level=packet_codec.MAX_U16
         ),
         content=encoding.ttypes.PacketContent(
             lie=None,
@@ -439,6 +473,10 @@ def test_fix_key_value_tie_packet():
             )
         )
     )
+
+def test_fix_key_value_tie_packet():
+    packet_common.add_missing_methods_to_thrift()
+    tie_protocol_packet = make_key_value_tie_packet()
     packet_info = packet_common.encode_protocol_packet(tie_protocol_packet, None)
     packet_info.update_env_header(0)
     packet_info.update_outer_sec_env_header(None, 111, 222, 10)
@@ -446,3 +484,358 @@ def test_fix_key_value_tie_packet():
     decoded_packet_info = packet_common.decode_message(None, None, message, None, None, None, None)
     assert not decoded_packet_info.error
     assert packet_info.protocol_packet == decoded_packet_info.protocol_packet
+
+def encode_with_copy_and_fix(protocol_packet):
+    # The encoder that was used before the copy-free encoder: deep copy, fix, and write
+    fixed_protocol_packet = copy.deepcopy(protocol_packet)
+    packet_codec.fix_prot_packet_before_encode(fixed_protocol_packet)
+    transport_out = thrift.transport.TTransport.TMemoryBuffer()
+    protocol_out = thrift.protocol.TBinaryProtocol.TBinaryProtocol(transport_out)
+    fixed_protocol_packet.write(protocol_out)
+    return transport_out.getvalue()
+
+def encode_copy_free(protocol_packet):
+    transport_out = thrift.transport.TTransport.TMemoryBuffer()
+    protocol_out = thrift.protocol.TBinaryProtocol.TBinaryProtocol(transport_out)
+    packet_codec.write_protocol_packet(protocol_packet, protocol_out)
+    return transport_out.getvalue()
+
+def small_values_packet():
+    # Values that don't need fixing, and optional fields that are not set
+    return encoding.ttypes.ProtocolPacket(
+        header=encoding.ttypes.PacketHeader(sender=1, level=0),
+        content=encoding.ttypes.PacketContent(
+            lie=encoding.ttypes.LIEPacket(
+                local_id=1,
+                flood_port=912,
+                neighbor=encoding.ttypes.Neighbor(originator=2, remote_id=3)
+            )
+        )
+    )
+
+def decode_encoded_protocol_packet(encoded_protocol_packet):
+    transport_in = thrift.transport.TTransport.TMemoryBuffer(encoded_protocol_packet)
+    protocol_in = thrift.protocol.TBinaryProtocol.TBinaryProtocol(transport_in)
+    protocol_packet = encoding.ttypes.ProtocolPacket()
+    protocol_packet.read(protocol_in)
+    packet_codec.fix_prot_packet_after_decode(protocol_packet)
+    return protocol_packet
+
+# The second parameter is False for packets which contain sets of structs with more than one
+# element. The old encoder rebuilds each set from the fixed elements, so it writes the elements in
+# the iteration order of the fixed (signed) values, whereas the copy-free encoder writes them in the
+# iteration order of the original (unsigned) values. The order of set elements is not significant
+# in Thrift, so for those packets the encodings are compared after decoding.
+@pytest.mark.parametrize("make_packet, same_bytes", [
+    (make_lie_packet, True),
+    (make_tide_packet, True),
+    (make_tire_packet, True),
+    (make_node_tie_packet, False),
+    (make_prefixes_tie_packet, True),
+    (make_positive_disaggregation_prefixes_tie_packet, True),
+    (make_negative_disaggregation_prefixes_tie_packet, True),
+    (make_external_prefixes_tie_packet, True),
+    (make_key_value_tie_packet, True),
+    (small_values_packet, True)
+])
+def test_copy_free_encoder(make_packet, same_bytes):
+    packet_common.add_missing_methods_to_thrift()
+    protocol_packet = make_packet()
+    untouched_protocol_packet = make_packet()
+    new_encoding = encode_copy_free(protocol_packet)
+    old_encoding = encode_with_copy_and_fix(protocol_packet)
+    assert len(new_encoding) == len(old_encoding)
+    if same_bytes:
+        assert new_encoding == old_encoding
+    assert (decode_encoded_protocol_packet(new_encoding) ==
+            decode_encoded_protocol_packet(old_encoding) ==
+            untouched_protocol_packet)
+    # The copy-free encoder must not modify the encoded packet
+    assert protocol_packet == untouched_protocol_packet
+    packet_info = packet_common.encode_protocol_packet(protocol_packet, None)
+    assert packet_info.protocol_packet is protocol_packet
+    assert (decode_encoded_protocol_packet(packet_info.encoded_protocol_packet) ==
+            untouched_protocol_packet)
+
+def test_copy_free_encoder_single_element_sets():
+    # With single element sets, set iteration order cannot make a difference, so the node TIE
+    # encodings must be identical byte for byte
+    packet_common.add_missing_methods_to_thrift()
+    protocol_packet = make_node_tie_packet()
+    for neighbor in protocol_packet.content.tie.element.node.neighbors.values():
+        neighbor.link_ids = set([max_link_id_pair()])
+    assert encode_copy_free(protocol_packet) == encode_with_copy_and_fix(protocol_packet)
+
+ALL_PACKETS = [
+    make_lie_packet,
+    make_tide_packet,
+    make_tire_packet,
+    make_node_tie_packet,
+    make_prefixes_tie_packet,
+    make_positive_disaggregation_prefixes_tie_packet,
+    make_negative_disaggregation_prefixes_tie_packet,
+    make_external_prefixes_tie_packet,
+    make_key_value_tie_packet,
+    small_values_packet
+]
+
+def encode_and_decode(protocol_packet, encode_codec, decode_codec):
+    try:
+        packet_codec.select_codec(encode_codec)
+        packet_info = packet_common.encode_protocol_packet(protocol_packet, None)
+        packet_info.update_env_header(0)
+        if protocol_packet.content.tie:
+            packet_info.update_outer_sec_env_header(None, 111, 222, 10)
+        else:
+            packet_info.update_outer_sec_env_header(None, 111, 222)
+        message = b''.join(packet_info.message_parts())
+        packet_codec.select_codec(decode_codec)
+        return packet_common.decode_message(None, None, message, None, None, None, None)
+    finally:
+        packet_codec.select_codec(constants.DEFAULT_CODEC)
+
+@pytest.mark.skipif(not packet_codec.FAST_CODEC_AVAILABLE, reason="Thrift C extension missing")
+@pytest.mark.parametrize("make_packet", ALL_PACKETS)
+@pytest.mark.parametrize("encode_codec", constants.CODECS)
+@pytest.mark.parametrize("decode_codec", constants.CODECS)
+def test_codecs_interoperate(make_packet, encode_codec, decode_codec):
+    packet_common.add_missing_methods_to_thrift()
+    protocol_packet = make_packet()
+    decoded_packet_info = encode_and_decode(protocol_packet, encode_codec, decode_codec)
+    assert not decoded_packet_info.error
+    assert decoded_packet_info.protocol_packet == make_packet()
+    # Encoding must not modify the encoded packet
+    assert protocol_packet == make_packet()
+
+@pytest.mark.skipif(not packet_codec.FAST_CODEC_AVAILABLE, reason="Thrift C extension missing")
+def test_fast_codec_same_bytes():
+    packet_common.add_missing_methods_to_thrift()
+    protocol_packet = make_tide_packet()
+    try:
+        packet_codec.select_codec(constants.CODEC_FAST)
+        fast_encoding = packet_codec.encode_protocol_packet_bytes(protocol_packet)
+    finally:
+        packet_codec.select_codec(constants.DEFAULT_CODEC)
+    assert fast_encoding == encode_with_copy_and_fix(protocol_packet)
+
+@pytest.mark.parametrize("codec", constants.CODECS)
+def test_codec_decode_error(codec):
+    packet_common.add_missing_methods_to_thrift()
+    packet_info = packet_common.encode_protocol_packet(make_node_tie_packet(), None)
+    packet_info.update_env_header(0)
+    packet_info.update_outer_sec_env_header(None, 111, 222, 10)
+    message = b''.join(packet_info.message_parts())
+    try:
+        packet_codec.select_codec(codec)
+        # Truncated protocol packet
+        decoded_packet_info = packet_common.decode_message(None, None, message[:-20], None, None,
+                                                           None, None)
+    finally:
+        packet_codec.select_codec(constants.DEFAULT_CODEC)
+    assert decoded_packet_info.error == packet_common.PacketInfo.ERR_TRIFT_DECODE
+
+def test_select_codec():
+    assert packet_codec.select_codec(constants.CODEC_PYTHON) == constants.CODEC_PYTHON
+    assert packet_codec.selected_codec() == constants.CODEC_PYTHON
+    selected = packet_codec.select_codec(constants.CODEC_FAST)
+    if packet_codec.FAST_CODEC_AVAILABLE:
+        assert selected == constants.CODEC_FAST
+    else:
+        assert selected == constants.CODEC_PYTHON
+    assert packet_codec.selected_codec() == selected
+
+def encode_tie_message(protocol_packet):
+    packet_info = packet_common.encode_protocol_packet(protocol_packet, None)
+    packet_info.update_env_header(0)
+    packet_info.update_outer_sec_env_header(None, 111, 222, 10)
+    return b''.join(packet_info.message_parts())
+
+def decode_lazily(message):
+    try:
+        packet_codec.set_lazy_tie_decode(True)
+        return packet_common.decode_message(None, None, message, None, None, None, None)
+    finally:
+        packet_codec.set_lazy_tie_decode(False)
+
+@pytest.mark.parametrize("codec", constants.CODECS)
+@pytest.mark.parametrize("make_packet", [
+    make_node_tie_packet,
+    make_prefixes_tie_packet,
+    make_external_prefixes_tie_packet,
+    make_key_value_tie_packet
+])
+def test_lazy_tie_decode(codec, make_packet):
+    packet_common.add_missing_methods_to_thrift()
+    message = encode_tie_message(make_packet())
+    try:
+        packet_codec.select_codec(codec)
+        packet_info = decode_lazily(message)
+        assert not packet_info.error
+        tie_packet = packet_info.protocol_packet.content.tie
+        assert isinstance(tie_packet, packet_codec.LazyTIEPacket)
+        assert not tie_packet.element_decoded()
+        # The header is decoded (and fixed) up front
+        assert tie_packet.header == make_packet().content.tie.header
+        assert not tie_packet.element_decoded()
+        # The element is decoded when it is accessed
+        assert tie_packet.element == make_packet().content.tie.element
+        assert tie_packet.element_decoded()
+        assert packet_info.protocol_packet == make_packet()
+        assert make_packet() == packet_info.protocol_packet
+        # The lazily decoded packet is encoded in the same way as the original packet
+        assert (packet_codec.encode_protocol_packet_bytes(packet_info.protocol_packet) ==
+                packet_codec.encode_protocol_packet_bytes(make_packet()))
+    finally:
+        packet_codec.select_codec(constants.DEFAULT_CODEC)
+
+def test_lazy_tie_decode_element_not_needed():
+    packet_common.add_missing_methods_to_thrift()
+    packet_info = decode_lazily(encode_tie_message(make_prefixes_tie_packet()))
+    tie_packet = packet_info.protocol_packet.content.tie
+    assert packet_common.decode_lazy_tie_element(packet_info)
+    assert tie_packet.element_decoded()
+    assert tie_packet.element == make_prefixes_tie_packet().content.tie.element
+    # Not lazily decoded packets don't need anything decoded
+    assert packet_common.decode_lazy_tie_element(
+        packet_common.decode_message(None, None, encode_tie_message(make_node_tie_packet()),
+                                     None, None, None, None))
+
+@pytest.mark.parametrize("codec", constants.CODECS)
+def test_lazy_tie_decode_bad_element(codec):
+    packet_common.add_missing_methods_to_thrift()
+    protocol_packet = make_prefixes_tie_packet()
+    try:
+        packet_codec.select_codec(codec)
+        packet_info = decode_lazily(encode_tie_message(protocol_packet))
+        assert not packet_info.error
+        tie_packet = packet_info.protocol_packet.content.tie
+        assert tie_packet.header == protocol_packet.content.tie.header
+        # Replace the encoded packet from which the element is decoded with a truncated one
+        tie_packet.set_encoded_protocol_packet(packet_info.encoded_protocol_packet[:-10])
+        assert not packet_common.decode_lazy_tie_element(packet_info)
+        assert packet_info.error == packet_common.PacketInfo.ERR_TRIFT_DECODE
+        assert tie_packet.element is None
+    finally:
+        packet_codec.select_codec(constants.DEFAULT_CODEC)
+
+def test_decode_from_receive_buffer():
+    packet_common.add_missing_methods_to_thrift()
+    protocol_packet = make_prefixes_tie_packet()
+    message = encode_tie_message(protocol_packet)
+    rx_buffer = bytearray(len(message) + 100)
+    rx_buffer[:len(message)] = message
+    for lazy in [False, True]:
+        view = memoryview(rx_buffer)[:len(message)]
+        if lazy:
+            packet_info = decode_lazily(view)
+        else:
+            packet_info = packet_common.decode_message(None, None, view, None, None, None, None)
+        assert not packet_info.error
+        # Nothing was copied out of the receive buffer
+        assert isinstance(packet_info.encoded_protocol_packet, memoryview)
+        assert isinstance(packet_info.origin_sec_env_header, memoryview)
+        packet_info.own_buffers()
+        assert isinstance(packet_info.encoded_protocol_packet, bytes)
+        # Re-using the receive buffer does not affect the packet info
+        rx_buffer[:len(message)] = bytes(len(message))
+        assert b''.join(packet_info.message_parts()) == message
+        assert packet_info.protocol_packet == protocol_packet
+        rx_buffer[:len(message)] = message
+
+def test_max_tire_headers():
+    packet_common.add_missing_methods_to_thrift()
+    for mtu in [1400, 9000]:
+        max_headers = packet_common.max_tire_headers(mtu)
+        tire_packet = packet_common.make_tire_packet()
+        for tie_nr in range(max_headers):
+            tie_header = packet_common.make_tie_header_with_lifetime(
+                common.ttypes.TieDirectionType.South, 1000 + tie_nr,
+                common.ttypes.TIETypeType.PrefixTIEType, tie_nr, 1, 600)
+            packet_common.add_tie_header_to_tire(tire_packet, tie_header)
+        protocol_packet = encoding.ttypes.ProtocolPacket(
+            header=encoding.ttypes.PacketHeader(sender=1, level=1),
+            content=encoding.ttypes.PacketContent(tire=tire_packet))
+        encoded_size = len(packet_codec.encode_protocol_packet_bytes(protocol_packet))
+        assert encoded_size + packet_common.TIDE_PACKET_OVERHEAD <= mtu
+
+def test_origin_fingerprint_verified_once():
+    packet_common.add_missing_methods_to_thrift()
+    origin_key = key.Key(5, "hmac-sha-256", "origin-secret")
+    protocol_packet = make_prefixes_tie_packet()
+    packet_info = packet_common.encode_protocol_packet(protocol_packet, origin_key)
+    packet_info.update_env_header(0)
+    packet_info.update_outer_sec_env_header(None, 111, 222, 10)
+    message = b''.join(packet_info.message_parts())
+    cache = origin_key.origin_fingerprint_cache
+    assert (cache.hit_count, cache.miss_count) == (0, 1)
+    # Receiving the same TIE version (e.g. from multiple neighbors) does not recompute the
+    # origin fingerprint
+    for _ in range(3):
+        rx_packet_info = packet_common.decode_message(None, None, memoryview(message), None, None,
+                                                      origin_key, None)
+        assert not rx_packet_info.error
+    assert (cache.hit_count, cache.miss_count) == (3, 1)
+    # A tampered message with the same TIE-ID and sequence number is still rejected
+    protocol_packet.header.level = 1
+    tampered_packet_info = packet_common.encode_protocol_packet(protocol_packet, None)
+    tampered_packet_info.update_env_header(0)
+    tampered_packet_info.origin_sec_env_header = packet_info.origin_sec_env_header
+    tampered_packet_info.update_outer_sec_env_header(None, 111, 222, 10)
+    tampered_message = b''.join(tampered_packet_info.message_parts())
+    rx_packet_info = packet_common.decode_message(None, None, tampered_message, None, None,
+                                                  origin_key, None)
+    assert rx_packet_info.error == rx_packet_info.ERR_INCORRECT_ORIGIN_FINGERPRINT
+
+def test_lifetime_bucket():
+    assert packet_common.lifetime_bucket(605) == 600
+    assert packet_common.lifetime_bucket(600) == 600
+    assert packet_common.lifetime_bucket(7) == 7
+    assert packet_common.lifetime_bucket(0xffffffff) == 0xffffffff
+
+def test_outer_fingerprint_cache():
+    packet_common.add_missing_methods_to_thrift()
+    outer_key = key.Key(7, "hmac-sha-256", "outer-secret")
+    cache = key.FingerprintCache()
+    packet_info = packet_common.encode_protocol_packet(make_prefixes_tie_packet(), None)
+    packet_info.update_env_header(0)
+    packet_info.update_outer_sec_env_header(outer_key, 111, 222, 605, cache)
+    # The lifetime of the TIE itself is not rounded down
+    assert packet_info.remaining_tie_lifetime == 605
+    first_outer_sec_env_header = packet_info.outer_sec_env_header
+    # Re-sending the same packet with the same nonces in the same lifetime bucket re-uses the
+    # cached fingerprint
+    packet_info.update_outer_sec_env_header(outer_key, 111, 222, 601, cache)
+    assert (cache.hit_count, cache.miss_count) == (1, 1)
+    assert packet_info.outer_sec_env_header == first_outer_sec_env_header
+    message = b''.join(packet_info.message_parts())
+    rx_packet_info = packet_common.decode_message(None, None, message, outer_key, [outer_key],
+                                                  None, None)
+    assert not rx_packet_info.error
+    assert rx_packet_info.remaining_tie_lifetime == 600
+    # Changing a nonce or the lifetime bucket recomputes the fingerprint
+    packet_info.update_outer_sec_env_header(outer_key, 112, 222, 601, cache)
+    packet_info.update_outer_sec_env_header(outer_key, 112, 222, 599, cache)
+    assert (cache.hit_count, cache.miss_count) == (1, 3)
+    message = b''.join(packet_info.message_parts())
+    rx_packet_info = packet_common.decode_message(None, None, message, outer_key, [outer_key],
+                                                  None, None)
+    assert not rx_packet_info.error
+    assert rx_packet_info.remaining_tie_lifetime == 590
+
+def test_outer_fingerprint_cache_key():
+    packet_common.add_missing_methods_to_thrift()
+    outer_key = key.Key(7, "hmac-sha-256", "outer-secret")
+    cache = key.FingerprintCache()
+    packet_info = packet_common.encode_protocol_packet(make_prefixes_tie_packet(), None)
+    packet_info.update_env_header(0)
+    packet_info.update_outer_sec_env_header(outer_key, 111, 222, 605, cache)
+    # The cache does not keep the packet info alive
+    packet_info_ref = weakref.ref(packet_info)
+    del packet_info
+    gc.collect()
+    assert packet_info_ref() is None
+    # Another packet info for the same version of the same TIE re-uses the cached fingerprint
+    packet_info = packet_common.encode_protocol_packet(make_prefixes_tie_packet(), None)
+    packet_info.update_env_header(1)
+    packet_info.update_outer_sec_env_header(outer_key, 111, 222, 605, cache)
+    assert (cache.hit_count, cache.miss_count) == (1, 1)
@@ -0,0 +1,51 @@
+import os
+import pstats
+
+import profiler
+
+class CliSession:
+
+    def __init__(self):
+        self.output = ""
+
+    def print(self, message):
+        self.output += message + "\n"
+
+def busy_function():
+    return sum(range(1000))
+
+def test_start_stop(tmpdir):
+    prof = profiler.Profiler()
+    session = CliSession()
+    file_name = str(tmpdir.join("test.prof"))
+    prof.command_start(session, file_name)
+    assert prof.running
+    assert "Profiling started (output file {})".format(file_name) in session.output
+    busy_function()
+    prof.command_stop(session)
+    assert not prof.running
+    assert "Profiling stopped after" in session.output
+    assert "busy_function" in session.output
+    # The output file is in pstats format
+    assert os.path.exists(file_name)
+    stats = pstats.Stats(file_name)
+    assert any(function_name == "busy_function" for (_, _, function_name) in stats.stats)
+
+def test_errors(tmpdir):
+    prof = profiler.Profiler()
+    session = CliSession()
+    prof.command_stop(session)
+    assert session.output == "Profiling is not running\n"
+    session = CliSession()
+    prof.command_start(session, str(tmpdir.join("test.prof")))
+    prof.command_start(session, str(tmpdir.join("other.prof")))
+    assert "Profiling is already running" in session.output
+    session = CliSession()
+    prof.command_stop(session)
+    assert "Profiling stopped after" in session.output
+
+def test_default_file_name(monkeypatch):
+    monkeypatch.setenv("RIFT_TEST_RESULTS_DIR", "/tmp/results")
+    file_name = profiler.default_file_name()
+    assert file_name.startswith("/tmp/results/rift-profile-{}-".format(os.getpid()))
+    assert file_name.endswith(".prof")
@@ -0,0 +1,143 @@
+import re
+import socket
+
+import pytest
+
+import scheduler
+import timer
+
+class Handler:
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.read_count = 0
+        self.write_count = 0
+
+    def rx_fd(self):
+        return self.sock.fileno()
+
+    def tx_fd(self):
+        return self.sock.fileno()
+
+    def ready_to_read(self):
+        self.read_count += 1
+        self.sock.recv(100)
+
+    def ready_to_write(self):
+        self.write_count += 1
+
+# pylint: disable=redefined-outer-name
+@pytest.fixture
+def sockets():
+    # Make sure there are no timers from previous tests that delay or block the iteration
+    timer.TIMER_SCHEDULER.stop_all_timers()
+    (sock1, sock2) = socket.socketpair()
+    yield (sock1, sock2)
+    sock1.close()
+    sock2.close()
+
+def test_read(sockets):
+    (sock1, sock2) = sockets
+    sched = scheduler.Scheduler()
+    handler = Handler(sock1)
+    sched.register_handler(handler, True, False)
+    assert sched.nr_registered_fds() == 1
+    sock2.send(b"hello")
+    sched.run_one_iteration()
+    assert handler.read_count == 1
+    assert handler.write_count == 0
+    sched.unregister_handler(handler)
+    assert sched.nr_registered_fds() == 0
+
+def test_loop_stats(sockets):
+    (sock1, sock2) = sockets
+    sched = scheduler.Scheduler()
+    handler = Handler(sock1)
+    sched.register_handler(handler, True, False)
+    sock2.send(b"hello")
+    sched.run_one_iteration()
+    loop_stats = sched.loop_stats_table().to_string()
+    for activity in ["Iteration", "Wait For I/O", "Timers", "FSM Events", "Handler Handler"]:
+        assert re.search(r"\| " + activity + r" +\| 1 +\|", loop_stats)
+    # No packets on in-memory links, so that is not measured
+    assert re.search(r"\| In-Memory Links +\| 0 +\|", loop_stats)
+    sched.clear_loop_stats()
+    loop_stats = sched.loop_stats_table().to_string()
+    assert "Handler Handler" not in loop_stats
+    assert re.search(r"\| Iteration +\| 0 +\|", loop_stats)
+    sched.unregister_handler(handler)
+
+def test_read_and_write_same_fd(sockets):
+    (sock1, sock2) = sockets
+    sched = scheduler.Scheduler()
+    handler = Handler(sock1)
+    sched.register_handler(handler, True, True)
+    # Both directions share a single fd registration
+    assert sched.nr_registered_fds() == 1
+    sock2.send(b"hello")
+    sched.run_one_iteration()
+    assert handler.read_count == 1
+    assert handler.write_count == 1
+    # The socket is always writable; with nothing to read only ready_to_write is invoked
+    sched.run_one_iteration()
+    assert handler.read_count == 1
+    assert handler.write_count == 2
+    sched.unregister_handler(handler)
+    assert sched.nr_registered_fds() == 0
+
+def test_unregister_during_dispatch(sockets):
+    (sock1, sock2) = sockets
+    sched = scheduler.Scheduler()
+    handler1 = Handler(sock1)
+    handler2 = Handler(sock2)
+    sched.register_handler(handler1, True, False)
+    sched.register_handler(handler2, True, False)
+    # Whichever handler is dispatched first unregisters the other one
+    handler1.ready_to_read = lambda: sched.unregister_handler(handler2)
+    handler2.ready_to_read = lambda: sched.unregister_handler(handler1)
+    sock1.send(b"hello")
+    sock2.send(b"hello")
+    sched.run_one_iteration()
+    assert sched.nr_registered_fds() == 1
+
+def test_asyncio(sockets):
+    (sock1, sock2) = sockets
+    sched = scheduler.Scheduler()
+    handler = Handler(sock1)
+    sched.register_handler(handler, True, False)
+    # Handlers registered while the loop is running are picked up as well
+    (sock3, sock4) = socket.socketpair()
+    handler3 = Handler(sock3)
+    def register_and_send():
+        sched.register_handler(handler3, True, False)
+        sock4.send(b"hello")
+    timer.Timer(interval=0.1, expire_function=register_and_send, periodic=False)
+    sock2.send(b"hello")
+    # The loop runs until a timer stops it
+    timer.Timer(interval=0.3, expire_function=sched.stop_asyncio, periodic=False)
+    loop = sched.create_asyncio_loop(use_uvloop=False)
+    sched.run_asyncio(loop)
+    loop.close()
+    assert handler.read_count == 1
+    assert handler3.read_count == 1
+    sched.unregister_handler(handler)
+    sched.unregister_handler(handler3)
+    assert sched.nr_registered_fds() == 0
+    sock3.close()
+    sock4.close()
+
+def test_asyncio_exception(sockets):
+    (sock1, sock2) = sockets
+    sched = scheduler.Scheduler()
+    handler = Handler(sock1)
+    def fail():
+        raise RuntimeError("handler failed")
+    handler.ready_to_read = fail
+    sched.register_handler(handler, True, False)
+    sock2.send(b"hello")
+    # Just like in the select loop, an exception in a handler stops the engine
+    loop = sched.create_asyncio_loop(use_uvloop=False)
+    with pytest.raises(RuntimeError):
+        sched.run_asyncio(loop)
+    loop.close()
+    sched.unregister_handler(handler)
@@ -0,0 +1,40 @@
+import socket
+
+import engine
+import shard
+
+def test_control_channel_messages():
+    (sock1, sock2) = socket.socketpair()
+    message = ("command", "command_show_interface", "node1", {'interface': 'if1'})
+    shard.send_message(sock1, message)
+    # Large messages are received in multiple chunks
+    big_message = ["x" * 1000] * 1000
+    shard.send_message(sock2, big_message)
+    assert shard.receive_message(sock2) == message
+    assert shard.receive_message(sock1) == big_message
+    sock1.close()
+    try:
+        shard.receive_message(sock2)
+        assert False, "Expected EOFError"
+    except EOFError:
+        pass
+    sock2.close()
+
+def test_parse_tree():
+    tree = shard.ShardFrontEnd.parse_tree
+    # Node and engine commands which the front end handles itself
+    assert tree["set"]["$node"] is shard.ShardFrontEnd.command_set_node
+    assert tree["show"]["nodes"][""] is shard.ShardFrontEnd.command_show_nodes
+    assert tree["show"]["engine"][""] is shard.ShardFrontEnd.command_show_engine
+    assert tree["stop"][""] is shard.ShardFrontEnd.command_stop
+    assert tree["stop"]["profiling"] is shard.ShardFrontEnd.command_stop_profiling
+    # All other commands are forwarded to the worker process of the current node
+    assert tree["show"]["interfaces"] is not engine.Engine.parse_tree["show"]["interfaces"]
+    assert callable(tree["show"]["$interface"]["queues"])
+
+def test_capture_cli_session():
+    session = shard.CaptureCliSession(None)
+    session.print("one")
+    session.print("two ", add_newline=False)
+    session.print("three")
+    assert session.output() == "one\ntwo three\n"
@@ -342,3 +342,22 @@ def test_imcompatible_sum_groups():
     group_2 = stats.Group(sum_group)
     with pytest.raises(Exception):
         stats.Counter(group_2, "Chasing Foxes", "Fox", "Foxen")
+
+def test_histogram():
+    histogram = stats.Histogram("Timers")
+    assert histogram.count() == 0
+    assert histogram.average() == 0.0
+    histogram.record(0.000002)
+    histogram.record(0.00001)
+    histogram.record(0.0005)
+    histogram.record(0.0015)
+    histogram.record(2.5)
+    assert histogram.count() == 5
+    assert histogram.buckets() == [2, 0, 1, 1, 0, 0, 1]
+    assert histogram.maximum() == 2.5
+    assert histogram.table_cells() == [5, "500.40ms", "2.500s", 2, 0, 1, 1, 0, 0, 1]
+    assert histogram.table_headers()[3] == ["0 -", "10us"]
+    assert histogram.table_headers()[-1] == ["1s -", "Up"]
+    histogram.clear()
+    assert histogram.count() == 0
+    assert histogram.buckets() == [0] * 7
@@ -0,0 +1,31 @@
+# System test: test_sys_2n_l0_l1_in_memory
+
+# 2n_l0_l1 = 2 nodes: level 0 and level 1, with packets between the simulated interfaces
+# delivered in memory instead of through sockets
+
+# Allow long test names
+# pylint: disable=invalid-name
+
+from rift_expect_session import RiftExpectSession
+
+def check_engine(res):
+    res.sendline("show engine")
+    res.table_expect("| In-Memory Links | True |")
+    res.wait_prompt()
+
+def test_2n_l0_l1_in_memory():
+    res = RiftExpectSession("2n_l0_l1", in_memory_links=True)
+    check_engine(res)
+    res.check_adjacency_3way(node="node1", interface="if1")
+    res.check_adjacency_3way(node="node2", interface="if1")
+    res.check_level(node="node2", configured_level=0, hal=1, hat=1, level_value=0)
+    expect_rib = [
+        r"| 0.0.0.0/0 | North SPF | if1",
+        r"| ::/0 | North SPF | if1",
+    ]
+    res.check_rib("node2", expect_rib)
+    # Simulated failures work the same as with sockets
+    res.interface_failure("node1", "if1", "failed")
+    res.check_adjacency_1way(node="node1", interface="if1")
+    res.check_adjacency_1way(node="node2", interface="if1")
+    res.stop()
@@ -0,0 +1,45 @@
+# System test: test_sys_2n_l0_l1_multi_shard
+
+# 2n_l0_l1_multi_shard = 2 nodes: level 0 and level 1, each in its own shard, running in
+# multi-process mode (each shard in its own worker process)
+
+# Allow long test names
+# pylint: disable=invalid-name
+
+from rift_expect_session import RiftExpectSession
+
+def check_nodes(res):
+    # The nodes of both worker processes are reported
+    res.sendline("show nodes level")
+    res.table_expect("| node1 | 1 | True | 1 | 1 |")
+    res.table_expect("| node2 | 2 | True | 0 | 0 |")
+    res.wait_prompt()
+
+def check_engine(res):
+    res.sendline("show engine")
+    res.table_expect("| 0 | [0-9]+ | None | True | 1 |")
+    res.table_expect("| 1 | [0-9]+ | None | True | 1 |")
+    res.table_expect("Shard 0:")
+    res.table_expect("| Shards | 0 |")
+    res.table_expect("| Number of Nodes | 2 |")
+    res.table_expect("Shard 1:")
+    res.table_expect("| Shards | 1 |")
+    res.wait_prompt()
+
+def test_2n_l0_l1_multi_shard():
+    res = RiftExpectSession("2n_l0_l1_multi_shard", multi_process=True)
+    check_nodes(res)
+    check_engine(res)
+    # The adjacency between the nodes in different processes comes up; the commands are forwarded
+    # to the worker process of the current node
+    res.check_adjacency_3way(node="node1", interface="if1")
+    res.check_adjacency_3way(node="node2", interface="if1")
+    res.check_level(node="node2", configured_level=0, hal=1, hat=1, level_value=0)
+    expect_rib = [
+        r"| 0.0.0.0/0 | North SPF | if1",
+        r"| ::/0 | North SPF | if1",
+    ]
+    res.check_rib("node2", expect_rib)
+    res.sendline("set node node3")
+    res.expect("Node node3 does not exist")
+    res.stop()
@@ -9,6 +9,9 @@
 # Allow long test names
 # pylint: disable=invalid-name
 
+import os
+import tempfile
+
 from rift_expect_session import RiftExpectSession
 
 def check_clear_engine_statistics(res):
@@ -34,6 +37,13 @@ def check_show_engine(res):
     res.table_expect("| Telnet Port File | None |")
     res.wait_prompt()
 
+def check_show_engine_loop(res):
+    res.sendline("show engine loop")
+    res.table_expect("Event Loop Latency:")
+    res.table_expect("| Timers | [0-9]+ |")
+    res.table_expect("| Handler UdpRxHandler | [0-9]+ |")
+    res.wait_prompt()
+
 def check_show_engine_statistics(res):
     res.sendline("show engine statistics")
     res.table_expect("All Node ZTP FSMs:")
@@ -69,6 +79,14 @@ def check_show_forwarding_prefix(res):
     res.table_expect("| 2.2.2.2/32 | South SPF | if1")
     res.wait_prompt()
 
+def check_show_fsm_latency(res):
+    res.sendline("show fsm latency")
+    res.table_expect("FSM Event Processing Latency:")
+    res.table_expect("| Interface | LIE_RECEIVED | [0-9]+ |")
+    res.table_expect("FSM Event Queues:")
+    res.table_expect("| Chained Events | [0-9]+ | [0-9]+ |")
+    res.wait_prompt()
+
 def check_show_fsm_lie(res):
     res.sendline("show fsm lie")
     res.table_expect("States:")
@@ -296,6 +314,22 @@ def check_set_node(res):
     res.sendline("set node node1")
     res.wait_prompt("node1")
 
+def check_start_stop_profiling(res):
+    (file_descriptor, file_name) = tempfile.mkstemp(suffix=".prof")
+    os.close(file_descriptor)
+    res.sendline("start profiling file " + file_name)
+    res.table_expect("Profiling started")
+    res.wait_prompt()
+    res.sendline("stop profiling")
+    res.table_expect("Profiling stopped after")
+    res.table_expect("Ordered by: cumulative time")
+    res.wait_prompt()
+    assert os.path.getsize(file_name) > 0
+    os.remove(file_name)
+    res.sendline("stop profiling")
+    res.table_expect("Profiling is not running")
+    res.wait_prompt()
+
 def check_stop(res):
     res.sendline("stop")
 
@@ -308,10 +342,12 @@ def test_cli_commands():
     check_set_level(res)
     check_set_node(res)
     check_show_engine(res)
+    check_show_engine_loop(res)
     check_show_engine_statistics(res)
     check_show_flooding_reduction(res)
     check_show_forwarding(res)
     check_show_forwarding_prefix(res)
+    check_show_fsm_latency(res)
     check_show_fsm_lie(res)
     check_show_fsm_ztp(res)
     check_show_interface(res)
@@ -342,5 +378,6 @@ def test_cli_commands():
     check_show_spf_direction_destination(res)
     check_set_level(res)
     check_set_node(res)
+    check_start_stop_profiling(res)
     check_stop(res)
     res.stop()
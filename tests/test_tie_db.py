@@ -0,0 +1,82 @@
+import common.ttypes
+import constants
+import packet_common
+import tie_db
+
+SOUTH = constants.DIR_SOUTH
+PREFIX = common.ttypes.TIETypeType.PrefixTIEType
+
+ADD = tie_db.ChangeType.ADD
+UPDATE = tie_db.ChangeType.UPDATE
+REMOVE = tie_db.ChangeType.REMOVE
+
+def make_tie_id(tie_nr):
+    return packet_common.make_tie_id(SOUTH, 1, PREFIX, tie_nr)
+
+def make_tie_packet_info(lifetime=600):
+    tie_packet_info = packet_common.PacketInfo()
+    tie_packet_info.remaining_tie_lifetime = lifetime
+    return tie_packet_info
+
+def test_store_and_remove():
+    packet_common.add_missing_methods_to_thrift()
+    db = tie_db.TieDb()
+    one = make_tie_packet_info()
+    two = make_tie_packet_info()
+    db.store(make_tie_id(2), two)
+    db.store(make_tie_id(1), one)
+    assert list(db.values()) == [one, two]
+    assert make_tie_id(1) in db
+    assert db.get(make_tie_id(3)) is None
+    assert db.remove(make_tie_id(1)) is one
+    assert db.remove(make_tie_id(1)) is None
+    assert len(db) == 1
+    assert db.generation == 3
+
+def test_changes_since():
+    packet_common.add_missing_methods_to_thrift()
+    db = tie_db.TieDb(journal_length=3)
+    db.store(make_tie_id(1), make_tie_packet_info())
+    generation = db.generation
+    assert db.changes_since(generation) == []
+    db.store(make_tie_id(2), make_tie_packet_info())
+    db.store(make_tie_id(1), make_tie_packet_info())
+    db.remove(make_tie_id(2))
+    assert db.changes_since(generation) == [
+        tie_db.TieDbChange(2, make_tie_id(2), ADD),
+        tie_db.TieDbChange(3, make_tie_id(1), UPDATE),
+        tie_db.TieDbChange(4, make_tie_id(2), REMOVE)]
+    assert db.changed_tie_ids_since(generation + 1) == {make_tie_id(1), make_tie_id(2)}
+    # The journal does not go back far enough anymore
+    assert db.changes_since(0) is None
+    assert db.changed_tie_ids_since(0) is None
+    # Clearing the TIE-DB removes each TIE
+    db.clear()
+    assert not db
+    assert db.changes_since(db.generation - 1) == [tie_db.TieDbChange(5, make_tie_id(1), REMOVE)]
+
+def test_age():
+    packet_common.add_missing_methods_to_thrift()
+    db = tie_db.TieDb()
+    short = make_tie_packet_info(2)
+    long = make_tie_packet_info(600)
+    db.store(make_tie_id(1), short)
+    db.store(make_tie_id(2), long)
+    # The remaining lifetime is derived from the expire time
+    assert not db.age()
+    assert short.remaining_tie_lifetime == 1
+    assert long.remaining_tie_lifetime == 599
+    assert db.age() == [make_tie_id(1)]
+    db.remove(make_tie_id(1))
+    # A new version of a TIE replaces the expire time of the old version, whose lifetime is frozen
+    newer = make_tie_packet_info(3)
+    db.store(make_tie_id(2), newer)
+    assert long.remaining_tie_lifetime == 598
+    assert not db.age(2)
+    assert long.remaining_tie_lifetime == 598
+    assert newer.remaining_tie_lifetime == 1
+    assert db.age() == [make_tie_id(2)]
+    # Removing a TIE also removes its expire time
+    db.store(make_tie_id(3), make_tie_packet_info(1))
+    db.remove(make_tie_id(3))
+    assert not db.age(1000)
@@ -0,0 +1,104 @@
+import common.ttypes
+import constants
+import node
+import packet_common
+import tie_fragmenter
+
+MY_SYSTEM_ID = 999
+
+NORTH = constants.DIR_NORTH
+PREFIX = common.ttypes.TIETypeType.PrefixTIEType
+
+def entry_size(_key, value):
+    return value
+
+def test_fragment_assignment():
+    # Empty size is 10, so there is room for 90 bytes of entries in each fragment
+    fragmenter = tie_fragmenter.TieFragmenter(100)
+    entries = {"a": 40, "b": 40, "c": 40}
+    fragments = fragmenter.update(entries, 10, entry_size)
+    assert fragments == [{"a": 40, "b": 40}, {"c": 40}]
+    # A new entry goes into the first fragment with room for it
+    entries["d"] = 10
+    fragments = fragmenter.update(entries, 10, entry_size)
+    assert fragments == [{"a": 40, "b": 40, "d": 10}, {"c": 40}]
+    # Removing an entry leaves the other entries where they are
+    del entries["a"]
+    fragments = fragmenter.update(entries, 10, entry_size)
+    assert fragments == [{"b": 40, "d": 10}, {"c": 40}]
+    assert fragmenter.fragment_index("c") == 1
+    # A new entry fills the hole
+    entries["e"] = 30
+    fragments = fragmenter.update(entries, 10, entry_size)
+    assert fragments == [{"b": 40, "d": 10, "e": 30}, {"c": 40}]
+    # An entry that grows and no longer fits moves the most recently added entry elsewhere
+    entries["b"] = 60
+    fragments = fragmenter.update(entries, 10, entry_size)
+    assert fragments == [{"b": 60, "d": 10}, {"c": 40, "e": 30}]
+
+def test_fragments_never_removed():
+    fragmenter = tie_fragmenter.TieFragmenter(100)
+    fragments = fragmenter.update({"a": 50, "b": 50}, 10, entry_size)
+    assert fragments == [{"a": 50}, {"b": 50}]
+    # The empty fragment is kept, so that it can be re-originated to flush the removed entry
+    fragments = fragmenter.update({"a": 50}, 10, entry_size)
+    assert fragments == [{"a": 50}, {}]
+    assert fragmenter.nr_fragments() == 2
+    # An entry that is too big for any fragment gets a fragment of its own
+    fragments = fragmenter.update({"a": 50, "x": 200}, 10, entry_size)
+    assert fragments == [{"a": 50}, {"x": 200}]
+    fragmenter.clear()
+    assert fragmenter.nr_fragments() == 0
+    # There is always at least one fragment
+    fragments = fragmenter.update({}, 10, entry_size)
+    assert fragments == [{}]
+
+def make_prefix_config(nr_prefixes, metric=1):
+    return [{"address": "10.{}.{}.0".format(index // 256, index % 256), "mask": 24,
+             "metric": metric}
+            for index in range(nr_prefixes)]
+
+def north_prefix_ties(test_node):
+    tie_packets = []
+    for tie_packet_info in test_node.tie_packet_infos.values():
+        tie_id = tie_packet_info.protocol_packet.content.tie.header.tieid
+        if tie_id.direction == NORTH and tie_id.tietype == PREFIX:
+            tie_packets.append(tie_packet_info.protocol_packet.content.tie)
+    return tie_packets
+
+def test_fragment_north_prefix_tie():
+    packet_common.add_missing_methods_to_thrift()
+    nr_prefixes = 500
+    config = {
+        "name": "test",
+        "systemid": MY_SYSTEM_ID,
+        "v4prefixes": make_prefix_config(nr_prefixes)
+    }
+    test_node = node.Node(config)
+    tie_packets = north_prefix_ties(test_node)
+    assert len(tie_packets) > 1
+    assert [tie_packet.header.tieid.tie_nr for tie_packet in tie_packets] == \
+        list(range(node.MY_PREFIX_TIE_NR, node.MY_PREFIX_TIE_NR + len(tie_packets)))
+    nr_advertised = 0
+    for tie_packet in tie_packets:
+        assert tie_packet.header.seq_nr == 1
+        assert packet_common.encoded_tie_packet_size(tie_packet) <= node.Node.MAX_TIE_PACKET_SIZE
+        nr_advertised += len(tie_packet.element.prefixes.prefixes)
+    assert nr_advertised == nr_prefixes
+    # Changing the metric of one prefix only re-originates the fragment that contains it
+    config["v4prefixes"][300]["metric"] = 2
+    test_node.regenerate_my_north_prefix_tie()
+    changed_prefix = packet_common.make_ipv4_prefix("10.1.44.0/24")
+    changed_tie_nr = None
+    for tie_packet in north_prefix_ties(test_node):
+        if changed_prefix in tie_packet.element.prefixes.prefixes:
+            changed_tie_nr = tie_packet.header.tieid.tie_nr
+            assert tie_packet.header.seq_nr == 2
+            assert tie_packet.element.prefixes.prefixes[changed_prefix].metric == 2
+        else:
+            assert tie_packet.header.seq_nr == 1
+    assert changed_tie_nr is not None
+    # Regenerating without any change does not re-originate anything
+    test_node.regenerate_my_north_prefix_tie()
+    seq_nrs = [tie_packet.header.seq_nr for tie_packet in north_prefix_ties(test_node)]
+    assert sorted(seq_nrs) == [1] * (len(seq_nrs) - 1) + [2]
@@ -223,3 +223,145 @@ def test_attributes(context):
     assert timer2.running() is False
     assert timer2.interval() == pytest.approx(0.7)
     assert timer2.remaining_time_str() == "Stopped"
+
+class ManualClockTimerScheduler(timer.TimerScheduler):
+
+    # Timer scheduler with a clock that only moves when the test says so
+
+    def __init__(self):
+        timer.TimerScheduler.__init__(self)
+        self.manual_now = 0.0
+
+    def now(self):
+        return self.manual_now
+
+def test_wheel_long_intervals():
+    sched = ManualClockTimerScheduler()
+    expired = []
+    # Intervals that land in each level of the wheel, and one beyond the range of the wheel
+    intervals = [0.3, 5.0, 100.0, 20000.0, 200000.0, 1000000.0]
+    timers = [timer.Timer(interval=interval,
+                          expire_function=lambda interval=interval: expired.append(interval),
+                          periodic=False,
+                          scheduler=sched)
+              for interval in intervals]
+    assert sched.nr_scheduled_timers() == len(intervals)
+    for interval in intervals:
+        # Just before the expire time, nothing expires and the timeout points at the expiry
+        # (or at an earlier cascade from a higher level of the wheel)
+        sched.manual_now = interval - 0.05
+        timeout = sched.trigger_all_expired_timers()
+        assert expired == [expired_interval for expired_interval in intervals
+                           if expired_interval < interval]
+        assert 0.0 <= timeout <= 0.05 + sched.TICK_SECS
+        # Just after the expire time, the timer has expired
+        sched.manual_now = interval + sched.TICK_SECS
+        sched.trigger_all_expired_timers()
+        assert expired[-1] == interval
+    assert sched.trigger_all_expired_timers() is None
+    assert sched.nr_scheduled_timers() == 0
+    assert not any(tmr.running() for tmr in timers)
+
+def test_wheel_periodic_catch_up():
+    sched = ManualClockTimerScheduler()
+    expire_times = []
+    periodic_timer = timer.Timer(interval=1.0,
+                                 expire_function=lambda: expire_times.append(sched.manual_now),
+                                 scheduler=sched)
+    # The system was busy for 3.5 seconds; the timer catches up and expires 3 times
+    sched.manual_now = 3.5
+    timeout = sched.trigger_all_expired_timers()
+    assert len(expire_times) == 3
+    assert periodic_timer.expire_time() == pytest.approx(4.0)
+    assert timeout == pytest.approx(0.5, abs=sched.TICK_SECS)
+    periodic_timer.stop()
+    assert sched.nr_scheduled_timers() == 0
+
+def test_wheel_timeout_considers_higher_levels():
+    sched = ManualClockTimerScheduler()
+    expire_times = []
+    # Timer A lands in level 1 of the wheel
+    _timer_a = timer.Timer(interval=3.0,
+                           expire_function=lambda: expire_times.append(sched.manual_now),
+                           periodic=False, scheduler=sched)
+    sched.manual_now = 1.0
+    sched.trigger_all_expired_timers()
+    # Timer B expires after timer A, but lands in level 0 of the wheel
+    _timer_b = timer.Timer(interval=2.5,
+                           expire_function=lambda: expire_times.append(sched.manual_now),
+                           periodic=False, scheduler=sched)
+    timeout = sched.trigger_all_expired_timers()
+    assert timeout <= 2.0
+    # Sleeping for the returned timeouts expires timer A no more than one tick late
+    while not expire_times:
+        sched.manual_now += timeout
+        timeout = sched.trigger_all_expired_timers()
+    assert expire_times[0] <= 3.0 + sched.TICK_SECS
+
+def test_wheel_stop_from_expire_function():
+    sched = ManualClockTimerScheduler()
+    expired = []
+    timer2 = timer.Timer(interval=1.0, expire_function=lambda: expired.append(2),
+                         start=False, scheduler=sched)
+    _timer1 = timer.Timer(interval=1.0, expire_function=timer2.stop,
+                          periodic=False, scheduler=sched)
+    timer2.start()
+    sched.manual_now = 1.5
+    sched.trigger_all_expired_timers()
+    # Timer1 stopped timer2, which was due in the same tick
+    assert not expired
+    assert not timer2.running()
+
+def test_tick_group():
+    sched = ManualClockTimerScheduler()
+    dispatched = []
+    # Members without a jitter key all run in phase 0 of the group, in a single dispatch
+    members = [timer.GroupTimer(interval=1.0,
+                                expire_function=lambda nr=nr: dispatched.append((sched.now(), nr)),
+                                scheduler=sched)
+               for nr in range(5)]
+    assert sched.tick_group(1.0).nr_members() == 5
+    # All members share one underlying timer
+    assert sched.nr_scheduled_timers() == 1
+    sched.manual_now = 1.0
+    sched.trigger_all_expired_timers()
+    assert dispatched == [(1.0, nr) for nr in range(5)]
+    # Stopped members are not dispatched anymore; when the last member stops the group timer stops
+    members[0].stop()
+    sched.manual_now = 2.0
+    sched.trigger_all_expired_timers()
+    assert [nr for (_now, nr) in dispatched[5:]] == [1, 2, 3, 4]
+    for member in members:
+        member.stop()
+    assert sched.nr_scheduled_timers() == 0
+    assert members[0].remaining_time_str() == "Stopped"
+
+def test_tick_group_jitter():
+    sched = ManualClockTimerScheduler()
+    dispatch_times = {}
+    def expire(key):
+        dispatch_times.setdefault(key, []).append(sched.now())
+    keys = ["node{}:if{}".format(node_nr, intf_nr) for node_nr in range(10) for intf_nr in range(4)]
+    members = [timer.GroupTimer(interval=1.0,
+                                expire_function=lambda key=key: expire(key),
+                                jitter_key=key,
+                                scheduler=sched)
+               for key in keys]
+    # Each phase that has members has its own timer
+    assert 1 < sched.nr_scheduled_timers() <= sched.TICK_GROUP_PHASES
+    sched.manual_now = 0.0
+    while sched.manual_now < 3.0:
+        sched.manual_now += 0.01
+        sched.trigger_all_expired_timers()
+    for key in keys:
+        # Each member runs once per interval at a fixed, deterministic phase within the interval
+        times = dispatch_times[key]
+        assert len(times) == 3
+        phase = sched.tick_group(1.0).phase_for_key(key)
+        expected_offset = phase / sched.TICK_GROUP_PHASES
+        for nr, dispatch_time in enumerate(times):
+            assert dispatch_time == pytest.approx(nr + expected_offset, abs=0.02) or \
+                   (phase == 0 and dispatch_time == pytest.approx(nr + 1.0, abs=0.02))
+    sched.stop_all_timers()
+    assert not any(member.running() for member in members)
+    assert sched.nr_scheduled_timers() == 0
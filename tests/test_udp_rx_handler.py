@@ -0,0 +1,105 @@
+import logging
+import socket
+
+import pytest
+
+import udp_rx_handler
+
+class Receiver:
+
+    def __init__(self):
+        self.batches = []
+
+    def receive(self, messages, sock):
+        assert sock is not None
+        # The messages are memoryviews into receive buffers which are re-used after we return
+        self.batches.append([(bytes(message), from_info) for (message, from_info) in messages])
+
+def test_batched_receive():
+    receiver = Receiver()
+    handler = udp_rx_handler.UdpRxHandler(
+        interface_name="lo",
+        local_port=0,
+        ipv4=True,
+        multicast_address=None,
+        remote_address=None,
+        receive_function=receiver.receive,
+        log=logging.getLogger("test"),
+        log_id="test",
+        batch_size=2)
+    assert handler.sock is not None
+    rx_address = handler.sock.getsockname()
+    tx_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for message in [b"one", b"two", b"three"]:
+        tx_sock.sendto(message, rx_address)
+    # First wakeup receives a full batch, second wakeup receives the remainder
+    handler.ready_to_read()
+    handler.ready_to_read()
+    # Nothing left to receive; the non-blocking socket must not block and no batch is reported
+    handler.ready_to_read()
+    tx_port = tx_sock.getsockname()[1]
+    tx_sock.close()
+    handler.close()
+    assert len(receiver.batches) == 2
+    assert [message for (message, _from_info) in receiver.batches[0]] == [b"one", b"two"]
+    assert [message for (message, _from_info) in receiver.batches[1]] == [b"three"]
+    (_message, from_info) = receiver.batches[0][0]
+    assert from_info == ("127.0.0.1", tx_port)
+
+def test_receive_buffers_reused():
+    receiver = Receiver()
+    handler = udp_rx_handler.UdpRxHandler(
+        interface_name="lo",
+        local_port=0,
+        ipv4=True,
+        multicast_address=None,
+        remote_address=None,
+        receive_function=receiver.receive,
+        log=logging.getLogger("test"),
+        log_id="test",
+        batch_size=2)
+    rx_address = handler.sock.getsockname()
+    tx_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    tx_sock.sendto(b"warmup", rx_address)
+    handler.ready_to_read()
+    nr_allocated = udp_rx_handler.RX_BUFFER_POOL.nr_allocated
+    for _ in range(10):
+        for message in [b"one", b"two", b"three"]:
+            tx_sock.sendto(message, rx_address)
+        handler.ready_to_read()
+        handler.ready_to_read()
+    tx_sock.close()
+    handler.close()
+    assert len(receiver.batches) == 21
+    assert receiver.batches[-1] == [(b"three", receiver.batches[-1][0][1])]
+    # Once the pool holds a batch worth of buffers, no more buffers are allocated
+    assert udp_rx_handler.RX_BUFFER_POOL.nr_allocated <= max(nr_allocated, 2)
+
+def test_receive_buffers_released_on_exception():
+    def failing_receive(_messages, _sock):
+        raise RuntimeError("receive function failed")
+    handler = udp_rx_handler.UdpRxHandler(
+        interface_name="lo",
+        local_port=0,
+        ipv4=True,
+        multicast_address=None,
+        remote_address=None,
+        receive_function=failing_receive,
+        log=logging.getLogger("test"),
+        log_id="test",
+        batch_size=2)
+    rx_address = handler.sock.getsockname()
+    tx_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    tx_sock.sendto(b"warmup", rx_address)
+    with pytest.raises(RuntimeError):
+        handler.ready_to_read()
+    nr_allocated = udp_rx_handler.RX_BUFFER_POOL.nr_allocated
+    for _ in range(10):
+        for message in [b"one", b"two"]:
+            tx_sock.sendto(message, rx_address)
+        with pytest.raises(RuntimeError):
+            handler.ready_to_read()
+    tx_sock.close()
+    handler.close()
+    # The buffers of the failed batches were returned to the pool and re-used
+    assert udp_rx_handler.RX_BUFFER_POOL.nr_allocated <= max(nr_allocated, 2)
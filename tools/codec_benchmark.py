@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+# Compare the copy-free protocol packet encoder, which applies the unsigned to signed fixes on the
+# fly while writing, with the encoder that was used before, which makes a deep copy of the packet,
+# fixes the copy, and then writes the copy. The packets are a LIE, a TIDE, and a node TIE and a
+# prefix TIE of configurable size. It also compares the encoding and decoding speed of the fast
+# codec (Thrift C extension) and the pure Python codec.
+
+# pylint:disable=wrong-import-position
+import sys
+sys.path.append("rift")
+
+import argparse
+import copy
+import time
+
+import thrift.protocol.TBinaryProtocol
+import thrift.transport.TTransport
+
+import common.ttypes
+import constants
+import encoding.constants
+import encoding.ttypes
+import packet_codec
+import packet_common
+
+def encode_with_copy_and_fix(protocol_packet):
+    fixed_protocol_packet = copy.deepcopy(protocol_packet)
+    packet_codec.fix_prot_packet_before_encode(fixed_protocol_packet)
+    transport_out = thrift.transport.TTransport.TMemoryBuffer()
+    protocol_out = thrift.protocol.TBinaryProtocol.TBinaryProtocol(transport_out)
+    fixed_protocol_packet.write(protocol_out)
+    return transport_out.getvalue()
+
+def encode_copy_free(protocol_packet):
+    transport_out = thrift.transport.TTransport.TMemoryBuffer()
+    protocol_out = thrift.protocol.TBinaryProtocol.TBinaryProtocol(transport_out)
+    packet_codec.write_protocol_packet(protocol_packet, protocol_out)
+    return transport_out.getvalue()
+
+def decode(encoded_protocol_packet):
+    protocol_packet = packet_codec.decode_protocol_packet_bytes(encoded_protocol_packet)
+    protocol_packet.validate()
+    packet_codec.fix_prot_packet_after_decode(protocol_packet)
+    return protocol_packet
+
+def make_protocol_packet(content):
+    return encoding.ttypes.ProtocolPacket(
+        header=encoding.ttypes.PacketHeader(
+            major_version=encoding.constants.protocol_major_version,
+            minor_version=encoding.constants.protocol_minor_version,
+            sender=0xffffffff00000001,
+            level=1),
+        content=content)
+
+def make_lie():
+    lie_packet = encoding.ttypes.LIEPacket(
+        name="if1",
+        local_id=1,
+        flood_port=912,
+        link_mtu_size=1400,
+        neighbor=encoding.ttypes.Neighbor(originator=0xffffffff00000002, remote_id=2),
+        pod=0,
+        node_capabilities=encoding.ttypes.NodeCapabilities(
+            flood_reduction=True,
+            hierarchy_indications=common.ttypes.HierarchyIndications.leaf_only),
+        holdtime=3,
+        not_a_ztp_offer=False,
+        you_are_flood_repeater=True)
+    return make_protocol_packet(encoding.ttypes.PacketContent(lie=lie_packet))
+
+def make_tide(nr_headers):
+    tide_packet = packet_common.make_tide_packet(
+        start_range=packet_common.make_tie_id(common.ttypes.TieDirectionType.South, 0,
+                                              common.ttypes.TIETypeType.NodeTIEType, 0),
+        end_range=packet_common.make_tie_id(common.ttypes.TieDirectionType.North,
+                                            packet_codec.MAX_U64,
+                                            common.ttypes.TIETypeType.KeyValueTIEType,
+                                            packet_codec.MAX_U32))
+    for index in range(nr_headers):
+        tie_header = packet_common.make_tie_header_with_lifetime(
+            common.ttypes.TieDirectionType.South, 0xffffffff00000000 + index,
+            common.ttypes.TIETypeType.PrefixTIEType, 1, 0xfffffff0 + index % 16, 600)
+        packet_common.add_tie_header_to_tide(tide_packet, tie_header)
+    return make_protocol_packet(encoding.ttypes.PacketContent(tide=tide_packet))
+
+def make_node_tie(nr_neighbors):
+    tie_packet = packet_common.make_node_tie_packet(
+        name="node", level=1, direction=common.ttypes.TieDirectionType.North,
+        originator=0xffffffff00000001, tie_nr=1, seq_nr=0xffffff00)
+    for index in range(nr_neighbors):
+        neighbor = encoding.ttypes.NodeNeighborsTIEElement(
+            level=2,
+            cost=1,
+            link_ids=set([encoding.ttypes.LinkIDPair(local_id=index + 1,
+                                                     remote_id=0xffff0000 + index)]),
+            bandwidth=100)
+        tie_packet.element.node.neighbors[0xffffffff00001000 + index] = neighbor
+    return make_protocol_packet(encoding.ttypes.PacketContent(tie=tie_packet))
+
+def make_prefix_tie(nr_prefixes):
+    tie_packet = packet_common.make_prefix_tie_packet(
+        direction=common.ttypes.TieDirectionType.South, originator=0xffffffff00000001,
+        tie_nr=2, seq_nr=5)
+    for index in range(nr_prefixes):
+        prefix = packet_common.make_ipv4_prefix("10.{}.{}.0/24".format(index // 256, index % 256))
+        packet_common.add_ipv4_prefix_to_prefix_tie(tie_packet, prefix, 0xfffffff0,
+                                                    tags=set([0xffffffff00000000 + index]))
+    return make_protocol_packet(encoding.ttypes.PacketContent(tie=tie_packet))
+
+def parse_command_line_arguments():
+    parser = argparse.ArgumentParser(description='Protocol packet codec benchmark')
+    parser.add_argument('-n', '--encodes', type=int, default=2000,
+                        help='Number of encodes and decodes of each packet')
+    parser.add_argument('-s', '--size', type=int, default=50,
+                        help='Number of TIDE headers, node TIE neighbors, and prefix TIE prefixes')
+    args = parser.parse_args()
+    return args
+
+def benchmark(function, argument, nr_calls):
+    start = time.perf_counter()
+    for _ in range(nr_calls):
+        function(argument)
+    secs = time.perf_counter() - start
+    return (secs, nr_calls / secs)
+
+def main():
+    args = parse_command_line_arguments()
+    packet_common.add_missing_methods_to_thrift()
+    packets = [
+        ("LIE", make_lie()),
+        ("TIDE", make_tide(args.size)),
+        ("Node TIE", make_node_tie(args.size)),
+        ("Prefix TIE", make_prefix_tie(args.size))
+    ]
+    # (Operation, codec, function, whether the function takes the encoded packet)
+    variants = [
+        ("Encode", "legacy", encode_with_copy_and_fix, False),
+        ("Encode", constants.CODEC_PYTHON, packet_codec.encode_protocol_packet_bytes, False),
+        ("Encode", constants.CODEC_FAST, packet_codec.encode_protocol_packet_bytes, False),
+        ("Decode", constants.CODEC_PYTHON, decode, True),
+        ("Decode", constants.CODEC_FAST, decode, True)
+    ]
+    if not packet_codec.FAST_CODEC_AVAILABLE:
+        print("Thrift C extension not available, skipping fast codec")
+        variants = [variant for variant in variants if variant[1] != constants.CODEC_FAST]
+    print("{:<12} {:<10} {:<8} {:>8} {:>10} {:>12} {:>8}".format(
+        "Packet", "Operation", "Codec", "Bytes", "Secs", "Calls/Sec", "Speedup"))
+    for (packet_name, protocol_packet) in packets:
+        encoded = encode_copy_free(protocol_packet)
+        assert len(encoded) == len(encode_with_copy_and_fix(protocol_packet))
+        baseline_rate = {}
+        for (operation, codec, function, takes_encoded) in variants:
+            if codec in constants.CODECS:
+                packet_codec.select_codec(codec)
+            argument = encoded if takes_encoded else protocol_packet
+            (secs, rate) = benchmark(function, argument, args.encodes)
+            if operation not in baseline_rate:
+                baseline_rate[operation] = rate
+            print("{:<12} {:<10} {:<8} {:>8} {:>10.3f} {:>12.0f} {:>7.2f}x".format(
+                packet_name, operation, codec, len(encoded), secs, rate,
+                rate / baseline_rate[operation]))
+
+if __name__ == "__main__":
+    main()
@@ -1140,13 +1140,24 @@ class Fabric:
                 fatal_error('Could not open output configuration file "{}"'.format(file_name))
 
     def write_config_to_file(self, file, netns):
-        print("shards:", file=file)
-        print("  - id: 0", file=file)
-        print("    nodes:", file=file)
+        # Spread the nodes over the requested number of shards (so that rift --multi-process can
+        # run each shard in its own process); consecutive nodes (e.g. the nodes in a POD) are
+        # kept together in the same shard as much as possible.
+        all_nodes = []
         for pod in self.pods:
-            pod.write_config_to_file(file, netns)
+            all_nodes.extend(pod.nodes)
         for plane in self.planes:
-            plane.write_config_to_file(file, netns)
+            all_nodes.extend(plane.nodes)
+        nr_shards = min(ARGS.shards, len(all_nodes))
+        print("shards:", file=file)
+        current_shard_id = None
+        for index, node in enumerate(all_nodes):
+            shard_id = index * nr_shards // len(all_nodes)
+            if shard_id != current_shard_id:
+                print("  - id: {}".format(shard_id), file=file)
+                print("    nodes:", file=file)
+                current_shard_id = shard_id
+            node.write_config_to_file(file, netns)
 
     def write_netns_configs_and_scripts(self):
         dir_name = getattr(ARGS, 'output-file-or-dir')
@@ -1637,6 +1648,11 @@ def parse_command_line_arguments():
         '-c', '--check',
         action="store_true",
         help='Check running configuration')
+    parser.add_argument(
+        '-s', '--shards',
+        type=int,
+        default=1,
+        help='Number of shards to spread the nodes over')
     args = parser.parse_args()
     return args
 
@@ -1652,6 +1668,8 @@ def main():
     input_file_name = getattr(ARGS, 'input-meta-config-file')
     META_CONFIG = parse_meta_configuration(input_file_name)
     validate_meta_configuration()
+    if ARGS.shards < 1:
+        fatal_error("Number of shards must be at least 1")
     fabric = Fabric()
     if ARGS.check:
         if not ARGS.netns_per_node:
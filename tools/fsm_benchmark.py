@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+# Measure the number of FSM events per second that can be processed, comparing the compiled
+# dispatch table with lazy record formatting against the FSM event processing that was used
+# before. The FSM mimics the LIE FSM of an interface in state THREE_WAY: mostly verbose events
+# (TIMER_TICK, LIE_RECEIVED, SEND_LIE) which don't change the state, and the occasional
+# non-verbose event which does.
+
+# pylint:disable=wrong-import-position
+import sys
+sys.path.append("rift")
+
+import argparse
+import enum
+import logging
+import time
+
+import fsm
+import stats
+
+class LegacyFsmRecord:
+
+    # A copy of the old FSM record, which stores the names of the actions and pushed events
+
+    _next_seq_nr = 1
+
+    def __init__(self, from_state, event, verbose):
+        self.seq_nr = LegacyFsmRecord._next_seq_nr
+        LegacyFsmRecord._next_seq_nr += 1
+        self.time = time.time()
+        self.skipped = 0
+        self.from_state = from_state
+        self.event = event
+        self.verbose = verbose
+        self.actions_and_pushed_events = []
+        self.to_state = None
+        self.implicit = False
+
+    def log_str(self):
+        return ("FSM transition sequence-nr={} from-state={} event={} "
+                "actions-and-pushed-events={} to-state={} implicit={}").format(
+                    self.seq_nr,
+                    fsm._state_to_name(self.from_state),  # pylint:disable=protected-access
+                    fsm._event_to_name(self.event),       # pylint:disable=protected-access
+                    ",".join(self.actions_and_pushed_events),
+                    fsm._state_to_name(self.to_state),    # pylint:disable=protected-access
+                    self.implicit)
+
+class LegacyFsm(fsm.Fsm):
+
+    # A copy of the old event processing: nested transition lookups, a name list per record,
+    # unconditional log formatting, and counter lookups for every event
+
+    # pylint:disable=protected-access
+
+    def info_or_debug(self, debug, msg, *args):
+        if self._log:
+            if debug:
+                self._log.debug("[%s] %s" % (self._log_id, msg), *args)
+            else:
+                self._log.info("[%s] %s" % (self._log_id, msg), *args)
+
+    def push_event(self, event, event_data=None):
+        event_tuple = (self, event, event_data)
+        if self._current_record is not None:
+            self._chained_event_queue.append(event_tuple)
+            self._current_record.actions_and_pushed_events.append(event.name)
+        else:
+            self._event_queue.append(event_tuple)
+            verbose = event in self._definition.verbose_events
+            self.info_or_debug(verbose, "FSM push event, event=%s", event.name)
+
+    def invoke_actions(self, actions, event_data=None):
+        for action in actions:
+            if self._current_record:
+                self._current_record.actions_and_pushed_events.append(
+                    fsm._action_to_name(action))
+            if event_data:
+                action(self._action_handler, event_data)
+            else:
+                action(self._action_handler)
+
+    def store_current_record(self):
+        record = self._current_record
+        self._verbose_records.appendleft(record)
+        if record.verbose:
+            self._verbose_records_skipped += 1
+        else:
+            record.skipped = self._verbose_records_skipped
+            self._verbose_records_skipped = 0
+            self._records.appendleft(record)
+        self.info_or_debug(record.verbose, record.log_str())
+        to_state = record.to_state
+        if to_state is None:
+            to_state = record.from_state
+        pair = (record.from_state, to_state)
+        if pair not in self._transition_counters:
+            self._transition_counters[pair] = stats.Counter(self._stats_group,
+                                                            "Transitions " + str(pair),
+                                                            "Transition")
+        self._transition_counters[pair].increase()
+        triple = (record.from_state, record.event, to_state)
+        if triple not in self._event_transition_counters:
+            self._event_transition_counters[triple] = stats.Counter(self._stats_group,
+                                                                    "Event-Transitions " +
+                                                                    str(triple),
+                                                                    "Transition")
+        self._event_transition_counters[triple].increase()
+        self._current_record = None
+
+    def process_event(self, event, event_data):
+        self._event_counters[event].increase()
+        from_state = self._state
+        verbose = event in self._definition.verbose_events
+        self._current_record = LegacyFsmRecord(from_state, event, verbose)
+        if from_state in self._transitions:
+            from_state_transitions = self._transitions[from_state]
+        else:
+            from_state_transitions = []
+        if event in from_state_transitions:
+            transition = from_state_transitions[event]
+            (to_state, actions, push_events) = fsm.FsmDefinition.parse_transition(transition)
+            self.invoke_actions(actions, event_data)
+            for push_event in push_events:
+                self.push_event(push_event, None)
+            if to_state is not None:
+                self._current_record.to_state = to_state
+                if to_state != self._state:
+                    self.invoke_state_exit_actions(self._state)
+                    self._state = to_state
+                    self.invoke_state_entry_actions(to_state)
+        else:
+            self._current_record.implicit = True
+        self.store_current_record()
+
+class BenchmarkInterface:
+
+    class State(enum.Enum):
+        ONE_WAY = 1
+        THREE_WAY = 2
+
+    class Event(enum.Enum):
+        TIMER_TICK = 1
+        LIE_RECEIVED = 2
+        SEND_LIE = 3
+        FLAP = 4
+
+    verbose_events = [Event.TIMER_TICK, Event.LIE_RECEIVED, Event.SEND_LIE]
+
+    def action_check_hold_time_expired(self):
+        pass
+
+    def action_process_lie(self, _event_data):
+        pass
+
+    def action_send_lie(self):
+        pass
+
+    def action_cleanup(self):
+        pass
+
+    _transitions = {
+        State.ONE_WAY: {
+            Event.TIMER_TICK: (None, [], [Event.SEND_LIE]),
+            Event.LIE_RECEIVED: (None, [action_process_lie]),
+            Event.SEND_LIE: (None, [action_send_lie]),
+            Event.FLAP: (State.THREE_WAY, [])
+        },
+        State.THREE_WAY: {
+            Event.TIMER_TICK: (None, [action_check_hold_time_expired], [Event.SEND_LIE]),
+            Event.LIE_RECEIVED: (None, [action_process_lie]),
+            Event.SEND_LIE: (None, [action_send_lie]),
+            Event.FLAP: (State.ONE_WAY, [])
+        }
+    }
+
+    _state_actions = {
+        State.ONE_WAY: ([action_cleanup, action_send_lie], [])
+    }
+
+    fsm_definition = fsm.FsmDefinition(
+        state_enum=State,
+        event_enum=Event,
+        transitions=_transitions,
+        initial_state=State.THREE_WAY,
+        state_actions=_state_actions,
+        verbose_events=verbose_events)
+
+def parse_command_line_arguments():
+    parser = argparse.ArgumentParser(description='FSM event processing benchmark')
+    parser.add_argument('-e', '--events', type=int, default=200000,
+                        help='Number of pushed events')
+    parser.add_argument('-f', '--flap-every', type=int, default=100,
+                        help='Push a (non-verbose) state changing event every N events')
+    args = parser.parse_args()
+    return args
+
+def benchmark(name, fsm_class, log, args):
+    interface = BenchmarkInterface()
+    fsm_instance = fsm_class(BenchmarkInterface.fsm_definition, interface, log, "if1")
+    fsm_instance.start()
+    events = [BenchmarkInterface.Event.TIMER_TICK, BenchmarkInterface.Event.LIE_RECEIVED]
+    nr_events = 0
+    start = time.perf_counter()
+    for count in range(args.events):
+        if count % args.flap_every == 0:
+            fsm_instance.push_event(BenchmarkInterface.Event.FLAP)
+            nr_events += 1
+        else:
+            event = events[count % 2]
+            if event == BenchmarkInterface.Event.TIMER_TICK:
+                # Each TIMER_TICK pushes a chained SEND_LIE event
+                fsm_instance.push_event(event)
+                nr_events += 2
+            else:
+                fsm_instance.push_event(event, "lie")
+                nr_events += 1
+        fsm.Fsm.process_queued_events()
+    secs = time.perf_counter() - start
+    print("{:<10} {:<8} {:>12} {:>10.3f} {:>14.0f}".format(
+        name, logging.getLevelName(log.level), nr_events, secs, nr_events / secs))
+
+def main():
+    args = parse_command_line_arguments()
+    # Log to a handler which discards the messages, so that only the cost of creating the log
+    # records is measured
+    log = logging.getLogger("fsm_benchmark")
+    log.addHandler(logging.NullHandler())
+    log.propagate = False
+    print("{:<10} {:<8} {:>12} {:>10} {:>14}".format(
+        "FSM", "Log", "Events", "Secs", "Events/Sec"))
+    for level in [logging.INFO, logging.DEBUG, logging.WARNING]:
+        log.setLevel(level)
+        benchmark("Legacy", LegacyFsm, log, args)
+        benchmark("Compiled", fsm.Fsm, log, args)
+
+if __name__ == "__main__":
+    main()
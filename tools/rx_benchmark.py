@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+# Compare the memory allocations and the speed of the receive path before and after zero-copy
+# decoding. Before, each received message was copied out of the receive buffer into a bytes object,
+# and decoding the message copied every header, fingerprint, and the encoded protocol packet out of
+# that bytes object once more. Now, the message is decoded straight from a memoryview into the
+# receive buffer, and the buffers are only copied when a TIE is stored in the TIE-DB. The
+# allocations are measured with tracemalloc.
+
+# pylint:disable=wrong-import-position
+import sys
+sys.path.append("rift")
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+import common.ttypes
+import encoding.constants
+import encoding.ttypes
+import packet_common
+
+def make_protocol_packet(content):
+    return encoding.ttypes.ProtocolPacket(
+        header=encoding.ttypes.PacketHeader(
+            major_version=encoding.constants.protocol_major_version,
+            minor_version=encoding.constants.protocol_minor_version,
+            sender=0xffffffff00000001,
+            level=1),
+        content=content)
+
+def make_lie_message():
+    lie_packet = encoding.ttypes.LIEPacket(
+        name="if1",
+        local_id=1,
+        flood_port=912,
+        link_mtu_size=1400,
+        neighbor=encoding.ttypes.Neighbor(originator=0xffffffff00000002, remote_id=2),
+        pod=0,
+        holdtime=3)
+    protocol_packet = make_protocol_packet(encoding.ttypes.PacketContent(lie=lie_packet))
+    return encode_message(protocol_packet, None)
+
+def make_prefix_tie_message(nr_prefixes):
+    tie_packet = packet_common.make_prefix_tie_packet(
+        direction=common.ttypes.TieDirectionType.South, originator=0xffffffff00000001,
+        tie_nr=2, seq_nr=5)
+    for index in range(nr_prefixes):
+        prefix = packet_common.make_ipv4_prefix("10.{}.{}.0/24".format(index // 256, index % 256))
+        packet_common.add_ipv4_prefix_to_prefix_tie(tie_packet, prefix, 1)
+    protocol_packet = make_protocol_packet(encoding.ttypes.PacketContent(tie=tie_packet))
+    return encode_message(protocol_packet, 600)
+
+def encode_message(protocol_packet, lifetime):
+    packet_info = packet_common.encode_protocol_packet(protocol_packet, None)
+    packet_info.update_env_header(1)
+    packet_info.update_outer_sec_env_header(None, 111, 222, lifetime)
+    return b''.join(packet_info.message_parts())
+
+def receive_copy(rx_view, nbytes):
+    message = bytes(rx_view[:nbytes])
+    return packet_common.decode_message(None, None, message, None, None, None, None)
+
+def receive_zero_copy(rx_view, nbytes):
+    return packet_common.decode_message(None, None, rx_view[:nbytes], None, None, None, None)
+
+def receive_zero_copy_and_store(rx_view, nbytes):
+    packet_info = receive_zero_copy(rx_view, nbytes)
+    packet_info.own_buffers()
+    return packet_info
+
+def parse_command_line_arguments():
+    parser = argparse.ArgumentParser(description='Receive path allocation benchmark')
+    parser.add_argument('-n', '--packets', type=int, default=2000,
+                        help='Number of packets received for each variant')
+    parser.add_argument('-s', '--size', type=int, default=200,
+                        help='Number of prefixes in the prefix TIE')
+    args = parser.parse_args()
+    return args
+
+def measure_allocations(function, rx_view, nbytes, nr_packets):
+    # Returns the number of memory blocks and bytes per packet which are held by the packet info,
+    # not counting the decoded protocol packet itself (which is the same for all variants), and the
+    # peak number of bytes per packet which are allocated while receiving and decoding the packet.
+    packet_infos = []
+    total_peak = 0
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(nr_packets):
+        (current, _peak) = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        packet_info = function(rx_view, nbytes)
+        (_current, peak) = tracemalloc.get_traced_memory()
+        total_peak += peak - current
+        packet_info.protocol_packet = None
+        packet_infos.append(packet_info)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    # Don't count the list holding on to the packet infos
+    blocks -= 1
+    size -= sys.getsizeof(packet_infos)
+    return (blocks / nr_packets, size / nr_packets, total_peak / nr_packets)
+
+def measure_time(function, rx_view, nbytes, nr_packets):
+    gc.collect()
+    start = time.perf_counter()
+    for _ in range(nr_packets):
+        function(rx_view, nbytes)
+    secs = time.perf_counter() - start
+    return nr_packets / secs
+
+def main():
+    args = parse_command_line_arguments()
+    packet_common.add_missing_methods_to_thrift()
+    messages = [
+        ("LIE", make_lie_message()),
+        ("Prefix TIE", make_prefix_tie_message(args.size))
+    ]
+    variants = [
+        ("copy", receive_copy),
+        ("zero-copy", receive_zero_copy),
+        ("zero-copy+store", receive_zero_copy_and_store)
+    ]
+    rx_buffer = bytearray(65535)
+    rx_view = memoryview(rx_buffer)
+    print("{:<12} {:<16} {:>8} {:>12} {:>12} {:>12} {:>12}".format(
+        "Packet", "Receive", "Bytes", "Blocks/Pkt", "Bytes/Pkt", "Peak/Pkt", "Pkts/Sec"))
+    for (packet_name, message) in messages:
+        nbytes = len(message)
+        rx_buffer[:nbytes] = message
+        for (variant_name, function) in variants:
+            rate = measure_time(function, rx_view, nbytes, args.packets)
+            (blocks, size, peak) = measure_allocations(function, rx_view, nbytes, args.packets)
+            print("{:<12} {:<16} {:>8} {:>12.1f} {:>12.0f} {:>12.0f} {:>12.0f}".format(
+                packet_name, variant_name, nbytes, blocks, size, peak, rate))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+# Measure the per-iteration cost of the scheduler event loop as the number of registered file
+# descriptors grows, and compare it with the select.select based loop that was used before.
+
+# pylint:disable=wrong-import-position
+import sys
+sys.path.append("rift")
+
+import argparse
+import resource
+import select
+import socket
+import time
+
+import scheduler
+import timer
+
+DEFAULT_FD_COUNTS = [10, 100, 500, 1000, 2000, 5000]
+
+# select.select cannot deal with file descriptors larger than or equal to FD_SETSIZE
+FD_SETSIZE = 1024
+
+class BenchmarkHandler:
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def rx_fd(self):
+        return self.sock.fileno()
+
+    def ready_to_read(self):
+        self.sock.recv(100)
+
+class ListScheduler:
+
+    # A minimal copy of the old list + select.select based loop, used as the baseline
+
+    def __init__(self):
+        self._handlers_by_rx_fd = {}
+        self._rx_fds = []
+
+    def register_handler(self, handler):
+        rx_fd = handler.rx_fd()
+        self._handlers_by_rx_fd[rx_fd] = handler
+        self._rx_fds.append(rx_fd)
+
+    def unregister_handler(self, handler):
+        rx_fd = handler.rx_fd()
+        del self._handlers_by_rx_fd[rx_fd]
+        self._rx_fds.remove(rx_fd)
+
+    def run_one_iteration(self):
+        timeout = timer.TIMER_SCHEDULER.trigger_all_expired_timers()
+        rx_ready, _, _ = select.select(self._rx_fds, [], [], timeout)
+        for rx_fd in rx_ready:
+            self._handlers_by_rx_fd[rx_fd].ready_to_read()
+
+def parse_command_line_arguments():
+    parser = argparse.ArgumentParser(description='Scheduler event loop benchmark')
+    parser.add_argument('-i', '--iterations', type=int, default=2000,
+                        help='Number of loop iterations per measurement')
+    parser.add_argument('fd_counts', nargs='*', type=int, default=DEFAULT_FD_COUNTS,
+                        help='Numbers of registered file descriptors to measure')
+    args = parser.parse_args()
+    return args
+
+def raise_fd_limit(needed):
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        new_soft = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+
+def measure(sched, register, unregister, handlers, iterations):
+    # Cost of registering and unregistering every handler (O(n) per call for the list baseline)
+    start = time.perf_counter()
+    for handler in handlers:
+        register(handler)
+    register_secs = time.perf_counter() - start
+    # Cost of one loop iteration with a single ready file descriptor
+    (ready_sock, peer_sock) = socket.socketpair()
+    ready_handler = BenchmarkHandler(ready_sock)
+    register(ready_handler)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        peer_sock.send(b"x")
+        sched.run_one_iteration()
+    iteration_secs = (time.perf_counter() - start) / iterations
+    unregister(ready_handler)
+    ready_sock.close()
+    peer_sock.close()
+    start = time.perf_counter()
+    for handler in reversed(handlers):
+        unregister(handler)
+    unregister_secs = time.perf_counter() - start
+    return (register_secs + unregister_secs) / len(handlers), iteration_secs
+
+def benchmark(nr_fds, iterations):
+    socks = []
+    for _ in range(nr_fds // 2 + 1):
+        socks.extend(socket.socketpair())
+    socks = socks[:nr_fds]
+    handlers = [BenchmarkHandler(sock) for sock in socks]
+    sched = scheduler.Scheduler()
+    new_reg, new_iter = measure(sched,
+                                lambda handler: sched.register_handler(handler, True, False),
+                                sched.unregister_handler,
+                                handlers,
+                                iterations)
+    max_fd = max(sock.fileno() for sock in socks) + 2
+    if max_fd < FD_SETSIZE:
+        list_sched = ListScheduler()
+        old_reg, old_iter = measure(list_sched,
+                                    list_sched.register_handler,
+                                    list_sched.unregister_handler,
+                                    handlers,
+                                    iterations)
+        old_reg_str = "{:.2f}".format(old_reg * 1e6)
+        old_iter_str = "{:.2f}".format(old_iter * 1e6)
+    else:
+        old_reg_str = "n/a"
+        old_iter_str = "FD_SETSIZE"
+    for sock in socks:
+        sock.close()
+    print("{:>8} {:>16} {:>16} {:>16} {:>16}".format(
+        nr_fds, old_iter_str, "{:.2f}".format(new_iter * 1e6),
+        old_reg_str, "{:.2f}".format(new_reg * 1e6)))
+
+def main():
+    args = parse_command_line_arguments()
+    raise_fd_limit(max(args.fd_counts) + 100)
+    print("{:>8} {:>16} {:>16} {:>16} {:>16}".format(
+        "FDs", "select iter us", "selector iter us", "list (un)reg us", "dict (un)reg us"))
+    for nr_fds in args.fd_counts:
+        benchmark(nr_fds, args.iterations)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+# Measure the memory footprint of a large TIE-DB, in bytes per TIE, for different representations
+# of the stored TIEs: a PacketInfo with a fully decoded TIE (as stored today), a PacketInfo with a
+# lazily decoded TIE element (the --lazy-tie-decode option), and a compact TieRecord (a candidate
+# representation which is defined below; the node does not use it). A synthetic TIE-DB with the
+# requested number of prefix TIEs is loaded by decoding a received message for each TIE, and the
+# memory which is still allocated once the TIE-DB has been loaded is measured with tracemalloc. The
+# messages themselves are not counted.
+
+# pylint:disable=wrong-import-position
+import sys
+sys.path.append("rift")
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+import common.ttypes
+import encoding.constants
+import encoding.ttypes
+import packet_codec
+import packet_common
+import tie_db
+
+class TieRecord(packet_common.TieLifetime):
+
+    # A compact representation of a stored TIE, with __slots__ instead of a per-instance __dict__.
+    # It only keeps the encoded protocol packet, the origin security envelope header, the TIE
+    # header packed into a tuple of integers, and the remaining lifetime (kept by the TieLifetime
+    # base class). The TIE itself would have to be decoded whenever it is needed.
+
+    __slots__ = ["encoded_protocol_packet", "origin_sec_env_header", "header_tup"]
+
+    def __init__(self, tie_packet_info):
+        super().__init__(tie_packet_info.remaining_tie_lifetime)
+        self.encoded_protocol_packet = bytes(tie_packet_info.encoded_protocol_packet)
+        if tie_packet_info.origin_sec_env_header is None:
+            self.origin_sec_env_header = None
+        else:
+            self.origin_sec_env_header = bytes(tie_packet_info.origin_sec_env_header)
+        tie_header = tie_packet_info.protocol_packet.content.tie.header
+        tie_id = tie_header.tieid
+        origination_time = tie_header.origination_time
+        if origination_time is None:
+            (as_sec, as_nsec) = (None, None)
+        else:
+            (as_sec, as_nsec) = (origination_time.AS_sec, origination_time.AS_nsec)
+        self.header_tup = (tie_id.direction, tie_id.originator, tie_id.tietype, tie_id.tie_nr,
+                           tie_header.seq_nr, as_sec, as_nsec, tie_header.origination_lifetime)
+
+    def tie_id(self):
+        (direction, originator, tietype, tie_nr) = self.header_tup[0:4]
+        return packet_common.make_tie_id(direction, originator, tietype, tie_nr)
+
+def parse_command_line_arguments():
+    parser = argparse.ArgumentParser(description='TIE-DB memory benchmark')
+    parser.add_argument('-n', '--ties', type=int, default=100000,
+                        help='Number of TIEs in the TIE-DB')
+    parser.add_argument('-p', '--prefixes', type=int, default=4,
+                        help='Number of prefixes in each prefix TIE')
+    args = parser.parse_args()
+    return args
+
+def make_tie_message(tie_index, nr_prefixes):
+    originator = 1000 + tie_index // 10
+    tie_packet = packet_common.make_prefix_tie_packet(
+        direction=common.ttypes.TieDirectionType.South, originator=originator,
+        tie_nr=tie_index % 10 + 1, seq_nr=5)
+    for prefix_index in range(nr_prefixes):
+        prefix_nr = tie_index * nr_prefixes + prefix_index
+        prefix = packet_common.make_ipv4_prefix("{}.{}.{}.0/24".format(
+            10 + prefix_nr // 65536, (prefix_nr // 256) % 256, prefix_nr % 256))
+        packet_common.add_ipv4_prefix_to_prefix_tie(tie_packet, prefix, 1)
+    protocol_packet = encoding.ttypes.ProtocolPacket(
+        header=encoding.ttypes.PacketHeader(
+            major_version=encoding.constants.protocol_major_version,
+            minor_version=encoding.constants.protocol_minor_version,
+            sender=originator,
+            level=1),
+        content=encoding.ttypes.PacketContent(tie=tie_packet))
+    packet_info = packet_common.encode_protocol_packet(protocol_packet, None)
+    packet_info.update_env_header(1)
+    packet_info.update_outer_sec_env_header(None, 111, 222, 600)
+    return b''.join(packet_info.message_parts())
+
+def receive_tie(message):
+    packet_info = packet_common.decode_message(None, None, message, None, None, None, None)
+    assert not packet_info.error
+    packet_info.own_buffers()
+    return packet_info
+
+def load_packet_infos(messages):
+    packet_codec.set_lazy_tie_decode(False)
+    db = tie_db.TieDb()
+    for message in messages:
+        packet_info = receive_tie(message)
+        db.store(packet_info.protocol_packet.content.tie.header.tieid, packet_info)
+    return db
+
+def load_lazy_packet_infos(messages):
+    packet_codec.set_lazy_tie_decode(True)
+    db = tie_db.TieDb()
+    for message in messages:
+        packet_info = receive_tie(message)
+        db.store(packet_info.protocol_packet.content.tie.header.tieid, packet_info)
+    packet_codec.set_lazy_tie_decode(False)
+    return db
+
+def load_tie_records(messages):
+    packet_codec.set_lazy_tie_decode(True)
+    db = tie_db.TieDb()
+    for message in messages:
+        record = TieRecord(receive_tie(message))
+        db.store(record.tie_id(), record)
+    packet_codec.set_lazy_tie_decode(False)
+    return db
+
+def measure(load_function, messages):
+    # Returns the number of memory blocks and bytes per TIE which are held by the TIE-DB, and the
+    # time it took to load the TIE-DB
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    db = load_function(messages)
+    secs = time.perf_counter() - start
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    nr_ties = len(db)
+    del db
+    return (blocks / nr_ties, size / nr_ties, secs)
+
+def main():
+    args = parse_command_line_arguments()
+    packet_common.add_missing_methods_to_thrift()
+    messages = [make_tie_message(tie_index, args.prefixes) for tie_index in range(args.ties)]
+    message_bytes = sum(len(message) for message in messages) / len(messages)
+    print("{} TIEs with {} prefixes each, {:.0f} bytes per TIE message".format(
+        args.ties, args.prefixes, message_bytes))
+    variants = [
+        ("PacketInfo", load_packet_infos),
+        ("PacketInfo (lazy)", load_lazy_packet_infos),
+        ("TieRecord", load_tie_records)
+    ]
+    print("{:<20} {:>12} {:>12} {:>12}".format("Representation", "Blocks/TIE", "Bytes/TIE",
+                                               "Load Secs"))
+    for (variant_name, load_function) in variants:
+        (blocks, size, secs) = measure(load_function, messages)
+        print("{:<20} {:>12.1f} {:>12.0f} {:>12.2f}".format(variant_name, blocks, size, secs))
+
+if __name__ == "__main__":
+    main()
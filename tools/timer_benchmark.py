@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+# Compare the timer wheel based timer scheduler with the SortedDict based timer scheduler that
+# was used before, using a large number of concurrent periodic timers. Both schedulers run on a
+# simulated clock, so that the results only reflect the cost of managing the timers.
+
+# pylint:disable=wrong-import-position
+import sys
+sys.path.append("rift")
+
+import argparse
+import random
+import time
+
+import sortedcontainers
+
+import timer
+
+class SortedDictTimerScheduler:
+
+    # A copy of the old SortedDict based timer scheduler, used as the baseline
+
+    def __init__(self):
+        self._timers_by_expire_time = sortedcontainers.SortedDict()
+        self.simulated_now = 0.0
+
+    def now(self):
+        return self.simulated_now
+
+    def schedule(self, tmr):
+        expire_time = tmr.expire_time()
+        if expire_time in self._timers_by_expire_time:
+            self._timers_by_expire_time[expire_time].append(tmr)
+        else:
+            self._timers_by_expire_time[expire_time] = [tmr]
+
+    def unschedule(self, tmr):
+        expire_time = tmr.expire_time()
+        timers_with_matching_expire = self._timers_by_expire_time[expire_time]
+        timers_with_matching_expire.remove(tmr)
+        if timers_with_matching_expire == []:
+            self._timers_by_expire_time.pop(expire_time)
+
+    def trigger_all_expired_timers(self):
+        now = self.now()
+        while True:
+            if not self._timers_by_expire_time:
+                return None
+            next_expire_time = self._timers_by_expire_time.peekitem(0)[0]
+            if next_expire_time > now:
+                return next_expire_time - now
+            expired_timers = self._timers_by_expire_time.popitem(0)[1]
+            for tmr in expired_timers:
+                tmr.trigger_expire()
+
+class WheelTimerScheduler(timer.TimerScheduler):
+
+    def __init__(self):
+        timer.TimerScheduler.__init__(self)
+        self.simulated_now = 0.0
+
+    def now(self):
+        return self.simulated_now
+
+def parse_command_line_arguments():
+    parser = argparse.ArgumentParser(description='Timer scheduler benchmark')
+    parser.add_argument('-t', '--timers', type=int, default=10000,
+                        help='Number of concurrent periodic timers')
+    parser.add_argument('-s', '--seconds', type=float, default=10.0,
+                        help='Simulated run time in seconds')
+    parser.add_argument('-r', '--restarts', type=int, default=100000,
+                        help='Number of timer restarts (stop + start)')
+    args = parser.parse_args()
+    return args
+
+def benchmark(name, sched, args):
+    rand = random.Random(1)
+    expire_count = [0]
+    def expire():
+        expire_count[0] += 1
+    results = []
+    # Start the timers; intervals are spread a bit, as with LIE, service queues, and TIDE timers
+    start = time.perf_counter()
+    timers = []
+    for _ in range(args.timers):
+        sched.simulated_now = rand.uniform(0.0, 1.0)
+        timers.append(timer.Timer(interval=rand.choice([1.0, 1.0, 1.0, 2.0]),
+                                  expire_function=expire,
+                                  scheduler=sched))
+    results.append(time.perf_counter() - start)
+    # Run the simulated event loop, waking up when the next timer expires
+    sched.simulated_now = 1.0
+    end_time = 1.0 + args.seconds
+    start = time.perf_counter()
+    nr_wakeups = 0
+    while sched.simulated_now < end_time:
+        timeout = sched.trigger_all_expired_timers()
+        nr_wakeups += 1
+        sched.simulated_now += max(timeout, timer.TimerScheduler.TICK_SECS)
+    results.append(time.perf_counter() - start)
+    # Restart random timers (e.g. hold timers that are restarted when a packet is received)
+    start = time.perf_counter()
+    for _ in range(args.restarts):
+        timers[rand.randrange(args.timers)].start()
+    results.append(time.perf_counter() - start)
+    # Stop all timers
+    start = time.perf_counter()
+    for tmr in timers:
+        tmr.stop()
+    results.append(time.perf_counter() - start)
+    print("{:<12} {:>12.3f} {:>12.3f} {:>12.3f} {:>12.3f} {:>12} {:>10}".format(
+        name, *results, expire_count[0], nr_wakeups))
+
+def main():
+    args = parse_command_line_arguments()
+    print("{} periodic timers, {} simulated seconds, {} restarts".format(
+        args.timers, args.seconds, args.restarts))
+    print("{:<12} {:>12} {:>12} {:>12} {:>12} {:>12} {:>10}".format(
+        "Scheduler", "Start secs", "Run secs", "Restart secs", "Stop secs", "Expires", "Wakeups"))
+    benchmark("SortedDict", SortedDictTimerScheduler(), args)
+    benchmark("Wheel", WheelTimerScheduler(), args)
+
+if __name__ == "__main__":
+    main()